@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import insert
+
+from . import counters, rollups
+from .database import AsyncSessionLocal
+from .filecache import FileMeta
+from .geo import geo
+from .models import FileAccess
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 500          # сбрасывать не реже, чем каждые N событий
+FLUSH_INTERVAL = 0.5      # ... или каждые M секунд
+MAX_QUEUE = 20_000        # верхняя граница памяти под несброшенные события
+ENQUEUE_TIMEOUT = 0.05    # сколько хендлер готов ждать места в очереди
+FLUSH_RETRIES = 3         # повторы записи пачки (например, database is locked) ...
+RETRY_BACKOFF = 0.5       # ... с паузой 0.5, 1, 2 с; после этого пачка считается потерянной
+GEO_BUDGET = 1.0          # сколько пачка ждёт геолокацию; кто не успел — пишется без страны
+
+
+@dataclass
+class AccessEvent:
+    file_code: str
+    access_type: str
+    ip_address: str
+    user_agent: str
+    access_time: datetime
+    country: str = ""
+    city: str = ""
+    # файл, к которому обратились — для уведомлений после записи, в БД не пишется
+    file: Optional[FileMeta] = field(default=None, repr=False, compare=False)
+
+    def row(self) -> dict:
+        return {
+            "file_code": self.file_code,
+            "access_type": self.access_type,
+            "ip_address": self.ip_address,
+            "user_agent": self.user_agent,
+            "access_time": self.access_time,
+            "country": self.country,
+            "city": self.city,
+        }
+
+
+FlushListener = Callable[[list[AccessEvent]], Awaitable[None]]
+
+
+class AccessLogWriter:
+    """
+    Write-behind лог обращений: хендлеры кладут событие в очередь, фоновая задача
+    дорезолвивает геолокацию (не дольше geo_budget на пачку), пишет пачками и затем
+    оповещает подписчиков.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 max_queue: int = MAX_QUEUE, enqueue_timeout: float = ENQUEUE_TIMEOUT,
+                 geo_budget: float = GEO_BUDGET):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.geo_budget = geo_budget
+        self._max_queue = max_queue
+        self._queue: asyncio.Queue[AccessEvent] | None = None
+        self._stopping: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._listeners: list[FlushListener] = []
+        self.written = 0
+        self.dropped = 0      # не влезли в очередь
+        self.failed = 0       # не записались в БД и после повторов
+
+    def add_listener(self, listener: FlushListener):
+        self._listeners.append(listener)
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self._max_queue)
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def record(self, event: AccessEvent) -> bool:
+        if self._queue is None or self._stopping.is_set():
+            # writer не запущен (скрипты, тесты) — пишем напрямую
+            await self._flush([event])
+            return True
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            pass
+        # backpressure: даём флашеру немного времени, затем отбрасываем событие
+        try:
+            await asyncio.wait_for(self._queue.put(event), self.enqueue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            return False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch: list[AccessEvent] = []
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0 or self._stopping.is_set():
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            if batch:
+                try:
+                    await self._flush(batch)
+                except Exception:
+                    # флашер не должен умирать: без него лог перестанет писаться до рестарта
+                    log.exception("access log flush crashed")
+
+    async def _flush(self, batch: list[AccessEvent]):
+        try:
+            places = await geo.resolve_many((e.ip_address for e in batch if not e.country),
+                                            timeout=self.geo_budget)
+        except Exception:
+            log.exception("geo lookup failed for %d access events", len(batch))
+            places = {}
+        for e in batch:
+            if not e.country:
+                e.country, e.city = places.get(e.ip_address, ("", ""))
+
+        for attempt in range(FLUSH_RETRIES + 1):
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(insert(FileAccess), [e.row() for e in batch])
+                    await counters.apply(db, batch)
+                    await rollups.apply_access(db, batch)
+                    await db.commit()
+                break
+            except Exception:
+                if attempt == FLUSH_RETRIES:
+                    self.failed += len(batch)
+                    log.exception("giving up on %d access events after %d attempts", len(batch), attempt + 1)
+                    return
+                log.warning("failed to flush %d access events, retrying", len(batch), exc_info=True)
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+        self.written += len(batch)
+
+        for listener in self._listeners:
+            try:
+                await listener(batch)
+            except Exception:
+                log.exception("access log listener failed")
+
+
+access_log = AccessLogWriter()
@@ -0,0 +1,311 @@
+"""
+Холодный архив лога обращений.
+
+file_access — «горячая» часть лога. Месяцы, закончившиеся раньше чем ARCHIVE_AFTER_DAYS
+назад, фоновая задача (только в держателе лизы, см. api/main.py) сжимает в
+api/archive/access-YYYY-MM.csv.gz и удаляет из БД пачками:
+
+- внутри месячного файла лог каждого файла — отдельный gzip-член (склейка членов —
+  обычный gzip, его читает zcat); смещение и длина члена лежат в access_archive_segments,
+  так что чтение лога одного файла — seek и распаковка только его куска;
+- строки члена отсортированы по (access_time, id), колонки — ARCHIVE_COLUMNS;
+- граница горячего и холодного — watermark: until последнего заархивированного
+  месяца. Строки file_access старше него читатели пропускают, поэтому между
+  записью индекса архива и окончанием удаления дублей нет.
+
+admin_logs и выгрузка идут через logs_after/stream_logs: горячая часть из БД,
+холодная — из архивов, с теми же курсорами и фильтрами since/until.
+
+    python -m api.archive --run    # заархивировать всё, что уже можно
+"""
+import asyncio
+import csv
+import io
+import logging
+import os
+import sys
+import time
+import zlib
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import AsyncIterator, Iterator, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import ARCHIVE_AFTER_DAYS
+from . import repository as repo
+from .models import AccessArchive, AccessArchiveSegment, FileAccess
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_DIR = "api/archive"
+ARCHIVE_COLUMNS = ["id", "time", "type", "ip", "country", "city", "user_agent"]
+ACCESS_TYPES = ("visit", "download")
+ARCHIVE_INTERVAL = 60
+DELETE_CHUNK = 1_000        # строк file_access за одну транзакцию
+DELETE_PER_TICK = 50_000
+PAUSE = 0.05
+READ_BATCH = 1_000
+
+os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+# архивная строка с теми же именами полей, что у FileAccess: читателям всё равно, откуда она
+ArchivedAccess = namedtuple("ArchivedAccess", "id access_time access_type ip_address country city user_agent")
+
+
+def _month_start(t: datetime) -> datetime:
+    return t.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(t: datetime) -> datetime:
+    return (_month_start(t) + timedelta(days=32)).replace(day=1)
+
+
+# ================== ЧТЕНИЕ ==================
+def _iter_segment(path: str, offset: int, length: int) -> Iterator[ArchivedAccess]:
+    # распаковываем член потоково: в памяти кусок сжатых данных и хвост незаконченной строки
+    z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    tail = b""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        left = length
+        while left:
+            data = f.read(min(left, 256 * 1024))
+            if not data:
+                raise EOFError(f"{path}: segment at {offset} is truncated")
+            left -= len(data)
+            lines = (tail + z.decompress(data)).split(b"\n")
+            tail = lines.pop()
+            yield from _parse(lines)
+    yield from _parse((tail + z.flush()).split(b"\n"))
+
+
+def _parse(lines: list[bytes]) -> Iterator[ArchivedAccess]:
+    # переводов строки внутри полей нет (см. _row): одна строка CSV — одна строка файла
+    for r in csv.reader(line.decode() for line in lines if line):
+        yield ArchivedAccess(int(r[0]), datetime.fromisoformat(r[1]), r[2], r[3],
+                             r[4] or None, r[5] or None, r[6] or None)
+
+
+async def _batches(seg, since: Optional[datetime], until: Optional[datetime]) -> AsyncIterator[list]:
+    it = _iter_segment(seg.path, seg.offset, seg.length)
+    while True:
+        part = await asyncio.to_thread(lambda: list(islice(it, READ_BATCH)))
+        if not part:
+            return
+        yield [r for r in part if (since is None or r.access_time >= since)
+               and (until is None or r.access_time < until)]
+
+
+async def watermark(db: AsyncSession) -> Optional[datetime]:
+    return (await db.execute(select(func.max(AccessArchive.until)))).scalar_one()
+
+
+async def _segments(db: AsyncSession, file_code: str, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None, newest_first: bool = False) -> list:
+    cond = [AccessArchiveSegment.file_code == file_code]
+    if since:
+        cond.append(AccessArchiveSegment.last_time >= since)
+    if until:
+        cond.append(AccessArchiveSegment.first_time < until)
+    order = AccessArchiveSegment.month.desc() if newest_first else AccessArchiveSegment.month
+    res = await db.execute(
+        select(AccessArchive.path, AccessArchiveSegment.offset, AccessArchiveSegment.length)
+        .join(AccessArchive, AccessArchive.month == AccessArchiveSegment.month)
+        .where(*cond).order_by(order)
+    )
+    return res.all()
+
+
+async def logs_after(db: AsyncSession, file_code: str, after: Optional[tuple[datetime, int]],
+                     limit: int) -> list:
+    """Как repo.access_logs_after, но по всему логу: сначала горячая часть, потом архивы."""
+    wm = await watermark(db)
+    rows = []
+    if wm is None or after is None or after[0] >= wm:
+        rows = await repo.access_logs_after(db, file_code, after, limit, not_before=wm)
+    if len(rows) >= limit or wm is None:
+        return rows
+
+    # нужны месяцы, в которых есть строки раньше курсора: first_time <= after
+    until = after[0] + timedelta(microseconds=1) if after and after[0] < wm else None
+    for seg in await _segments(db, file_code, until=until, newest_first=True):
+        # член упорядочен по возрастанию — от него нужен хвост из limit - len(rows) строк
+        last = deque(maxlen=limit - len(rows))
+        async for part in _batches(seg, None, None):
+            last.extend(r for r in part if after is None or (r.access_time, r.id) < after)
+        rows.extend(reversed(last))
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+async def stream_logs(db: AsyncSession, file_code: str, since: Optional[datetime] = None,
+                      until: Optional[datetime] = None, batch: int = 1000) -> AsyncIterator[list]:
+    """Как repo.stream_access_logs, но по всему логу: архивы по месяцам, затем горячая часть."""
+    wm = await watermark(db)
+    if wm is not None and (since is None or since < wm):
+        for seg in await _segments(db, file_code, since, min(until, wm) if until else wm):
+            async for part in _batches(seg, since, until):
+                if part:
+                    yield part
+    hot_since = max(since, wm) if since and wm else since or wm
+    if until is None or hot_since is None or hot_since < until:
+        async for part in repo.stream_access_logs(db, file_code, hot_since, until, batch=batch):
+            yield part
+
+
+def iter_all(conn: Connection) -> Iterator[ArchivedAccess]:
+    """Все архивные строки подряд — для пересчёта агрегатов (api/rollups.py)."""
+    segments = conn.execute(
+        select(AccessArchive.path, AccessArchiveSegment.offset, AccessArchiveSegment.length)
+        .join(AccessArchive, AccessArchive.month == AccessArchiveSegment.month)
+        .order_by(AccessArchiveSegment.month, AccessArchiveSegment.offset)
+    ).all()
+    for seg in segments:
+        yield from _iter_segment(seg.path, seg.offset, seg.length)
+
+
+# ================== КОМПАКЦИЯ ==================
+def _row(r) -> list:
+    # \r и \n из user_agent убираем: строка CSV должна совпадать со строкой файла (см. _parse)
+    ua = (r.user_agent or "").replace("\r", " ").replace("\n", " ")
+    return [r.id, r.access_time.isoformat(), r.access_type, r.ip_address, r.country or "", r.city or "", ua]
+
+
+def _write_segment(conn: Connection, out, file_code: str, start: datetime, end: datetime) -> dict:
+    seg = {"file_code": file_code, "offset": out.tell(), "rows": 0, "visits": 0, "downloads": 0,
+           "first_time": None, "last_time": None}
+    z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    result = conn.execution_options(yield_per=READ_BATCH).execute(
+        select(FileAccess).where(FileAccess.file_code == file_code,
+                                 FileAccess.access_time >= start, FileAccess.access_time < end)
+        .order_by(FileAccess.access_time, FileAccess.id)
+    )
+    for part in result.partitions():
+        for r in part:
+            writer.writerow(_row(r))
+            seg["rows"] += 1
+            seg["visits"] += r.access_type == "visit"
+            seg["downloads"] += r.access_type == "download"
+            seg["first_time"] = seg["first_time"] or r.access_time
+            seg["last_time"] = r.access_time
+        out.write(z.compress(buf.getvalue().encode()))
+        buf.seek(0)
+        buf.truncate()
+    out.write(z.flush())
+    seg["length"] = out.tell() - seg["offset"]
+    return seg
+
+
+def compact_month(engine: Engine, start: datetime) -> int:
+    """Пишет архив месяца и регистрирует его. Строки из file_access удаляет purge_archived."""
+    end = _next_month(start)
+    month = start.strftime("%Y-%m")
+    path = os.path.join(ARCHIVE_DIR, f"access-{month}.csv.gz")
+    tmp = f"{path}.{os.getpid()}.part"
+
+    with engine.connect() as conn:
+        # одна транзакция чтения — снимок WAL, коды и строки согласованы между собой
+        codes = sorted(conn.execute(
+            select(FileAccess.file_code).distinct()
+            .where(FileAccess.access_type.in_(ACCESS_TYPES), FileAccess.access_time >= start, FileAccess.access_time < end)
+        ).scalars())
+        with open(tmp, "wb") as out:
+            segments = [_write_segment(conn, out, code, start, end) for code in codes]
+            out.flush()
+            os.fsync(out.fileno())
+        conn.rollback()
+    os.replace(tmp, path)
+
+    rows = sum(s["rows"] for s in segments)
+    with engine.begin() as conn:
+        # повторная компакция того же месяца (потеря лизы посреди работы) даёт те же байты
+        conn.execute(insert(AccessArchive).values(
+            month=month, path=path, until=end, rows=rows, bytes=os.path.getsize(path), created_at=datetime.now()
+        ).on_conflict_do_nothing(index_elements=[AccessArchive.month]))
+        for i in range(0, len(segments), 500):
+            conn.execute(insert(AccessArchiveSegment).values([{**s, "month": month} for s in segments[i:i + 500]])
+                         .on_conflict_do_nothing(index_elements=[AccessArchiveSegment.file_code,
+                                                                 AccessArchiveSegment.month]))
+    return rows
+
+
+def purge_archived(engine: Engine, budget: int = DELETE_PER_TICK) -> int:
+    """Удаляет из file_access строки старше watermark — кусками, по ix_file_access_type_time."""
+    deleted = 0
+    with engine.connect() as conn:
+        wm = conn.execute(select(func.max(AccessArchive.until))).scalar_one()
+        if wm is None:
+            return 0
+        for access_type in ACCESS_TYPES:
+            while deleted < budget:
+                chunk = (select(FileAccess.id).where(FileAccess.access_type == access_type,
+                                                     FileAccess.access_time < wm).limit(DELETE_CHUNK))
+                n = conn.execute(delete(FileAccess).where(FileAccess.id.in_(chunk))).rowcount
+                conn.commit()
+                deleted += n
+                if n < DELETE_CHUNK:
+                    break
+                time.sleep(PAUSE)
+    return deleted
+
+
+def _due_month(engine: Engine) -> Optional[datetime]:
+    cutoff = datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    with engine.connect() as conn:
+        wm = conn.execute(select(func.max(AccessArchive.until))).scalar_one()
+        # min по каждому типу — поиск по индексу, а не скан всей таблицы
+        oldest = [
+            conn.execute(select(func.min(FileAccess.access_time)).where(
+                FileAccess.access_type == t, FileAccess.access_time >= (wm or datetime.min)
+            )).scalar_one()
+            for t in ACCESS_TYPES
+        ]
+    oldest = [t for t in oldest if t is not None]
+    if not oldest:
+        return None
+    start = _month_start(min(oldest))
+    return start if _next_month(start) <= cutoff else None
+
+
+def archive_step(engine: Engine) -> tuple[Optional[str], int, int]:
+    """Дочищает уже заархивированное, затем архивирует не больше одного месяца."""
+    deleted = purge_archived(engine)
+    if deleted >= DELETE_PER_TICK:
+        return None, 0, deleted
+    start = _due_month(engine)
+    if start is None:
+        return None, 0, deleted
+    rows = compact_month(engine, start)
+    return start.strftime("%Y-%m"), rows, deleted + purge_archived(engine)
+
+
+async def archive_loop(engine: Engine, interval: float = ARCHIVE_INTERVAL):
+    # синхронный движок в отдельном потоке: сжатие — CPU, а event loop остаётся свободным
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            month, rows, deleted = await asyncio.to_thread(archive_step, engine)
+            if month or deleted:
+                log.info("archive: %s %d rows archived, %d hot rows deleted", month or "-", rows, deleted)
+        except Exception:
+            log.exception("access log archiving failed")
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    if "--run" in sys.argv:
+        while True:
+            month, rows, deleted = archive_step(engine)
+            if not month and not deleted:
+                break
+            print(f"{month or '-'}: archived {rows}, deleted {deleted}")
+        print("archive is up to date")
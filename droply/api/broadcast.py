@@ -0,0 +1,152 @@
+"""
+Рассылки админа как фоновые задания.
+
+Задание — строка broadcast_jobs. Получатели обходятся страницами по возрастанию
+user_id (keyset по ix_files_user_id), внутри страницы сообщения уходят параллельно
+через общий telegram_bucket. После каждой страницы в задание пишется cursor и
+счётчики, так что после падения процесса рассылка продолжается с последней
+сохранённой страницы (повторно получит сообщение максимум одна страница).
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest, TelegramNetworkError
+from sqlalchemy import select, update
+
+from . import metrics, repository as repo
+from .models import BroadcastJob
+from .ratelimit import TokenBucket, telegram_bucket
+
+log = logging.getLogger(__name__)
+
+PAGE_SIZE = 200           # получателей между сохранениями прогресса
+CONCURRENCY = 16          # одновременных send_message — лимит задаёт bucket, это лишь перекрытие RTT
+MAX_ATTEMPTS = 5          # на получателя, с учётом RetryAfter и сетевых ошибок
+POLL_INTERVAL = 5.0
+
+
+class BroadcastRunner:
+    def __init__(self, bucket: TokenBucket = telegram_bucket, page_size: int = PAGE_SIZE,
+                 concurrency: int = CONCURRENCY):
+        self.bucket = bucket
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self._bot: Optional[Bot] = None
+        self._session_factory = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self, bot: Bot, session_factory):
+        self._bot = bot
+        self._session_factory = session_factory
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # незавершённое задание остаётся running и будет подхвачено при следующем старте
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        if self._wake:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                job_id = await self._next_job()
+                if job_id is not None:
+                    await self._run_job(job_id)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("broadcast runner failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _next_job(self) -> Optional[int]:
+        async with self._session_factory() as db:
+            res = await db.execute(
+                select(BroadcastJob.id).where(BroadcastJob.status.in_(("pending", "running")))
+                .order_by(BroadcastJob.id).limit(1)
+            )
+            return res.scalar_one_or_none()
+
+    async def _update(self, job_id: int, **values):
+        async with self._session_factory() as db:
+            await db.execute(update(BroadcastJob).where(BroadcastJob.id == job_id).values(**values))
+            await db.commit()
+
+    async def _run_job(self, job_id: int):
+        async with self._session_factory() as db:
+            job = await db.get(BroadcastJob, job_id)
+            if job.status == "pending":
+                job.status = "running"
+                job.started_at = datetime.now()
+                job.total = await repo.count_user_ids(db)
+                await db.commit()
+            message, cursor = job.message, job.cursor
+
+        try:
+            sem = asyncio.Semaphore(self.concurrency)
+            while True:
+                async with self._session_factory() as db:
+                    ids = await repo.user_ids_after(db, cursor, self.page_size)
+                if not ids:
+                    break
+                results = await asyncio.gather(*(self._send(sem, uid, message) for uid in ids))
+                ok = sum(results)
+                cursor = ids[-1]
+                await self._update(
+                    job_id, cursor=cursor,
+                    sent=BroadcastJob.sent + ok, failed=BroadcastJob.failed + (len(ids) - ok),
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception("broadcast %s failed", job_id)
+            await self._update(job_id, status="failed", error=str(e)[:500], finished_at=datetime.now())
+            return
+
+        await self._update(job_id, status="done", finished_at=datetime.now())
+
+    async def _send(self, sem: asyncio.Semaphore, chat_id: int, text: str) -> bool:
+        async with sem:
+            for attempt in range(MAX_ATTEMPTS):
+                await self.bucket.acquire()
+                started = time.perf_counter()
+                try:
+                    await self._bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+                    metrics.TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started, "broadcast")
+                    return True
+                except TelegramRetryAfter as e:
+                    # flood control распространяется на весь бот — тормозим общий bucket
+                    metrics.TELEGRAM_ERRORS.inc("broadcast", "retry_after")
+                    self.bucket.pause(e.retry_after)
+                except TelegramNetworkError:
+                    metrics.TELEGRAM_ERRORS.inc("broadcast", "network")
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                except (TelegramForbiddenError, TelegramBadRequest) as e:
+                    metrics.TELEGRAM_ERRORS.inc("broadcast", type(e).__name__)
+                    return False   # бот заблокирован / чат недоступен — повтор не поможет
+                except Exception as e:
+                    metrics.TELEGRAM_ERRORS.inc("broadcast", type(e).__name__)
+                    log.debug("broadcast to %s failed", chat_id, exc_info=True)
+                    return False
+            return False
+
+
+broadcaster = BroadcastRunner()
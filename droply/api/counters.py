@@ -0,0 +1,105 @@
+"""
+Предагрегированные счётчики обращений по файлам (file_counters).
+
+Обновляются в той же транзакции, что и пачка file_access (см. access_log), поэтому
+статистика файла читается одной строкой вместо COUNT(*) по логу.
+
+    python -m api.counters --reconcile   # найти и исправить расхождения с логом (file_access и архивы)
+    python -m api.counters --rebuild     # пересчитать всё с нуля
+"""
+import sys
+from collections import defaultdict
+from typing import Iterable
+
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import FileCounter
+
+# горячая часть лога — строки file_access не старше watermark архива, холодная —
+# готовые суммы сегментов access_archive_segments (api/archive.py)
+_AGGREGATE_SQL = """
+    SELECT file_code, SUM(visits) AS visits, SUM(downloads) AS downloads, MAX(last_access) AS last_access
+    FROM (
+        SELECT file_code,
+               SUM(access_type = 'visit') AS visits,
+               SUM(access_type = 'download') AS downloads,
+               MAX(access_time) AS last_access
+        FROM file_access
+        WHERE access_time >= (SELECT COALESCE(MAX(until), '') FROM access_archives) {where}
+        GROUP BY file_code
+        UNION ALL
+        SELECT file_code, visits, downloads, last_time FROM access_archive_segments WHERE 1 {where}
+    )
+    GROUP BY file_code
+"""
+
+
+async def apply(db: AsyncSession, events: Iterable):
+    """Прибавляет пачку событий к счётчикам. Коммит — на вызывающей стороне."""
+    totals: dict[str, list] = defaultdict(lambda: [0, 0, None])
+    for e in events:
+        t = totals[e.file_code]
+        if e.access_type == "visit":
+            t[0] += 1
+        elif e.access_type == "download":
+            t[1] += 1
+        if t[2] is None or e.access_time > t[2]:
+            t[2] = e.access_time
+    if not totals:
+        return
+
+    stmt = insert(FileCounter).values([
+        {"file_code": code, "visits": v, "downloads": d, "last_access": last}
+        for code, (v, d, last) in totals.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[FileCounter.file_code],
+        set_={
+            "visits": FileCounter.visits + stmt.excluded.visits,
+            "downloads": FileCounter.downloads + stmt.excluded.downloads,
+            "last_access": stmt.excluded.last_access,
+        },
+    )
+    await db.execute(stmt)
+
+
+def rebuild(conn: Connection):
+    conn.exec_driver_sql("DELETE FROM file_counters")
+    conn.exec_driver_sql(f"INSERT INTO file_counters (file_code, visits, downloads, last_access) "
+                         f"{_AGGREGATE_SQL.format(where='')}")
+
+
+def reconcile(conn: Connection) -> list[str]:
+    """Пересчитывает только разошедшиеся с логом строки, возвращает их коды."""
+    aggregate = _AGGREGATE_SQL.format(where="")
+    drifted = [row[0] for row in conn.exec_driver_sql(f"""
+        SELECT a.file_code
+        FROM ({aggregate}) a
+        LEFT JOIN file_counters c ON c.file_code = a.file_code
+        WHERE c.file_code IS NULL OR a.visits != c.visits OR a.downloads != c.downloads
+        UNION
+        SELECT c.file_code FROM file_counters c
+        WHERE c.file_code NOT IN (SELECT file_code FROM ({aggregate}))
+    """)]
+    for code in drifted:
+        conn.execute(text("DELETE FROM file_counters WHERE file_code = :c"), {"c": code})
+        conn.execute(text(
+            "INSERT INTO file_counters (file_code, visits, downloads, last_access) "
+            + _AGGREGATE_SQL.format(where="AND file_code = :c")
+        ), {"c": code})
+    return drifted
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    with engine.begin() as conn:
+        if "--rebuild" in sys.argv:
+            rebuild(conn)
+            print("file_counters rebuilt")
+        else:
+            drifted = reconcile(conn)
+            print(f"reconciled {len(drifted)} files" + (f": {', '.join(drifted)}" if drifted else ""))
@@ -1,19 +1,37 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from .models import Base
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///./droply.db"
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base.metadata.create_all(bind=engine)
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from .models import Base
+from .migrations import upgrade
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./droply.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./droply.db"
+
+# синхронный движок — только для создания схемы и служебных скриптов
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL: чтения не ждут писателя, synchronous=NORMAL — без fsync на каждый коммит
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.close()
+
+
+event.listen(engine, "connect", _sqlite_pragmas)
+event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+
+Base.metadata.create_all(bind=engine)
+upgrade(engine)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
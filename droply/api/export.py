@@ -0,0 +1,82 @@
+"""
+Потоковая выгрузка лога обращений: CSV или NDJSON, опционально gzip.
+
+Строки читаются пачками — из архивов и из БД (archive.stream_logs, yield_per), каждая
+пачка сразу кодируется и уходит клиенту — память не зависит от размера лога.
+Сессия открывается внутри генератора: StreamingResponse дочитывает его уже после
+выхода из обработчика.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from . import archive
+from .database import AsyncSessionLocal
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+HEADER = ["time", "type", "ip", "country", "city", "user_agent"]
+BATCH = 1000
+
+
+async def _batches(file_code: str, since: Optional[datetime], until: Optional[datetime]):
+    async with AsyncSessionLocal() as db:
+        async for part in archive.stream_logs(db, file_code, since, until, batch=BATCH):
+            yield part
+
+
+async def csv_chunks(file_code: str, since: Optional[datetime] = None,
+                     until: Optional[datetime] = None) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(HEADER)
+    async for part in _batches(file_code, since, until):
+        for r in part:
+            writer.writerow([r.access_time.isoformat(), r.access_type, r.ip_address,
+                             r.country or "", r.city or "", r.user_agent or ""])
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()   # только заголовок — лог пуст
+
+
+async def ndjson_chunks(file_code: str, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None) -> AsyncIterator[bytes]:
+    async for part in _batches(file_code, since, until):
+        yield "".join(
+            json.dumps({
+                "time": r.access_time.isoformat(),
+                "type": r.access_type,
+                "ip": r.ip_address,
+                "country": r.country or "",
+                "city": r.city or "",
+                "user_agent": r.user_agent or "",
+            }, ensure_ascii=False) + "\n"
+            for r in part
+        ).encode()
+
+
+async def gzipped(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)   # 16+ — gzip-обёртка
+    async for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def access_log_export(file_code: str, fmt: str = "csv", gzip: bool = False,
+                      since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Возвращает (поток байт, media type, имя файла)."""
+    media_type, ext = FORMATS[fmt]
+    chunks = csv_chunks(file_code, since, until) if fmt == "csv" else ndjson_chunks(file_code, since, until)
+    filename = f"logs_{file_code}.{ext}"
+    if gzip:
+        return gzipped(chunks), "application/gzip", filename + ".gz"
+    return chunks, media_type, filename
@@ -0,0 +1,142 @@
+"""
+Кэш file_code -> метаданные активного файла для /{file_code}, /download и статистики.
+
+Метаданные меняются редко (замена, переключение уведомлений, удаление), а читаются
+на каждом визите — кэшируем неизменяемый снимок FileMeta, не ORM-объект, чтобы он
+не зависел от закрытой сессии. Несуществующие коды тоже кэшируются (None), но
+коротко: перебор случайных кодов не должен каждый раз ходить в БД.
+
+Инвалидация явная — services.py вызывает invalidate() после коммита любого
+изменения файла. Поколение (_generation) защищает от гонки: если запрос прочитал
+строку до инвалидации, а положить в кэш пытается после, запись не сохраняется.
+
+У каждого процесса (воркеры uvicorn, отдельный бот) свой кэш, поэтому invalidate()
+ещё и пишет код в cache_invalidations, а InvalidationFollower каждого процесса раз в
+FOLLOW_INTERVAL сбрасывает перечисленные там коды — чужие изменения видны не позже
+чем через секунду, свои — сразу.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import repository as repo
+from .cache import TTLCache, MISSING
+from .models import CacheInvalidation, File
+
+log = logging.getLogger(__name__)
+
+CACHE_SIZE = 20_000
+CACHE_TTL = 600
+NEGATIVE_TTL = 30
+FOLLOW_INTERVAL = 1.0
+KEEP_INVALIDATIONS = 300   # секунд; дольше строки не нужны даже отставшему воркеру
+
+
+@dataclass(frozen=True)
+class FileMeta:
+    id: int
+    file_code: str
+    original_filename: str
+    stored_filename: str
+    file_size: int
+    user_id: Optional[int]
+    upload_date: datetime
+    notify_visits: bool
+    notify_downloads: bool
+    expires_at: Optional[datetime] = None
+
+    @classmethod
+    def of(cls, f: File) -> "FileMeta":
+        return cls(f.id, f.file_code, f.original_filename, f.stored_filename, f.file_size or 0,
+                   f.user_id, f.upload_date, bool(f.notify_visits), bool(f.notify_downloads), f.expires_at)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= datetime.now()
+
+
+file_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+_generation = 0
+
+
+async def resolve(db: AsyncSession, file_code: str) -> Optional[FileMeta]:
+    # истёкший, но ещё не убранный sweeper'ом файл уже не отдаём
+    meta = file_cache.get(file_code)
+    if meta is not MISSING:
+        return None if meta is None or meta.expired else meta
+    gen = _generation
+    file = await repo.get_active_file(db, file_code)
+    meta = FileMeta.of(file) if file else None
+    if gen == _generation:
+        file_cache.set(file_code, meta, ttl=None if meta else NEGATIVE_TTL)
+    return None if meta is None or meta.expired else meta
+
+
+def _drop(file_code: str):
+    global _generation
+    _generation += 1
+    file_cache.pop(file_code)
+
+
+async def invalidate(db: AsyncSession, file_code: str):
+    """Вызывать после коммита изменения: сбрасывает свой кэш и оповещает остальные процессы."""
+    _drop(file_code)
+    await db.execute(insert(CacheInvalidation).values(file_code=file_code, created_at=datetime.now()))
+    await db.commit()
+
+
+class InvalidationFollower:
+    def __init__(self, interval: float = FOLLOW_INTERVAL):
+        self.interval = interval
+        self._session_factory = None
+        self._task: asyncio.Task | None = None
+
+    def start(self, session_factory):
+        # API и бот в одном процессе (run.py) оба зовут start — достаточно одного цикла
+        if self._task:
+            return
+        self._session_factory = session_factory
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        async with self._session_factory() as db:
+            last = (await db.execute(select(func.coalesce(func.max(CacheInvalidation.id), 0)))).scalar_one()
+        ticks = 0
+        while True:
+            await asyncio.sleep(self.interval)
+            ticks += 1
+            try:
+                async with self._session_factory() as db:
+                    rows = (await db.execute(
+                        select(CacheInvalidation.id, CacheInvalidation.file_code)
+                        .where(CacheInvalidation.id > last).order_by(CacheInvalidation.id)
+                    )).all()
+                    for row_id, file_code in rows:
+                        _drop(file_code)
+                        last = row_id
+                    if ticks % 60 == 0:
+                        # чистку делает любой процесс — DELETE идемпотентен
+                        cutoff = datetime.now() - timedelta(seconds=KEEP_INVALIDATIONS)
+                        await db.execute(delete(CacheInvalidation).where(CacheInvalidation.created_at < cutoff))
+                        await db.commit()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("filecache invalidation follower failed")
+
+
+follower = InvalidationFollower()
@@ -0,0 +1,225 @@
+import asyncio
+import bisect
+import csv
+import ipaddress
+import logging
+import time
+from typing import Optional, Protocol
+
+import aiohttp
+
+from bot.config import GEO_API_URL, GEO_BACKEND, GEO_DB_PATH
+from . import metrics
+from .cache import TTLCache, MISSING
+
+try:
+    import maxminddb
+except ImportError:  # MMDB-бэкенд опционален
+    maxminddb = None
+
+log = logging.getLogger(__name__)
+
+Geo = tuple[str, str]   # (country, city)
+
+CACHE_SIZE = 50_000
+CACHE_TTL = 24 * 3600
+NEGATIVE_TTL = 300          # неудачные ответы кэшируем коротко, чтобы не долбить API
+IP_API_URL = GEO_API_URL
+IP_API_TIMEOUT = 2.5
+IP_API_CONCURRENCY = 8
+
+
+class GeoBackend(Protocol):
+    async def lookup(self, ip: str) -> Optional[Geo]:
+        """None — ошибка/нет данных (кэшируется как негативная запись)."""
+
+    async def close(self): ...
+
+
+# ================== БЭКЕНДЫ ==================
+class IpApiBackend:
+    def __init__(self, url: str = IP_API_URL, timeout: float = IP_API_TIMEOUT,
+                 concurrency: int = IP_API_CONCURRENCY):
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._sem = asyncio.Semaphore(concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=IP_API_CONCURRENCY, ttl_dns_cache=300, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def lookup(self, ip: str) -> Optional[Geo]:
+        async with self._sem:
+            try:
+                async with self._get_session().get(self.url.format(ip=ip)) as r:
+                    data = await r.json(content_type=None)
+            except Exception:
+                return None
+        if data.get("status") != "success":
+            return None
+        return data.get("country") or "", data.get("city") or ""
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+class RangeDbBackend:
+    """
+    Офлайн-база диапазонов: CSV со строками `start_ip,end_ip,country,city`
+    (адреса в точечной записи или целыми числами). Поиск — бинарный по началам диапазонов.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tables: dict[int, tuple[list[int], list[int], list[Geo]]] = {}
+
+    def load(self):
+        rows: dict[int, list[tuple[int, int, Geo]]] = {4: [], 6: []}
+        with open(self.path, newline="", encoding="utf-8") as f:
+            for rec in csv.reader(f):
+                if len(rec) < 3 or rec[0].startswith("#"):
+                    continue
+                try:
+                    start, end = _ip_value(rec[0]), _ip_value(rec[1])
+                except ValueError:
+                    continue  # заголовок или мусор
+                city = rec[3] if len(rec) > 3 else ""
+                rows[start[0]].append((start[1], end[1], (rec[2], city)))
+        for version, items in rows.items():
+            items.sort()
+            self._tables[version] = ([s for s, _, _ in items], [e for _, e, _ in items], [g for _, _, g in items])
+
+    async def lookup(self, ip: str) -> Optional[Geo]:
+        version, value = _ip_value(ip)
+        starts, ends, geos = self._tables.get(version, ([], [], []))
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return geos[i]
+        return None
+
+    async def close(self):
+        pass
+
+
+class MmdbBackend:
+    def __init__(self, path: str):
+        if maxminddb is None:
+            raise RuntimeError("GEO_BACKEND=mmdb требует пакет maxminddb")
+        self._reader = maxminddb.open_database(path)
+
+    async def lookup(self, ip: str) -> Optional[Geo]:
+        rec = self._reader.get(ip)
+        if not rec:
+            return None
+        country = _mmdb_name(rec.get("country"))
+        city = _mmdb_name(rec.get("city"))
+        return (country, city) if country or city else None
+
+    async def close(self):
+        self._reader.close()
+
+
+def _ip_value(text: str) -> tuple[int, int]:
+    text = text.strip()
+    if text.isdigit():
+        value = int(text)
+        return (4 if value < 2**32 else 6), value
+    addr = ipaddress.ip_address(text)
+    return addr.version, int(addr)
+
+
+def _mmdb_name(node: Optional[dict]) -> str:
+    names = (node or {}).get("names") or {}
+    return names.get("ru") or names.get("en") or ""
+
+
+# ================== РЕЗОЛВЕР ==================
+def _prefix_key(addr) -> str:
+    bits = 24 if addr.version == 4 else 48
+    return str(ipaddress.ip_network(f"{addr}/{bits}", strict=False))
+
+
+class GeoResolver:
+    """Кэш (по IP и по /24|/48) перед бэкендом + склейка одновременных запросов к одному IP."""
+
+    def __init__(self, backend: GeoBackend, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL,
+                 negative_ttl: float = NEGATIVE_TTL):
+        self.backend = backend
+        self.cache = TTLCache(maxsize, ttl)
+        self.negative_ttl = negative_ttl
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def resolve(self, ip: str) -> Geo:
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return "", ""
+        if not addr.is_global:
+            return "", ""
+
+        hit = self.cache.get_first((ip, _prefix_key(addr)))
+        if hit is not MISSING:
+            return hit or ("", "")
+
+        fut = self._inflight.get(ip)
+        if fut is None:
+            fut = asyncio.ensure_future(self._fetch(ip, addr))
+            self._inflight[ip] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(ip, None))
+        return await asyncio.shield(fut)
+
+    async def resolve_many(self, ips, timeout: Optional[float] = None) -> dict[str, Geo]:
+        """
+        С timeout — только адреса, разрешившиеся за это время. Запросы к бэкенду
+        по остальным не отменяются (shield в resolve) и дозаполнят кэш.
+        """
+        tasks = {ip: asyncio.ensure_future(self.resolve(ip)) for ip in set(ips)}
+        if not tasks:
+            return {}
+        try:
+            done, _ = await asyncio.wait(tasks.values(), timeout=timeout)
+        finally:
+            for t in tasks.values():
+                t.cancel()
+        return {ip: t.result() for ip, t in tasks.items() if t in done and not t.exception()}
+
+    async def _fetch(self, ip: str, addr) -> Geo:
+        started = time.perf_counter()
+        try:
+            geo = await self.backend.lookup(ip)
+        except Exception:
+            log.exception("geo backend failed for %s", ip)
+            geo = None
+        metrics.GEO_LOOKUP_SECONDS.observe(time.perf_counter() - started, "found" if geo else "none")
+        if geo is None:
+            self.cache.set(ip, None, ttl=self.negative_ttl)
+            return "", ""
+        self.cache.set(ip, geo)
+        self.cache.set(_prefix_key(addr), geo)
+        return geo
+
+    async def close(self):
+        await self.backend.close()
+
+
+def create_backend(kind: str = GEO_BACKEND, path: str = GEO_DB_PATH) -> GeoBackend:
+    if kind == "csv":
+        backend = RangeDbBackend(path)
+        backend.load()
+        return backend
+    if kind == "mmdb":
+        return MmdbBackend(path)
+    return IpApiBackend()
+
+
+geo = GeoResolver(IpApiBackend())
+
+
+async def init_geo():
+    # загрузка CSV-базы может занять секунды — не блокируем цикл
+    if GEO_BACKEND != "ip-api":
+        geo.backend = await asyncio.to_thread(create_backend)
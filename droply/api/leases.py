@@ -0,0 +1,131 @@
+"""
+Лизы в БД: кто из процессов сейчас выполняет фоновые задачи-одиночки.
+
+При нескольких воркерах uvicorn (`python run.py api --workers N`) startup выполняет
+каждый из них, но рассылки, сводки владельцам и сборка мусора должны идти в одном
+экземпляре — иначе владельцы получат по N сообщений, а суммарный темп отправки
+превысит лимит Telegram. Каждый воркер раз в RENEW_INTERVAL пытается взять или
+продлить лизу; держатель запускает задачи, потерявший — останавливает. Упавший
+держатель перестаёт продлевать, и через LEASE_TTL лизу забирает другой.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Lease
+
+log = logging.getLogger(__name__)
+
+LEASE_TTL = 30
+RENEW_INTERVAL = 10
+HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def acquire(db: AsyncSession, name: str, holder: str = HOLDER, ttl: float = LEASE_TTL) -> bool:
+    """Берёт свободную/просроченную лизу или продлевает свою. Коммит — на вызывающей стороне."""
+    now = datetime.now()
+    stmt = insert(Lease).values(name=name, holder=holder, expires_at=now + timedelta(seconds=ttl))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Lease.name],
+        set_={"holder": stmt.excluded.holder, "expires_at": stmt.excluded.expires_at},
+        where=or_(Lease.holder == holder, Lease.expires_at < now),
+    )
+    res = await db.execute(stmt)
+    return res.rowcount == 1
+
+
+async def release(db: AsyncSession, name: str, holder: str = HOLDER):
+    await db.execute(
+        update(Lease).where(Lease.name == name, Lease.holder == holder).values(expires_at=datetime.min)
+    )
+
+
+async def get_cursor(db: AsyncSession, name: str) -> Optional[int]:
+    return (await db.execute(select(Lease.cursor).where(Lease.name == name))).scalar_one_or_none()
+
+
+async def set_cursor(db: AsyncSession, name: str, cursor: int, holder: str = HOLDER) -> bool:
+    # только держатель: отставший бывший лидер не откатит позицию нового
+    res = await db.execute(
+        update(Lease).where(Lease.name == name, Lease.holder == holder).values(cursor=cursor)
+    )
+    return res.rowcount == 1
+
+
+Hook = Callable[[], Awaitable[None]]
+
+
+class LeaderElection:
+    """Держит лизу name, пока процесс жив; on_acquire/on_release запускают и гасят задачи."""
+
+    def __init__(self, name: str, on_acquire: Hook, on_release: Hook,
+                 ttl: float = LEASE_TTL, interval: float = RENEW_INTERVAL):
+        self.name = name
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+        self.ttl = ttl
+        self.interval = interval
+        self.is_leader = False
+        self._valid_until = 0.0
+        self._session_factory = None
+        self._task: asyncio.Task | None = None
+
+    def start(self, session_factory):
+        self._session_factory = session_factory
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await self._step_down()
+            # отпускаем сразу, не дожидаясь TTL — рестарт не оставляет задачи без хозяина
+            async with self._session_factory() as db:
+                await release(db, self.name)
+                await db.commit()
+
+    async def _run(self):
+        while True:
+            try:
+                async with self._session_factory() as db:
+                    held = await acquire(db, self.name, ttl=self.ttl)
+                    await db.commit()
+                if held:
+                    self._valid_until = time.monotonic() + self.ttl - self.interval
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # БД занята или недоступна: пока наша лиза заведомо не истекла, остаёмся лидером
+                log.exception("lease %s: renew failed", self.name)
+                held = self.is_leader and time.monotonic() < self._valid_until
+            if held and not self.is_leader:
+                log.info("lease %s acquired by %s", self.name, HOLDER)
+                self.is_leader = True
+                try:
+                    await self.on_acquire()
+                except Exception:
+                    log.exception("lease %s: starting tasks failed", self.name)
+            elif not held and self.is_leader:
+                log.warning("lease %s lost by %s", self.name, HOLDER)
+                await self._step_down()
+            await asyncio.sleep(self.interval)
+
+    async def _step_down(self):
+        self.is_leader = False
+        try:
+            await self.on_release()
+        except Exception:
+            log.exception("lease %s: stopping tasks failed", self.name)
@@ -1,98 +1,128 @@
-from fastapi import FastAPI, Request, HTTPException, UploadFile, File as FastFile, Form, Depends, Query
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, StreamingResponse
+from fastapi import FastAPI, Request, HTTPException, UploadFile, File as FastFile, Form, Depends, Query, Header
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, or_
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 import os
-import shutil
 import urllib.parse
-import uuid
-import shortuuid
 from datetime import datetime, timedelta
 import asyncio
-import csv
-import io
-import aiohttp
 
 from aiogram import Bot
-from bot.config import BOT_TOKEN, ADMIN_IDS, BASE_URL
-from .database import get_db
-from .models import File, FileAccess
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from bot.config import BOT_TOKEN, TELEGRAM_API_URL
+from . import storage, ranges, rollups, services, export, filecache, uploads, sweeper, archive, metrics
+from .access_log import access_log, AccessEvent
+from .geo import geo, init_geo
+from .notifications import notifier, AccessFeed
+from .broadcast import broadcaster
+from .leases import LeaderElection
+from .database import get_db, AsyncSessionLocal, engine, async_engine
+from .filecache import FileMeta
 
 # ================== ИНИЦИАЛИЗАЦИЯ ==================
-bot = Bot(token=BOT_TOKEN)
+# TELEGRAM_API_URL — свой сервер Bot API или заглушка из bench/_fakes.py
+_tg_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=_tg_session)
 
-os.makedirs("api/files", exist_ok=True)
 os.makedirs("api/templates", exist_ok=True)
 
 app = FastAPI(title="Droply", version="1.3.0")
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(async_engine.sync_engine)
 
-app.mount("/files", StaticFiles(directory="api/files"), name="files")
+app.mount("/files", StaticFiles(directory=storage.FILES_DIR), name="files")
 templates = Jinja2Templates(directory="api/templates")
 
 
 # ================== УТИЛИТЫ ==================
-def generate_short_code() -> str:
-    return shortuuid.ShortUUID().random(length=5)
-
 def _get_client_ip(req: Request) -> str:
     xfwd = req.headers.get("x-forwarded-for")
     if xfwd:
         return xfwd.split(",")[0].strip()
     return req.client.host
 
-async def geo_lookup(ip: str) -> tuple[str, str]:
-    try:
-        url = f"http://ip-api.com/json/{ip}?lang=ru&fields=status,country,city"
-        timeout = aiohttp.ClientTimeout(total=2.5)
-        async with aiohttp.ClientSession(timeout=timeout) as s:
-            async with s.get(url) as r:
-                data = await r.json()
-                if data.get("status") == "success":
-                    return data.get("country") or "", data.get("city") or ""
-    except Exception:
-        pass
-    return "", ""
-
-async def notify_owner(file: File, event: str, ip: str, ua: str, country: str, city: str):
-    if not file.user_id:
-        return
-    if event == "visit" and not file.notify_visits:
-        return
-    if event == "download" and not file.notify_downloads:
-        return
-
-    place = f"{country}, {city}".strip(", ").strip()
-    place_txt = f" 🌍 {place}" if place else ""
-    fileee = urllib.parse.unquote(file.original_filename)
-    msg = (
-        f"🔔 <b>{'Просмотр страницы' if event=='visit' else 'Скачивание файла'}\n\n"
-        f"📁 {fileee}\n"
-        f"🔗 <code>{BASE_URL}/{file.file_code}</code>\n"
-        f"🕒 {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}\n"
-        f"🌐 IP: <code>{ip}</code>{place_txt}</b>\n"
-    )
-    try:
-        await bot.send_message(chat_id=file.user_id, text=msg, parse_mode="HTML", disable_web_page_preview=True)
-    except Exception:
-        pass
-
-async def write_access(db: Session, file_code: str, access_type: str, ip: str, ua: str):
-    country, city = await geo_lookup(ip)
-    access = FileAccess(
-        file_code=file_code,
+async def write_access(file: FileMeta, access_type: str, ip: str, ua: str):
+    # геолокация и уведомление — уже после записи, в фоне (см. access_log)
+    await access_log.record(AccessEvent(
+        file_code=file.file_code,
         access_type=access_type,
         ip_address=ip,
         user_agent=ua or "",
         access_time=datetime.now(),
-        country=country,
-        city=city
-    )
-    db.add(access)
-    db.commit()
-    return country, city
+        file=file
+    ))
+
+# ================== ФОНОВЫЕ ЗАДАЧИ ==================
+# лог обращений и кэши — в каждом воркере; отправка в Telegram и сборка мусора —
+# только в держателе лизы "background", сколько бы воркеров ни было (api/leases.py)
+access_feed = AccessFeed(notifier, lease="background")
+
+async def _start_singletons():
+    notifier.start(bot)
+    access_feed.start(AsyncSessionLocal)
+    broadcaster.start(bot, AsyncSessionLocal)
+    app.state.gc_tasks = [
+        asyncio.create_task(storage.gc_loop(AsyncSessionLocal)),
+        asyncio.create_task(uploads.gc_loop(AsyncSessionLocal)),
+        asyncio.create_task(sweeper.sweep_loop(AsyncSessionLocal)),
+        asyncio.create_task(archive.archive_loop(engine)),
+    ]
+
+async def _stop_singletons():
+    for task in app.state.gc_tasks:
+        task.cancel()
+    await access_feed.stop()
+    await notifier.stop()
+    await broadcaster.stop()
+
+background = LeaderElection("background", _start_singletons, _stop_singletons)
+
+# ================== МЕТРИКИ ==================
+# очереди и кэши читаются в момент выдачи /metrics (api/metrics.py)
+metrics.gauge("droply_leader", "1 if this worker runs background singletons", lambda: background.is_leader)
+metrics.gauge("droply_access_log_queue_depth", "Access events waiting to be written", lambda: access_log.depth)
+metrics.counter_fn("droply_access_log_written_total", "Access events written", lambda: access_log.written)
+metrics.counter_fn("droply_access_log_dropped_total", "Access events dropped on backpressure",
+                   lambda: access_log.dropped)
+metrics.counter_fn("droply_access_log_failed_total", "Access events lost after failed write retries",
+                   lambda: access_log.failed)
+metrics.gauge("droply_notify_queue_depth", "Owner notifications waiting to be sent",
+              lambda: notifier.stats()["outbox"])
+metrics.gauge("droply_notify_owners", "Owners with pending notification digests", lambda: notifier.stats()["owners"])
+metrics.counter_fn("droply_notify_messages_total", "Owner notifications by outcome",
+                   lambda: {k: v for k, v in notifier.stats().items() if k in ("sent", "failed", "dropped")},
+                   ("outcome",))
+_caches = {"files": filecache.file_cache, "geo": geo.cache}
+metrics.counter_fn("droply_cache_hits_total", "Cache hits", lambda: {k: c.hits for k, c in _caches.items()}, ("cache",))
+metrics.counter_fn("droply_cache_misses_total", "Cache misses", lambda: {k: c.misses for k, c in _caches.items()},
+                   ("cache",))
+metrics.gauge("droply_cache_entries", "Cache entries", lambda: {k: len(c) for k, c in _caches.items()}, ("cache",))
+
+
+@app.on_event("startup")
+async def _start_background():
+    await init_geo()
+    access_log.start()
+    filecache.follower.start(AsyncSessionLocal)
+    metrics.publisher.start(AsyncSessionLocal)
+    background.start(AsyncSessionLocal)
+
+@app.on_event("shutdown")
+async def _stop_background():
+    await access_log.stop()
+    await background.stop()
+    await filecache.follower.stop()
+    await metrics.publisher.stop()
+    await geo.close()
+
+
+# до "/{file_code}" — иначе тот перехватит путь
+@app.get("/metrics")
+async def metrics_endpoint(db: AsyncSession = Depends(get_db)):
+    return PlainTextResponse(await metrics.exposition(db), media_type=metrics.CONTENT_TYPE)
 
 
 # ================== ПУБЛИЧНЫЕ РОУТЫ ==================
@@ -109,377 +139,250 @@ async def root(request: Request):
 
 
 @app.get("/{file_code}", response_class=HTMLResponse)
-async def short_link(file_code: str, request: Request, db: Session = Depends(get_db)):
-    file = db.query(File).filter(File.file_code == file_code, File.is_active == True).first()
+async def short_link(file_code: str, request: Request, db: AsyncSession = Depends(get_db)):
+    file = await filecache.resolve(db, file_code)
     if not file:
         raise HTTPException(status_code=404, detail="Файл не найден")
 
     ip = _get_client_ip(request)
     ua = request.headers.get("user-agent", "")
     try:
-        country, city = await write_access(db, file_code, "visit", ip, ua)
-        asyncio.create_task(notify_owner(file, "visit", ip, ua, country, city))
+        await write_access(file, "visit", ip, ua)
     except Exception:
         pass
 
     return templates.TemplateResponse("download.html", {"request": request, "file": file})
 
 @app.get("/download/{file_code}")
-async def download_file(request: Request, file_code: str, db: Session = Depends(get_db)):
-    file = db.query(File).filter(File.file_code == file_code, File.is_active == True).first()
+async def download_file(request: Request, file_code: str, db: AsyncSession = Depends(get_db)):
+    file = await filecache.resolve(db, file_code)
     if not file:
         raise HTTPException(status_code=404, detail="Файл не найден")
 
-    file_path = f"api/files/{file.stored_filename}"
-    if not os.path.exists(file_path):
+    path = await storage.locate(file.stored_filename)
+    st = await ranges.stat_stored(path) if path else None
+    if st is None:
         raise HTTPException(status_code=404, detail="Файл не найден на сервере")
 
-    ip = _get_client_ip(request)
-    ua = request.headers.get("user-agent", "")
-    try:
-        country, city = await write_access(db, file_code, "download", ip, ua)
-        asyncio.create_task(notify_owner(file, "download", ip, ua, country, city))
-    except Exception:
-        pass
-
     filename = file.original_filename
     headers = {
         "Content-Disposition": f"attachment; filename*=UTF-8''{urllib.parse.quote(filename)}"
     }
+    response = ranges.file_response(request, st, headers)
 
-    return FileResponse(path=file_path, filename=filename, headers=headers, media_type="application/octet-stream")
+    # докачка и параллельные куски одной загрузки не считаются отдельными скачиваниями
+    if ranges.is_download_start(request, response, st.size):
+        ip = _get_client_ip(request)
+        ua = request.headers.get("user-agent", "")
+        try:
+            await write_access(file, "download", ip, ua)
+        except Exception:
+            pass
+
+    return response
 
 
 @app.post("/api/upload")
-async def upload_file(file: UploadFile, user_id: Optional[int] = Form(default=None), db: Session = Depends(get_db)):
+async def upload_file(
+    file: UploadFile,
+    user_id: Optional[int] = Form(default=None),
+    expires_in: Optional[int] = Form(default=None, description="срок жизни файла, секунд"),
+    db: AsyncSession = Depends(get_db)
+):
     try:
-        file_code = generate_short_code()
-        ext = os.path.splitext(file.filename)[1] if file.filename else ""
-        stored_filename = f"{uuid.uuid4()}{ext}"
-        file_path = f"api/files/{stored_filename}"
-
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        file_size = os.path.getsize(file_path)
-
-        file_obj = File(
-            file_code=file_code,
-            original_filename=file.filename or stored_filename,
-            stored_filename=stored_filename,
-            file_size=file_size,
-            user_id=user_id,
-            upload_date=datetime.now(),
-            notify_visits=True,
-            notify_downloads=True
-        )
-        db.add(file_obj)
-        db.commit()
-        db.refresh(file_obj)
-
-        return JSONResponse({
-            "success": True,
-            "file_code": file_code,
-            "filename": file_obj.original_filename,
-            "size": file_size,
-            "download_url": f"{BASE_URL}/{file_code}"
-        })
+        return await services.upload(db, storage.iter_upload(file), file.filename, user_id, expires_in)
+    except services.ServiceError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/stats/{file_code}")
-async def get_file_stats(file_code: str, db: Session = Depends(get_db)):
-    file = db.query(File).filter(File.file_code == file_code, File.is_active == True).first()
-    if not file:
-        raise HTTPException(status_code=404, detail="File not found")
+# загрузка по частям с докачкой — протокол описан в api/uploads.py
+@app.post("/api/uploads")
+async def create_upload(
+    size: int = Form(...),
+    filename: Optional[str] = Form(None),
+    user_id: Optional[int] = Form(None),
+    chunk_size: Optional[int] = Form(None),
+    expires_in: Optional[int] = Form(None),
+    db: AsyncSession = Depends(get_db)
+):
+    return await uploads.create(db, filename, size, user_id, chunk_size, expires_in)
+
+@app.get("/api/uploads/{upload_id}")
+async def upload_status(upload_id: str, db: AsyncSession = Depends(get_db)):
+    return await uploads.status(db, upload_id)
+
+@app.put("/api/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    upload_checksum: Optional[str] = Header(None, alias="Upload-Checksum"),
+    db: AsyncSession = Depends(get_db)
+):
+    return await uploads.write_chunk(db, upload_id, upload_offset, request.stream(), upload_checksum)
 
-    visits = db.query(FileAccess).filter(FileAccess.file_code == file_code, FileAccess.access_type == "visit").count()
-    downloads = db.query(FileAccess).filter(FileAccess.file_code == file_code, FileAccess.access_type == "download").count()
+@app.post("/api/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, db: AsyncSession = Depends(get_db)):
+    return await uploads.finalize(db, upload_id)
 
-    recent_activity = db.query(FileAccess).filter(FileAccess.file_code == file_code)\
-        .order_by(FileAccess.access_time.desc()).limit(10).all()
+@app.delete("/api/uploads/{upload_id}")
+async def abort_upload(upload_id: str, db: AsyncSession = Depends(get_db)):
+    return await uploads.abort(db, upload_id)
 
-    return {
-        "file_code": file_code,
-        "filename": file.original_filename,
-        "size": file.file_size,
-        "visits": visits,
-        "downloads": downloads,
-        "notify_visits": file.notify_visits,
-        "notify_downloads": file.notify_downloads,
-        "recent_activity": [
-            {
-                "access_type": a.access_type,
-                "ip_address": a.ip_address,
-                "user_agent": a.user_agent,
-                "country": a.country,
-                "city": a.city,
-                "access_time": a.access_time
-            }
-            for a in recent_activity
-        ]
-    }
+
+@app.get("/api/stats/{file_code}")
+async def get_file_stats(file_code: str, db: AsyncSession = Depends(get_db)):
+    return await services.file_stats(db, file_code)
 
 @app.get("/api/files/{user_id}")
-async def get_user_files(user_id: int, db: Session = Depends(get_db)):
-    user_files = db.query(File).filter(File.user_id == user_id, File.is_active == True).order_by(desc(File.upload_date)).all()
-    return {"files": [
-        {
-            "file_code": f.file_code,
-            "filename": f.original_filename,
-            "size": f.file_size,
-            "upload_date": f.upload_date.isoformat(),
-            "notify_visits": f.notify_visits,
-            "notify_downloads": f.notify_downloads,
-            "download_url": f"{BASE_URL}/{f.file_code}"
-        } for f in user_files
-    ]}
+async def get_user_files(user_id: int, db: AsyncSession = Depends(get_db)):
+    return await services.list_files(db, user_id)
 
 @app.delete("/api/files/{file_code}")
-async def delete_file(file_code: str, user_id: int = Form(...), db: Session = Depends(get_db)):
-    file = db.query(File).filter(File.file_code == file_code).first()
-    if not file:
-        raise HTTPException(status_code=404, detail="File not found")
-    if file.user_id != user_id:
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    path = f"api/files/{file.stored_filename}"
-    if os.path.exists(path):
-        os.remove(path)
-    file.is_active = False
-    db.commit()
-    return {"success": True, "message": "File deleted"}
+async def delete_file(file_code: str, user_id: int = Form(...), db: AsyncSession = Depends(get_db)):
+    return await services.delete(db, file_code, user_id)
 
 @app.patch("/api/files/{file_code}/notify_visits")
-async def toggle_visit_notifications(file_code: str, user_id: int = Form(...), db: Session = Depends(get_db)):
-    file = db.query(File).filter(File.file_code == file_code, File.is_active == True).first()
-    if not file:
-        raise HTTPException(status_code=404, detail="File not found")
-    if file.user_id != user_id:
-        raise HTTPException(status_code=403, detail="Access denied")
-    file.notify_visits = not file.notify_visits
-    db.commit()
-    return {"success": True, "notify_visits": file.notify_visits}
+async def toggle_visit_notifications(file_code: str, user_id: int = Form(...), db: AsyncSession = Depends(get_db)):
+    return await services.toggle(db, file_code, "notify_visits", user_id)
 
 @app.patch("/api/files/{file_code}/notify_downloads")
-async def toggle_download_notifications(file_code: str, user_id: int = Form(...), db: Session = Depends(get_db)):
-    file = db.query(File).filter(File.file_code == file_code, File.is_active == True).first()
-    if not file:
-        raise HTTPException(status_code=404, detail="File not found")
-    if file.user_id != user_id:
-        raise HTTPException(status_code=403, detail="Access denied")
-    file.notify_downloads = not file.notify_downloads
-    db.commit()
-    return {"success": True, "notify_downloads": file.notify_downloads}
+async def toggle_download_notifications(file_code: str, user_id: int = Form(...), db: AsyncSession = Depends(get_db)):
+    return await services.toggle(db, file_code, "notify_downloads", user_id)
 
 @app.put("/api/files/{file_code}/replace")
-async def replace_file(file_code: str, file: UploadFile, user_id: int = Form(...), db: Session = Depends(get_db)):
+async def replace_file(file_code: str, file: UploadFile, user_id: int = Form(...), db: AsyncSession = Depends(get_db)):
     try:
-        file_obj = db.query(File).filter(File.file_code == file_code, File.is_active == True).first()
-        if not file_obj:
-            raise HTTPException(status_code=404, detail="File not found")
-        if file_obj.user_id != user_id:
-            raise HTTPException(status_code=403, detail="Access denied")
-
-        old_path = f"api/files/{file_obj.stored_filename}"
-        if os.path.exists(old_path):
-            os.remove(old_path)
-
-        ext = os.path.splitext(file.filename)[1] if file.filename else ""
-        stored_filename = f"{uuid.uuid4()}{ext}"
-        new_path = f"api/files/{stored_filename}"
-        with open(new_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        file_size = os.path.getsize(new_path)
-        file_obj.original_filename = file.filename or stored_filename
-        file_obj.stored_filename = stored_filename
-        file_obj.file_size = file_size
-        file_obj.upload_date = datetime.now()
-        db.commit()
-
-        return JSONResponse({
-            "success": True,
-            "file_code": file_code,
-            "filename": file_obj.original_filename,
-            "size": file_size,
-            "download_url": f"{BASE_URL}/{file_code}"
-        })
+        return await services.replace(db, file_code, storage.iter_upload(file), file.filename, user_id)
+    except services.ServiceError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
-def _check_admin(admin_id: int):
-    if admin_id not in ADMIN_IDS:
-        raise HTTPException(status_code=403, detail="Access denied")
-
 @app.get("/api/admin/stats")
-async def admin_stats(admin_id: int = Query(...), db: Session = Depends(get_db)):
-    _check_admin(admin_id)
-
-    total_files = db.query(File).filter(File.is_active == True).count()
-    total_size = db.query(func.sum(File.file_size)).filter(File.is_active == True).scalar() or 0
-    total_visits = db.query(FileAccess).filter(FileAccess.access_type == "visit").count()
-    total_downloads = db.query(FileAccess).filter(FileAccess.access_type == "download").count()
-
-    week_ago = datetime.now() - timedelta(days=7)
-    files_this_week = db.query(File).filter(File.is_active == True, File.upload_date >= week_ago).count()
-    visits_this_week = db.query(FileAccess).filter(FileAccess.access_type == "visit", FileAccess.access_time >= week_ago).count()
-    downloads_this_week = db.query(FileAccess).filter(FileAccess.access_type == "download", FileAccess.access_time >= week_ago).count()
-
-    top_files = db.query(
-        File.file_code,
-        File.original_filename,
-        File.file_size,
-        func.count(FileAccess.id).label('downloads')
-    ).join(FileAccess, File.file_code == FileAccess.file_code)\
-     .filter(File.is_active == True, FileAccess.access_type == "download")\
-     .group_by(File.file_code)\
-     .order_by(desc('downloads')).limit(10).all()
+async def admin_stats(admin_id: int = Query(...), db: AsyncSession = Depends(get_db)):
+    services.check_admin(admin_id)
+    return await services.admin_stats(db)
+
+@app.get("/api/admin/cache")
+async def admin_cache_stats(admin_id: int = Query(...)):
+    # счётчики попаданий — чтобы подбирать размеры и TTL кэшей
+    services.check_admin(admin_id)
+    return {
+        "files": filecache.file_cache.stats(),
+        "geo": geo.cache.stats(),
+    }
 
+@app.put("/api/admin/users/{user_id}/quota")
+async def admin_set_quota(
+    user_id: int,
+    admin_id: int = Form(...),
+    limit_mb: Optional[int] = Form(None, ge=0, description="пусто — общий лимит из конфига"),
+    db: AsyncSession = Depends(get_db)
+):
+    services.check_admin(admin_id)
+    return await services.set_quota(db, user_id, limit_mb)
+
+@app.get("/api/admin/timeseries")
+async def admin_timeseries(
+    admin_id: int = Query(...),
+    granularity: str = Query("hour", pattern="^(hour|day)$"),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
+    services.check_admin(admin_id)
+    to = to or datetime.now()
+    from_ = from_ or to - (timedelta(days=2) if granularity == "hour" else timedelta(days=30))
     return {
-        "total_files": total_files,
-        "total_size_mb": round(total_size / 1024 / 1024, 2),
-        "total_visits": total_visits,
-        "total_downloads": total_downloads,
-        "files_this_week": files_this_week,
-        "visits_this_week": visits_this_week,
-        "downloads_this_week": downloads_this_week,
-        "top_files": [
-            {
-                "file_code": f.file_code,
-                "filename": f.original_filename,
-                "size_mb": round(f.file_size / 1024 / 1024, 2),
-                "downloads": f.downloads
-            } for f in top_files
-        ]
+        "granularity": granularity,
+        "from": from_.isoformat(),
+        "to": to.isoformat(),
+        "points": await rollups.series(db, granularity, from_, to)
     }
 
 @app.get("/api/admin/files")
 async def admin_all_files(
     admin_id: int = Query(...),
     q: Optional[str] = Query(None, description="поиск по имени/коду"),
-    page: int = Query(1, ge=1),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
     size: int = Query(10, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    _check_admin(admin_id)
-
-    query = db.query(File).filter(File.is_active == True)
-    if q:
-        like = f"%{q}%"
-        query = query.filter(or_(File.original_filename.ilike(like), File.file_code.ilike(like)))
-
-    total = query.count()
-    files = query.order_by(desc(File.upload_date)).offset((page-1)*size).limit(size).all()
-
-    return {
-        "total": total,
-        "page": page,
-        "size": size,
-        "files": [
-            {
-                "file_code": f.file_code,
-                "filename": f.original_filename,
-                "size_mb": round(f.file_size / 1024 / 1024, 2),
-                "upload_date": f.upload_date.isoformat(),
-                "user_id": f.user_id,
-                "notify_visits": f.notify_visits,
-                "notify_downloads": f.notify_downloads,
-                "download_url": f"{BASE_URL}/{f.file_code}"
-            } for f in files
-        ]
-    }
+    services.check_admin(admin_id)
+    return await services.admin_files(db, q, cursor, size)
 
 @app.get("/api/admin/logs/{file_code}")
 async def admin_logs(
     file_code: str,
     admin_id: int = Query(...),
-    page: int = Query(1, ge=1),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
     size: int = Query(20, ge=1, le=200),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    _check_admin(admin_id)
-    base = db.query(FileAccess).filter(FileAccess.file_code == file_code).order_by(desc(FileAccess.access_time))
-    total = base.count()
-    rows = base.offset((page-1)*size).limit(size).all()
-    return {
-        "total": total,
-        "page": page,
-        "size": size,
-        "logs": [
-            {
-                "type": r.access_type,
-                "ip": r.ip_address,
-                "ua": r.user_agent,
-                "country": r.country,
-                "city": r.city,
-                "time": r.access_time.isoformat()
-            } for r in rows
-        ]
-    }
+    services.check_admin(admin_id)
+    return await services.admin_logs(db, file_code, cursor, size)
 
-@app.get("/api/admin/logs/{file_code}/export.csv")
-async def admin_logs_export_csv(file_code: str, admin_id: int = Query(...), db: Session = Depends(get_db)):
-    _check_admin(admin_id)
-    rows = db.query(FileAccess).filter(FileAccess.file_code == file_code).order_by(FileAccess.access_time.asc()).all()
-
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(["time", "type", "ip", "country", "city", "user_agent"])
-    for r in rows:
-        writer.writerow([r.access_time.isoformat(), r.access_type, r.ip_address, r.country or "", r.city or "", r.user_agent or ""])
-    buf.seek(0)
-    return StreamingResponse(iter([buf.read()]), media_type="text/csv", headers={
-        "Content-Disposition": f'attachment; filename="logs_{file_code}.csv"'
+@app.get("/api/admin/logs/{file_code}/export")
+async def admin_logs_export(
+    file_code: str,
+    admin_id: int = Query(...),
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = Query(False),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = Query(None)
+):
+    services.check_admin(admin_id)
+    chunks, media_type, filename = export.access_log_export(file_code, format, gzip, from_, to)
+    return StreamingResponse(chunks, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
     })
 
+@app.get("/api/admin/logs/{file_code}/export.csv")
+async def admin_logs_export_csv(
+    file_code: str,
+    admin_id: int = Query(...),
+    gzip: bool = Query(False),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = Query(None)
+):
+    return await admin_logs_export(file_code, admin_id, "csv", gzip, from_, to)
+
 @app.patch("/api/admin/files/{file_code}/toggle")
 async def admin_toggle(
     file_code: str,
     admin_id: int = Form(...),
     field: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    _check_admin(admin_id)
-    file = db.query(File).filter(File.file_code == file_code, File.is_active == True).first()
-    if not file:
-        raise HTTPException(status_code=404, detail="File not found")
-    if field not in ("notify_visits", "notify_downloads"):
-        raise HTTPException(status_code=400, detail="Bad field")
-    setattr(file, field, not getattr(file, field))
-    db.commit()
-    return {"success": True, field: getattr(file, field)}
+    services.check_admin(admin_id)
+    return await services.toggle(db, file_code, field, user_id=None)
 
 @app.delete("/api/admin/files/{file_code}")
-async def admin_delete_file(file_code: str, admin_id: int = Form(...), db: Session = Depends(get_db)):
-    _check_admin(admin_id)
-    file = db.query(File).filter(File.file_code == file_code).first()
-    if not file:
-        raise HTTPException(status_code=404, detail="File not found")
-
-    path = f"api/files/{file.stored_filename}"
-    if os.path.exists(path):
-        os.remove(path)
-    file.is_active = False
-    db.commit()
-    return {"success": True, "message": "File deleted by admin"}
+async def admin_delete_file(file_code: str, admin_id: int = Form(...), db: AsyncSession = Depends(get_db)):
+    services.check_admin(admin_id)
+    return await services.delete(db, file_code, user_id=None)
 
 @app.post("/api/admin/broadcast")
-async def admin_broadcast(message: str = Form(...), admin_id: int = Form(...), db: Session = Depends(get_db)):
-    _check_admin(admin_id)
-    user_ids = db.query(File.user_id).filter(File.user_id.isnot(None)).distinct().all()
-    user_ids = [uid[0] for uid in user_ids]
-    success = 0
-    for uid in user_ids:
-        try:
-            await bot.send_message(chat_id=uid, text=message, parse_mode="HTML")
-            success += 1
-        except Exception:
-            pass
-    return {"success": True, "message": f"Сообщение отправлено {success} из {len(user_ids)} пользователей"}
+async def admin_broadcast(message: str = Form(...), admin_id: int = Form(...), db: AsyncSession = Depends(get_db)):
+    services.check_admin(admin_id)
+    return await services.start_broadcast(db, admin_id, message)
+
+@app.get("/api/admin/broadcast/{job_id}")
+async def admin_broadcast_status(job_id: int, admin_id: int = Query(...), db: AsyncSession = Depends(get_db)):
+    services.check_admin(admin_id)
+    return await services.broadcast_status(db, job_id)
+
 
+@app.exception_handler(services.ServiceError)
+async def service_error_handler(request: Request, exc: services.ServiceError):
+    if exc.status_code == 404:
+        return await custom_404_handler(request, exc)
+    return JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
 
 @app.exception_handler(404)
 async def custom_404_handler(request: Request, exc: HTTPException):
@@ -0,0 +1,372 @@
+"""
+Метрики в текстовом формате Prometheus: GET /metrics.
+
+Инструменты дешёвые и всегда включены: наблюдение — bisect по границам бакетов и
+пара сложений в словаре процесса, без блокировок (всё в одном event loop).
+
+- MetricsMiddleware (чистый ASGI, без BaseHTTPMiddleware) меряет каждый запрос:
+  латентность, байты в обе стороны, коды ответа и суммарное время SQL-запросов —
+  по имени функции-обработчика (short_link, download_file, upload_file, ...).
+  Для потоковых ответов латентность — до отправки последнего байта.
+- время SQL считают события курсора движка (instrument_engine) и складывают в
+  счётчик текущего запроса из contextvar; фоновые задачи в него не попадают;
+- геолокация и отправка в Telegram отмечаются в местах вызова (geo, notifications,
+  broadcast), очереди и кэши читаются в момент выдачи через gauge()/counter_fn().
+
+При нескольких воркерах uvicorn каждый процесс раз в PUBLISH_INTERVAL кладёт свой
+снимок в metric_snapshots, а /metrics складывает свежие снимки остальных процессов
+со своими живыми значениями — какой бы воркер ни ответил, цифры по всему сервису.
+Счётчики и гистограммы умерших воркеров остаются в сумме (иначе *_total пошли бы
+назад и сломали rate()): их последние снимки учитываются и после SNAPSHOT_STALE, а
+перед удалением старых строк копятся в строке RETIRED. Gauge — только живые воркеры.
+"""
+import asyncio
+import bisect
+import json
+import logging
+import secrets
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import delete, event, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .leases import HOLDER
+from .models import MetricSnapshot
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+PUBLISH_INTERVAL = 5
+SNAPSHOT_STALE = 30         # снимок старше — воркер умер или завис, не учитываем
+SNAPSHOT_KEEP = 3600
+CUMULATIVE = ("counter", "histogram")
+RETIRED = "retired"         # строка с суммой счётчиков удалённых снимков
+# не просто HOLDER: pid после рестарта (особенно в контейнере) бывает тем же,
+# и новый процесс перезаписал бы итоги старого
+SNAPSHOT_HOLDER = f"{HOLDER}:{secrets.token_hex(4)}"
+
+Labels = tuple[str, ...]
+_registry: list = []
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: dict[Labels, float] = {}
+        _registry.append(self)
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, tuple(zip(self.labelnames, labels)), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Labels = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.buckets = buckets
+        self._values: dict[Labels, list] = {}     # [счётчики бакетов..., +Inf, сумма]
+        _registry.append(self)
+
+    def observe(self, value: float, *labels: str):
+        v = self._values.get(labels)
+        if v is None:
+            v = self._values[labels] = [0] * (len(self.buckets) + 2)
+        v[bisect.bisect_left(self.buckets, value)] += 1
+        v[-1] += value
+
+    def samples(self):
+        for labels, v in self._values.items():
+            pairs = tuple(zip(self.labelnames, labels))
+            total = 0
+            for bound, n in zip((*self.buckets, "+Inf"), v):
+                total += n
+                yield f"{self.name}_bucket", (*pairs, ("le", str(bound))), total
+            yield f"{self.name}_sum", pairs, v[-1]
+            yield f"{self.name}_count", pairs, total
+
+
+class _Callback:
+    """Значение читается при выдаче: fn() -> число или {значения меток: число}."""
+
+    def __init__(self, kind: str, name: str, help: str, fn: Callable, labelnames: Labels = ()):
+        self.kind, self.name, self.help, self.fn, self.labelnames = kind, name, help, fn, labelnames
+        _registry.append(self)
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            log.debug("metric %s callback failed", self.name, exc_info=True)
+            return
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, v in items:
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield self.name, tuple(zip(self.labelnames, labels)), v
+
+
+def gauge(name: str, help: str, fn: Callable, labelnames: Labels = ()):
+    _Callback("gauge", name, help, fn, labelnames)
+
+
+def counter_fn(name: str, help: str, fn: Callable, labelnames: Labels = ()):
+    # для счётчиков, которые объекты и так ведут сами (notifier.sent, TTLCache.hits, ...)
+    _Callback("counter", name, help, fn, labelnames)
+
+
+# ================== ИНСТРУМЕНТЫ ==================
+REQUEST_SECONDS = Histogram("droply_request_duration_seconds", "HTTP request latency", ("handler",))
+REQUESTS = Counter("droply_requests_total", "HTTP requests by status code", ("handler", "code"))
+BYTES_SENT = Counter("droply_response_bytes_total", "Response body bytes sent", ("handler",))
+BYTES_RECEIVED = Counter("droply_request_bytes_total", "Request body bytes received", ("handler",))
+DB_SECONDS = Histogram("droply_db_duration_seconds", "Total SQL time per request", ("handler",), FAST_BUCKETS)
+DB_QUERIES = Counter("droply_db_queries_total", "SQL statements executed by requests", ("handler",))
+GEO_LOOKUP_SECONDS = Histogram("droply_geo_lookup_seconds", "Geo backend lookup latency (cache misses only)",
+                               ("result",), FAST_BUCKETS)
+TELEGRAM_SEND_SECONDS = Histogram("droply_telegram_send_seconds", "Telegram sendMessage latency", ("source",))
+TELEGRAM_ERRORS = Counter("droply_telegram_errors_total", "Failed Telegram sends", ("source", "error"))
+
+
+# ================== HTTP ==================
+_request_db: ContextVar[Optional[list]] = ContextVar("request_db", default=None)
+
+
+def _handler(scope) -> str:
+    # имя функции роута, а не путь: число значений метки ограничено числом роутов
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    return getattr(endpoint, "__name__", type(endpoint).__name__)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        db = [0.0, 0]
+        token = _request_db.set(db)
+        state = {"code": "500", "sent": 0, "received": 0}
+
+        async def receive_counted():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message):
+            if message["type"] == "http.response.start":
+                state["code"] = str(message["status"])
+            elif message["type"] == "http.response.body":
+                state["sent"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            _request_db.reset(token)
+            handler = _handler(scope)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, handler)
+            REQUESTS.inc(handler, state["code"])
+            if state["sent"]:
+                BYTES_SENT.inc(handler, amount=state["sent"])
+            if state["received"]:
+                BYTES_RECEIVED.inc(handler, amount=state["received"])
+            if db[1]:
+                DB_SECONDS.observe(db[0], handler)
+                DB_QUERIES.inc(handler, amount=db[1])
+
+
+def instrument_engine(sync_engine):
+    """Время SQL — в счётчик текущего запроса. SQLAlchemy переносит contextvars в свои greenlet'ы."""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_start"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        # after_cursor_execute для упавшего запроса не придёт
+        if exception_context.connection is not None:
+            exception_context.connection.info.pop("metrics_start", None)
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("metrics_start", None)
+        db = _request_db.get()
+        if db is not None and started is not None:
+            db[0] += time.perf_counter() - started
+            db[1] += 1
+
+
+# ================== СНИМКИ И ВЫДАЧА ==================
+def snapshot() -> dict:
+    families, samples = {}, []
+    for m in _registry:
+        families[m.name] = [m.kind, m.help]
+        for name, labels, value in m.samples():
+            samples.append([m.name, name, [list(p) for p in labels], value])
+    return {"families": families, "samples": samples}
+
+
+def _cumulative(snap: dict) -> dict:
+    """Только счётчики и гистограммы — то, что после смерти воркера остаётся в сумме."""
+    kinds = {name: fam[0] for name, fam in snap["families"].items()}
+    return {
+        "families": {name: fam for name, fam in snap["families"].items() if fam[0] in CUMULATIVE},
+        "samples": [s for s in snap["samples"] if kinds.get(s[0]) in CUMULATIVE],
+    }
+
+
+def _merge(snapshots: list[dict]) -> tuple[dict, dict]:
+    families, totals = {}, {}
+    for snap in snapshots:
+        families.update(snap["families"])
+        for family, name, labels, value in snap["samples"]:
+            key = (family, name, tuple(tuple(p) for p in labels))
+            totals[key] = totals.get(key, 0) + value
+    return families, totals
+
+
+def _number(value: float) -> str:
+    # без :g — счётчики байт быстро перерастают шесть значащих цифр
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(snapshots: list[dict]) -> str:
+    families, totals = _merge(snapshots)
+    by_family: dict[str, list] = {name: [] for name in families}
+    for (family, name, labels), value in totals.items():
+        by_family.setdefault(family, []).append((name, labels, value))
+    lines = []
+    for family, samples in by_family.items():
+        kind, help = families.get(family, ("untyped", ""))
+        lines.append(f"# HELP {family} {help}")
+        lines.append(f"# TYPE {family} {kind}")
+        for name, labels, value in samples:
+            label_str = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels)
+            lines.append(f"{name}{{{label_str}}} {_number(value)}" if label_str else f"{name} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+async def exposition(db: AsyncSession) -> str:
+    fresh = datetime.now() - timedelta(seconds=SNAPSHOT_STALE)
+    rows = (await db.execute(
+        select(MetricSnapshot.payload, MetricSnapshot.updated_at).where(MetricSnapshot.holder != SNAPSHOT_HOLDER)
+    )).all()
+    snapshots = [json.loads(r.payload) for r in rows]
+    snapshots = [snap if r.updated_at >= fresh else _cumulative(snap) for r, snap in zip(rows, snapshots)]
+    snapshots.append(snapshot())
+    return render(snapshots)
+
+
+async def retire(db: AsyncSession, cutoff: datetime):
+    """Снимки старше cutoff — в строку RETIRED (только накопительные метрики) и удалить. Коммит — на вызывающей стороне."""
+    rows = (await db.execute(
+        select(MetricSnapshot.holder, MetricSnapshot.payload)
+        .where(MetricSnapshot.updated_at < cutoff, MetricSnapshot.holder != RETIRED)
+    )).all()
+    if not rows:
+        return
+    snapshots = [_cumulative(json.loads(r.payload)) for r in rows]
+    prev = (await db.execute(
+        select(MetricSnapshot.payload).where(MetricSnapshot.holder == RETIRED)
+    )).scalar_one_or_none()
+    if prev:
+        snapshots.append(json.loads(prev))
+    families, totals = _merge(snapshots)
+    payload = json.dumps({
+        "families": families,
+        "samples": [[family, name, [list(p) for p in labels], value]
+                    for (family, name, labels), value in totals.items()],
+    }, separators=(",", ":"))
+
+    # тот же набор строк мог одновременно сложить другой воркер — тогда его версия и остаётся
+    deleted = await db.execute(delete(MetricSnapshot).where(
+        MetricSnapshot.holder.in_([r.holder for r in rows]), MetricSnapshot.updated_at < cutoff))
+    if deleted.rowcount != len(rows):
+        await db.rollback()
+        return
+    now = datetime.now()
+    stmt = insert(MetricSnapshot).values(holder=RETIRED, payload=payload, updated_at=now)
+    stmt = stmt.on_conflict_do_update(index_elements=[MetricSnapshot.holder],
+                                      set_={"payload": payload, "updated_at": now})
+    await db.execute(stmt)
+
+
+class SnapshotPublisher:
+    """Раз в PUBLISH_INTERVAL пишет снимок процесса в metric_snapshots (по строке на воркер)."""
+
+    def __init__(self, interval: float = PUBLISH_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, session_factory):
+        if self._task:
+            return
+        self._session_factory = session_factory
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            # последний снимок: счётчики, накопленные после предыдущего, не пропадут из суммы
+            try:
+                await self._publish(retire_old=False)
+            except Exception:
+                log.exception("final metrics snapshot failed")
+
+    async def _publish(self, retire_old: bool):
+        now = datetime.now()
+        payload = json.dumps(snapshot(), separators=(",", ":"))
+        stmt = insert(MetricSnapshot).values(holder=SNAPSHOT_HOLDER, payload=payload, updated_at=now)
+        stmt = stmt.on_conflict_do_update(index_elements=[MetricSnapshot.holder],
+                                          set_={"payload": payload, "updated_at": now})
+        async with self._session_factory() as db:
+            await db.execute(stmt)
+            await db.commit()
+            if retire_old:
+                # строки давно умерших воркеров — в RETIRED
+                await retire(db, now - timedelta(seconds=SNAPSHOT_KEEP))
+                await db.commit()
+
+    async def _run(self):
+        ticks = 0
+        while True:
+            await asyncio.sleep(self.interval)
+            ticks += 1
+            try:
+                await self._publish(retire_old=ticks % 120 == 0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("metrics snapshot failed")
+
+
+publisher = SnapshotPublisher()
@@ -0,0 +1,298 @@
+"""
+Миграции схемы поверх create_all.
+
+create_all создаёт только отсутствующие таблицы, поэтому индексы, новые колонки и
+перестройки для уже существующих БД описываются здесь. Каждая миграция идемпотентна
+(на свежей БД create_all уже создал то же самое) и выполняется один раз — номер
+применённой версии хранится в schema_migrations.
+
+    python -m api.migrations            # применить недостающие миграции
+    python -m api.migrations --check    # EXPLAIN QUERY PLAN горячих запросов
+
+Те же планы на свежей и на мигрированной БД проверяет tests/test_migrations.py.
+"""
+import logging
+import sys
+import urllib.parse
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import Engine, text
+from sqlalchemy.engine import Connection
+
+log = logging.getLogger(__name__)
+
+Migration = Callable[[Connection], None]
+MIGRATIONS: list[tuple[int, str, Migration]] = []
+
+
+def migration(version: int, name: str):
+    def register(fn: Migration) -> Migration:
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return register
+
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.exec_driver_sql(f"PRAGMA table_info({table})"))
+
+
+def has_table(conn: Connection, table: str) -> bool:
+    row = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (table,)
+    ).first()
+    return row is not None
+
+
+# ================== МИГРАЦИИ ==================
+@migration(1, "hot path indexes")
+def _m001_indexes(conn: Connection):
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_files_user_id ON files (user_id)")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_files_active_user_upload ON files (user_id, upload_date) WHERE is_active = 1"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_files_active_upload ON files (upload_date) WHERE is_active = 1"
+    )
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_file_access_code_type ON file_access (file_code, access_type)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_file_access_code_time ON file_access (file_code, access_time)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_file_access_type_time ON file_access (access_type, access_time)")
+    conn.exec_driver_sql("ANALYZE")
+
+
+@migration(2, "file counters")
+def _m002_file_counters(conn: Connection):
+    from .counters import rebuild
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS file_counters ("
+        "file_code VARCHAR(6) PRIMARY KEY, visits INTEGER NOT NULL DEFAULT 0, "
+        "downloads INTEGER NOT NULL DEFAULT 0, last_access DATETIME)"
+    )
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_file_counters_downloads ON file_counters (downloads)")
+    rebuild(conn)
+
+
+@migration(3, "stats rollups")
+def _m003_stats_rollup(conn: Connection):
+    from .rollups import rebuild
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS stats_rollup ("
+        "granularity VARCHAR(4) NOT NULL, bucket DATETIME NOT NULL, "
+        "uploads INTEGER NOT NULL DEFAULT 0, upload_bytes INTEGER NOT NULL DEFAULT 0, "
+        "deletes INTEGER NOT NULL DEFAULT 0, delete_bytes INTEGER NOT NULL DEFAULT 0, "
+        "visits INTEGER NOT NULL DEFAULT 0, downloads INTEGER NOT NULL DEFAULT 0, "
+        "PRIMARY KEY (granularity, bucket))"
+    )
+    rebuild(conn)
+
+
+@migration(4, "content-addressed blobs")
+def _m004_blobs(conn: Connection):
+    from .storage import convert_flat_directory
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS blobs ("
+        "digest VARCHAR(64) PRIMARY KEY, size INTEGER, refcount INTEGER NOT NULL DEFAULT 0, "
+        "created_at DATETIME, released_at DATETIME)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_blobs_unreferenced ON blobs (released_at) WHERE refcount = 0"
+    )
+    convert_flat_directory(conn)
+
+
+@migration(5, "files full-text index")
+def _m005_files_fts(conn: Connection):
+    from . import search
+    if search.create(conn):
+        search.rebuild(conn)
+
+
+@migration(6, "file expiry and user quotas")
+def _m006_expiry_quotas(conn: Connection):
+    from .quotas import rebuild
+    for column in ("expires_at", "deleted_at"):
+        if not has_column(conn, "files", column):
+            conn.exec_driver_sql(f"ALTER TABLE files ADD COLUMN {column} DATETIME")
+    if has_table(conn, "upload_sessions") and not has_column(conn, "upload_sessions", "expires_in"):
+        conn.exec_driver_sql("ALTER TABLE upload_sessions ADD COLUMN expires_in INTEGER")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_files_active_expires ON files (expires_at) "
+        "WHERE is_active = 1 AND expires_at IS NOT NULL"
+    )
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_files_inactive_deleted ON files (deleted_at) WHERE is_active = 0")
+    # уже удалённые файлы: срок до очистки отсчитывается от миграции
+    conn.execute(text("UPDATE files SET deleted_at = :t WHERE is_active = 0 AND deleted_at IS NULL"),
+                 {"t": datetime.now()})
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS user_quotas ("
+        "user_id INTEGER PRIMARY KEY, used_bytes INTEGER NOT NULL DEFAULT 0, "
+        "file_count INTEGER NOT NULL DEFAULT 0, limit_bytes INTEGER)"
+    )
+    rebuild(conn)
+
+
+def _decoded_name(name: str) -> str:
+    # percent-encoded имя из multipart бота — чистый ASCII; имена из браузера и LocalBackend не трогаем
+    if "%" not in name or not name.isascii():
+        return name
+    try:
+        return urllib.parse.unquote(name, errors="strict")
+    except UnicodeDecodeError:
+        return name
+
+
+@migration(7, "decode percent-encoded filenames")
+def _m007_decode_filenames(conn: Connection):
+    """
+    Раскодирует имена, которые бот присылал percent-encoded. Миграция с потерями:
+    отличить такое имя от настоящего "100%25.txt" по строке нельзя, решение
+    принимается эвристикой _decoded_name. Исходные имена сохраняются в
+    filename_decodes, id изменённых файлов пишутся в лог.
+    """
+    from . import search
+    rows = conn.exec_driver_sql("SELECT id, original_filename FROM files WHERE instr(original_filename, '%') > 0").fetchall()
+    changed = [(_decoded_name(name), id_, name) for id_, name in rows if _decoded_name(name) != name]
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS filename_decodes ("
+        "file_id INTEGER PRIMARY KEY, original_filename VARCHAR(255) NOT NULL, decoded_at DATETIME)"
+    )
+    if changed:
+        now = datetime.now()
+        conn.exec_driver_sql(
+            "INSERT OR IGNORE INTO filename_decodes (file_id, original_filename, decoded_at) VALUES (?, ?, ?)",
+            [(id_, name, now) for _, id_, name in changed],
+        )
+        conn.exec_driver_sql("UPDATE files SET original_filename = ? WHERE id = ?",
+                             [(decoded, id_) for decoded, id_, _ in changed])
+        log.warning("migration 7: decoded %d filenames, originals in filename_decodes: ids %s",
+                    len(changed), [id_ for _, id_, _ in changed])
+    if changed and has_table(conn, "files_fts"):
+        search.rebuild(conn)
+
+# ================== ПРИМЕНЕНИЕ ==================
+def current_version(conn: Connection) -> int:
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR(100), applied_at DATETIME)"
+    )
+    return conn.exec_driver_sql("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").scalar()
+
+
+def upgrade(engine: Engine) -> list[int]:
+    applied = []
+    with engine.begin() as conn:
+        version = current_version(conn)
+    for num, name, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if num <= version:
+            continue
+        # каждая миграция — в своей транзакции вместе с записью о ней
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": num, "n": name, "t": datetime.now()},
+            )
+        applied.append(num)
+    if applied:
+        # статистика из миграции 1 не знает о таблицах, созданных позже, — без неё
+        # планировщик ведёт top_downloaded сканом files вместо ix_file_counters_downloads
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    return applied
+
+
+# ================== ПРОВЕРКА ПЛАНОВ ==================
+# запрос горячего пути -> индекс, который он обязан использовать
+HOT_QUERIES: dict[str, tuple[str, dict, str]] = {
+    "file_counter": (
+        "SELECT * FROM file_counters WHERE file_code = :c",
+        {"c": "abcde"}, "sqlite_autoindex_file_counters_1",
+    ),
+    "recent_activity": (
+        "SELECT * FROM file_access WHERE file_code = :c ORDER BY access_time DESC LIMIT 10",
+        {"c": "abcde"}, "ix_file_access_code_time",
+    ),
+    "csv_export": (
+        "SELECT * FROM file_access WHERE file_code = :c ORDER BY access_time ASC",
+        {"c": "abcde"}, "ix_file_access_code_time",
+    ),
+    "rollup_totals": (
+        "SELECT sum(uploads), sum(visits), sum(downloads) FROM stats_rollup "
+        "WHERE granularity = 'day' AND bucket >= :t",
+        {"t": "2024-01-01"}, "sqlite_autoindex_stats_rollup_1",
+    ),
+    "rollup_series": (
+        "SELECT * FROM stats_rollup WHERE granularity = 'hour' AND bucket >= :s AND bucket <= :e",
+        {"s": "2024-01-01", "e": "2024-01-02"}, "sqlite_autoindex_stats_rollup_1",
+    ),
+    "top_downloaded": (
+        "SELECT files.file_code, files.original_filename, files.file_size, file_counters.downloads "
+        "FROM file_counters JOIN files ON files.file_code = file_counters.file_code "
+        "WHERE files.is_active = 1 AND file_counters.downloads > 0 "
+        "ORDER BY file_counters.downloads DESC LIMIT 10",
+        {}, "ix_file_counters_downloads",
+    ),
+    "user_files": (
+        "SELECT * FROM files WHERE user_id = :u AND is_active = 1 ORDER BY upload_date DESC",
+        {"u": 1}, "ix_files_active_user_upload",
+    ),
+    "admin_files": (
+        "SELECT * FROM files WHERE is_active = 1 AND (upload_date, id) < (:t, :i) "
+        "ORDER BY upload_date DESC, id DESC LIMIT 11",
+        {"t": "2024-01-01", "i": 1}, "ix_files_active_upload",
+    ),
+    "admin_logs": (
+        "SELECT * FROM file_access WHERE file_code = :c AND (access_time, id) < (:t, :i) "
+        "ORDER BY access_time DESC, id DESC LIMIT 21",
+        {"c": "abcde", "t": "2024-01-01", "i": 1}, "ix_file_access_code_time",
+    ),
+    "archive_due": (
+        "SELECT min(access_time) FROM file_access WHERE access_type = 'visit' AND access_time >= :t",
+        {"t": "2024-01-01"}, "ix_file_access_type_time",
+    ),
+    "archive_segments": (
+        "SELECT * FROM access_archive_segments WHERE file_code = :c ORDER BY month DESC",
+        {"c": "abcde"}, "sqlite_autoindex_access_archive_segments_1",
+    ),
+    "expired_files": (
+        "SELECT * FROM files WHERE is_active = 1 AND expires_at IS NOT NULL AND expires_at <= :t "
+        "ORDER BY expires_at LIMIT 100",
+        {"t": "2024-01-01"}, "ix_files_active_expires",
+    ),
+    "purge_candidates": (
+        "SELECT id, file_code FROM files WHERE is_active = 0 AND deleted_at < :t ORDER BY deleted_at LIMIT 50",
+        {"t": "2024-01-01"}, "ix_files_inactive_deleted",
+    ),
+    "broadcast_recipients": (
+        "SELECT DISTINCT user_id FROM files WHERE user_id > :u ORDER BY user_id LIMIT 200",
+        {"u": 0}, "ix_files_user_id",
+    ),
+}
+
+
+def plan_of(conn: Connection, sql: str, params: dict) -> str:
+    return " | ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params))
+
+
+def check_query_plans(conn: Connection) -> dict[str, str]:
+    """Возвращает {имя запроса: план} для запросов, которые не используют ожидаемый индекс."""
+    failures = {}
+    for name, (sql, params, index) in HOT_QUERIES.items():
+        plan = plan_of(conn, sql, params)
+        if index not in plan:
+            failures[name] = plan
+    return failures
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    if "--check" in sys.argv:
+        with engine.connect() as conn:
+            failures = check_query_plans(conn)
+        for name, plan in failures.items():
+            print(f"FAIL {name}: {plan}")
+        print("ok" if not failures else f"{len(failures)} hot queries without expected index")
+        sys.exit(1 if failures else 0)
+
+    print(f"applied: {upgrade(engine) or 'nothing to do'}")
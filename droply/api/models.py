@@ -1,35 +1,198 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text
-from sqlalchemy.ext.declarative import declarative_base
-from datetime import datetime
-import shortuuid
-
-Base = declarative_base()
-
-def generate_short_code():
-    return shortuuid.ShortUUID().random(length=6)
-
-class File(Base):
-    __tablename__ = "files"
-
-    id = Column(Integer, primary_key=True)
-    file_code = Column(String(6), unique=True, default=generate_short_code)
-    original_filename = Column(String(255))
-    stored_filename = Column(String(255))
-    file_size = Column(Integer)
-    user_id = Column(Integer)
-    upload_date = Column(DateTime, default=datetime.now)
-    notify_visits = Column(Boolean, default=True)
-    notify_downloads = Column(Boolean, default=True)
-    is_active = Column(Boolean, default=True)
-
-class FileAccess(Base):
-    __tablename__ = "file_access"
-
-    id = Column(Integer, primary_key=True)
-    file_code = Column(String(6))
-    access_type = Column(String(10))
-    ip_address = Column(String(45))
-    user_agent = Column(Text)
-    access_time = Column(DateTime, default=datetime.now)
-    country = Column(String(100))
-    city = Column(String(100))
\ No newline at end of file
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Index, text
+from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime
+import shortuuid
+
+Base = declarative_base()
+
+def generate_short_code():
+    return shortuuid.ShortUUID().random(length=6)
+
+class File(Base):
+    __tablename__ = "files"
+
+    id = Column(Integer, primary_key=True)
+    file_code = Column(String(6), unique=True, default=generate_short_code)
+    original_filename = Column(String(255))
+    stored_filename = Column(String(255))
+    file_size = Column(Integer)
+    user_id = Column(Integer)
+    upload_date = Column(DateTime, default=datetime.now)
+    notify_visits = Column(Boolean, default=True)
+    notify_downloads = Column(Boolean, default=True)
+    is_active = Column(Boolean, default=True)
+    expires_at = Column(DateTime)     # None — бессрочно
+    deleted_at = Column(DateTime)     # когда деактивирован; строку и логи вычистит api/sweeper.py
+
+    # id — rowid, SQLite и так дописывает его в конец каждого индекса
+    __table_args__ = (
+        Index("ix_files_user_id", "user_id"),
+        Index("ix_files_active_user_upload", "user_id", "upload_date", sqlite_where=text("is_active = 1")),
+        Index("ix_files_active_upload", "upload_date", sqlite_where=text("is_active = 1")),
+        Index("ix_files_active_expires", "expires_at",
+              sqlite_where=text("is_active = 1 AND expires_at IS NOT NULL")),
+        Index("ix_files_inactive_deleted", "deleted_at", sqlite_where=text("is_active = 0")),
+    )
+
+class FileAccess(Base):
+    __tablename__ = "file_access"
+
+    id = Column(Integer, primary_key=True)
+    file_code = Column(String(6))
+    access_type = Column(String(10))
+    ip_address = Column(String(45))
+    user_agent = Column(Text)
+    access_time = Column(DateTime, default=datetime.now)
+    country = Column(String(100))
+    city = Column(String(100))
+
+    __table_args__ = (
+        Index("ix_file_access_code_type", "file_code", "access_type"),
+        Index("ix_file_access_code_time", "file_code", "access_time"),
+        Index("ix_file_access_type_time", "access_type", "access_time"),
+    )
+
+class FileCounter(Base):
+    __tablename__ = "file_counters"
+
+    file_code = Column(String(6), primary_key=True)
+    visits = Column(Integer, default=0, nullable=False)
+    downloads = Column(Integer, default=0, nullable=False)
+    last_access = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_file_counters_downloads", "downloads"),
+    )
+
+class StatsRollup(Base):
+    __tablename__ = "stats_rollup"
+
+    granularity = Column(String(4), primary_key=True)   # hour | day
+    bucket = Column(DateTime, primary_key=True)
+    uploads = Column(Integer, default=0, nullable=False)
+    upload_bytes = Column(Integer, default=0, nullable=False)
+    deletes = Column(Integer, default=0, nullable=False)
+    delete_bytes = Column(Integer, default=0, nullable=False)
+    visits = Column(Integer, default=0, nullable=False)
+    downloads = Column(Integer, default=0, nullable=False)
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    digest = Column(String(64), primary_key=True)   # sha256 содержимого, он же stored_filename
+    size = Column(Integer)
+    refcount = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+    released_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_blobs_unreferenced", "released_at", sqlite_where=text("refcount = 0")),
+    )
+
+class BroadcastJob(Base):
+    __tablename__ = "broadcast_jobs"
+
+    id = Column(Integer, primary_key=True)
+    admin_id = Column(Integer)
+    message = Column(Text)
+    status = Column(String(10), default="pending", nullable=False)   # pending | running | done | failed
+    # получатели обходятся по возрастанию user_id; всё <= cursor уже отправлено
+    cursor = Column(Integer, default=0, nullable=False)
+    total = Column(Integer, default=0, nullable=False)
+    sent = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_broadcast_jobs_status", "status"),
+    )
+
+class Lease(Base):
+    __tablename__ = "leases"
+
+    # фоновые задачи-одиночки при нескольких воркерах (api/leases.py)
+    name = Column(String(50), primary_key=True)
+    holder = Column(String(100), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    # докуда держатель обработал свою работу (например, file_access.id для уведомлений)
+    cursor = Column(Integer)
+
+class CacheInvalidation(Base):
+    __tablename__ = "cache_invalidations"
+
+    # изменённые файлы — воркеры сбрасывают свои копии filecache (api/filecache.py)
+    id = Column(Integer, primary_key=True)
+    file_code = Column(String(6), nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    # загрузка по частям (api/uploads.py); id — случайный токен, он же право дописывать части
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer)
+    filename = Column(String(255))
+    size = Column(Integer, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    expires_in = Column(Integer)                                   # срок жизни файла после finalize, секунд
+    status = Column(String(10), default="open", nullable=False)   # open | finalizing | done
+    file_code = Column(String(6))                                  # результат finalize
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_upload_sessions_updated", "updated_at"),
+    )
+
+class UploadChunk(Base):
+    __tablename__ = "upload_chunks"
+
+    session_id = Column(String(32), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    size = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+
+class UserQuota(Base):
+    __tablename__ = "user_quotas"
+
+    # сумма по активным файлам владельца, ведётся в тех же транзакциях (api/quotas.py)
+    user_id = Column(Integer, primary_key=True)
+    used_bytes = Column(Integer, default=0, nullable=False)
+    file_count = Column(Integer, default=0, nullable=False)
+    limit_bytes = Column(Integer)     # None — USER_QUOTA_BYTES из конфига
+
+class AccessArchive(Base):
+    __tablename__ = "access_archives"
+
+    # месяц file_access, вынесенный в gzip-CSV (api/archive.py); строки старше until — только в архивах
+    month = Column(String(7), primary_key=True)     # YYYY-MM
+    path = Column(String(255), nullable=False)
+    until = Column(DateTime, nullable=False)        # начало следующего месяца
+    rows = Column(Integer, default=0, nullable=False)
+    bytes = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+class AccessArchiveSegment(Base):
+    __tablename__ = "access_archive_segments"
+
+    # лог одного файла за месяц — отдельный gzip-член архива: [offset, offset + length)
+    file_code = Column(String(6), primary_key=True)
+    month = Column(String(7), primary_key=True)
+    offset = Column(Integer, nullable=False)
+    length = Column(Integer, nullable=False)
+    rows = Column(Integer, default=0, nullable=False)
+    visits = Column(Integer, default=0, nullable=False)
+    downloads = Column(Integer, default=0, nullable=False)
+    first_time = Column(DateTime)
+    last_time = Column(DateTime)
+
+class MetricSnapshot(Base):
+    __tablename__ = "metric_snapshots"
+
+    # последние значения метрик каждого воркера — /metrics отдаёт сумму по всем (api/metrics.py)
+    holder = Column(String(100), primary_key=True)
+    payload = Column(Text, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
@@ -0,0 +1,291 @@
+"""
+Уведомления владельцам о просмотрах и скачиваниях их файлов.
+
+Сообщение на каждое обращение упирается в flood-лимиты Telegram, поэтому события
+копятся по владельцу: первое после тишины уходит сразу, всё, что пришло в течение
+окна WINDOW, сливается в одну сводку ("37 скачиваний с 12 IP за 60 с"). Так в один
+чат уходит не больше сообщения за окно, а общий поток идёт через telegram_bucket,
+общий с рассылками.
+
+При перегрузке: очередь отправки ограничена (сводка остаётся копиться до следующего
+тика), число владельцев с несброшенной сводкой тоже — события новых сверх лимита
+отбрасываются и считаются в dropped.
+
+События notifier получает не от AccessLogWriter своего процесса, а из file_access
+(AccessFeed): при нескольких воркерах API лог пишут все, а notifier и AccessFeed
+работают только в держателе лизы (api/leases.py) — сводки не дублируются.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot.config import BASE_URL
+from . import leases, metrics, repository as repo
+from .access_log import AccessEvent
+from .filecache import FileMeta
+from .ratelimit import TokenBucket, telegram_bucket
+
+log = logging.getLogger(__name__)
+
+WINDOW = 60.0             # окно сводки, секунд
+CHAT_RATE = 1.0           # сообщений/с в один чат — окно не может быть короче 1/CHAT_RATE
+MAX_OWNERS = 10_000       # владельцев с несброшенной сводкой
+MAX_FILES = 20            # файлов в одной сводке, остальные события — строкой "ещё N"
+MAX_IPS = 1_000           # уникальные IP на файл считаем до этого порога
+MAX_OUTBOX = 1_000        # сообщений в очереди на отправку
+TICK = 1.0
+FEED_INTERVAL = 1.0       # как часто AccessFeed читает новые строки file_access
+FEED_BATCH = 1_000
+
+
+@dataclass
+class _FileDigest:
+    filename: str
+    visits: int = 0
+    downloads: int = 0
+    ips: set = field(default_factory=set)
+    last: Optional[AccessEvent] = None
+
+
+@dataclass
+class _Owner:
+    last_sent: float = float("-inf")
+    files: dict = field(default_factory=dict)   # file_code -> _FileDigest
+    events: int = 0
+    overflow: int = 0                           # события по файлам сверх MAX_FILES
+
+
+def _place(e: AccessEvent) -> str:
+    return f"{e.country}, {e.city}".strip(", ").strip()
+
+def single_message(e: AccessEvent, filename: str) -> str:
+    place = _place(e)
+    place_txt = f" 🌍 {place}" if place else ""
+    return (
+        f"🔔 <b>{'Просмотр страницы' if e.access_type=='visit' else 'Скачивание файла'}\n\n"
+        f"📁 {filename}\n"
+        f"🔗 <code>{BASE_URL}/{e.file_code}</code>\n"
+        f"🕒 {e.access_time.strftime('%d.%m.%Y %H:%M:%S')}\n"
+        f"🌐 IP: <code>{e.ip_address}</code>{place_txt}</b>\n"
+    )
+
+def digest_message(owner: _Owner, window: float) -> str:
+    if owner.events == 1:
+        (code, d), = owner.files.items()
+        return single_message(d.last, d.filename)
+
+    lines = [f"🔔 <b>Активность за последние {int(window)} с</b>\n"]
+    for code, d in sorted(owner.files.items(), key=lambda kv: -(kv[1].visits + kv[1].downloads)):
+        ips = f"{len(d.ips)}+" if len(d.ips) >= MAX_IPS else str(len(d.ips))
+        parts = []
+        if d.downloads:
+            parts.append(f"⬇️ {d.downloads}")
+        if d.visits:
+            parts.append(f"👁 {d.visits}")
+        lines.append(
+            f"📁 <b>{d.filename}</b>\n"
+            f"   {' | '.join(parts)} с {ips} IP\n"
+            f"   🔗 <code>{BASE_URL}/{code}</code>"
+        )
+    if owner.overflow:
+        lines.append(f"… и ещё {owner.overflow} событий по другим файлам")
+    return "\n".join(lines)
+
+
+class OwnerNotifier:
+    def __init__(self, window: float = WINDOW, bucket: TokenBucket = telegram_bucket,
+                 max_owners: int = MAX_OWNERS, max_outbox: int = MAX_OUTBOX):
+        self.window = max(window, 1 / CHAT_RATE)
+        self.max_owners = max_owners
+        self._max_outbox = max_outbox
+        self._bucket = bucket
+        self._owners: dict[int, _Owner] = {}
+        self._outbox: asyncio.Queue | None = None
+        self._bot: Optional[Bot] = None
+        self._tasks: list[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self, bot: Bot):
+        self._bot = bot
+        self._outbox = asyncio.Queue(maxsize=self._max_outbox)
+        self._tasks = [asyncio.create_task(self._tick_loop()), asyncio.create_task(self._send_loop())]
+
+    async def stop(self, drain_timeout: float = 5.0):
+        if not self._tasks:
+            return
+        # несброшенные сводки — в очередь, сколько влезет, и даём ей стечь
+        self._flush_due(force=True)
+        try:
+            await asyncio.wait_for(self._outbox.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "owners": len(self._owners),
+            "outbox": self._outbox.qsize() if self._outbox else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    # ---------- приём событий ----------
+    def add_many(self, events: Iterable[AccessEvent]):
+        now = asyncio.get_running_loop().time()
+        for e in events:
+            self.add(e, now)
+
+    def add(self, e: AccessEvent, now: float):
+        file = e.file
+        if file is None or not file.user_id:
+            return
+        if e.access_type == "visit" and not file.notify_visits:
+            return
+        if e.access_type == "download" and not file.notify_downloads:
+            return
+
+        owner = self._owners.get(file.user_id)
+        if owner is None:
+            if len(self._owners) >= self.max_owners:
+                self.dropped += 1
+                return
+            owner = self._owners[file.user_id] = _Owner()
+
+        # тишина дольше окна — первое событие отправляем сразу, без ожидания сводки
+        if not owner.events and now - owner.last_sent >= self.window:
+            if self._enqueue(file.user_id, single_message(e, file.original_filename)):
+                owner.last_sent = now
+                return
+
+        owner.events += 1
+        d = owner.files.get(e.file_code)
+        if d is None:
+            if len(owner.files) >= MAX_FILES:
+                owner.overflow += 1
+                return
+            d = owner.files[e.file_code] = _FileDigest(filename=file.original_filename)
+        if e.access_type == "download":
+            d.downloads += 1
+        else:
+            d.visits += 1
+        if len(d.ips) < MAX_IPS:
+            d.ips.add(e.ip_address)
+        d.last = e
+
+    # ---------- сводки и отправка ----------
+    def _enqueue(self, chat_id: int, text: str) -> bool:
+        try:
+            self._outbox.put_nowait((chat_id, text))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def _flush_due(self, force: bool = False):
+        now = asyncio.get_running_loop().time()
+        for chat_id, owner in list(self._owners.items()):
+            due = force or now - owner.last_sent >= self.window
+            if not owner.events:
+                if due:
+                    del self._owners[chat_id]   # простаивает — состояние не нужно
+                continue
+            if due and self._enqueue(chat_id, digest_message(owner, self.window)):
+                self._owners[chat_id] = _Owner(last_sent=now)
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(TICK)
+            self._flush_due()
+
+    async def _send_loop(self):
+        while True:
+            chat_id, text = await self._outbox.get()
+            try:
+                await self._bucket.acquire()
+                started = time.perf_counter()
+                await self._bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML",
+                                             disable_web_page_preview=True)
+                metrics.TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started, "notify")
+                self.sent += 1
+            except TelegramRetryAfter as e:
+                # Telegram сам сказал, сколько молчать — тормозим весь поток и повторяем
+                metrics.TELEGRAM_ERRORS.inc("notify", "retry_after")
+                self._bucket.pause(e.retry_after)
+                if not self._enqueue(chat_id, text):
+                    self.dropped += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.TELEGRAM_ERRORS.inc("notify", type(e).__name__)
+                self.failed += 1
+                log.debug("notification to %s failed", chat_id, exc_info=True)
+            finally:
+                self._outbox.task_done()
+
+
+notifier = OwnerNotifier()
+
+
+class AccessFeed:
+    """
+    Читает file_access по возрастанию id и передаёт события notifier. Позиция
+    хранится в лизе (leases.cursor), так что новый держатель продолжает с места
+    предыдущего; при самом первом запуске — с конца лога, без истории.
+    """
+
+    def __init__(self, target: OwnerNotifier, lease: str, interval: float = FEED_INTERVAL,
+                 batch: int = FEED_BATCH):
+        self.target = target
+        self.lease = lease
+        self.interval = interval
+        self.batch = batch
+        self._session_factory = None
+        self._task: asyncio.Task | None = None
+
+    def start(self, session_factory):
+        self._session_factory = session_factory
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        async with self._session_factory() as db:
+            pos = await leases.get_cursor(db, self.lease)
+            if pos is None:
+                pos = await repo.last_access_id(db)
+        while True:
+            rows = []
+            try:
+                async with self._session_factory() as db:
+                    rows = await repo.access_with_files_after(db, pos, self.batch)
+                    if rows:
+                        self.target.add_many(
+                            AccessEvent(a.file_code, a.access_type, a.ip_address, a.user_agent or "",
+                                        a.access_time, a.country or "", a.city or "", file=FileMeta.of(f))
+                            for a, f in rows
+                        )
+                        pos = rows[-1].FileAccess.id
+                        await leases.set_cursor(db, self.lease, pos)
+                        await db.commit()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("access feed failed")
+            if len(rows) < self.batch:
+                await asyncio.sleep(self.interval)
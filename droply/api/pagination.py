@@ -0,0 +1,45 @@
+"""
+Keyset-пагинация: страница продолжается со строки после (ключ сортировки, id)
+последней строки предыдущей страницы. Курсор для клиента непрозрачен —
+base64 от JSON с этими значениями.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Callable, Optional, Union
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+Key = Union[datetime, float]
+
+
+def encode_cursor(key: Key, row_id: int) -> str:
+    # t — дата (upload_date, access_time), r — ранг полнотекстового поиска
+    value = ["t", key.isoformat()] if isinstance(key, datetime) else ["r", key]
+    raw = json.dumps([*value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(token: Optional[str], kind: str = "t") -> Optional[tuple[Key, int]]:
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        tag, key, row_id = json.loads(raw)
+        if tag != kind:
+            raise ValueError(f"cursor of kind {tag!r}, expected {kind!r}")
+        return (datetime.fromisoformat(key) if tag == "t" else float(key)), int(row_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+def page_of(rows: list, size: int, key: Callable[[Any], tuple[Key, int]]) -> tuple[list, Optional[str]]:
+    # запрашиваем size+1 строк: лишняя говорит, что дальше есть ещё страница
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, encode_cursor(*key(rows[-1]))
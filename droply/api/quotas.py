@@ -0,0 +1,88 @@
+"""
+Квоты хранилища по пользователям.
+
+user_quotas держит занятый объём и число активных файлов владельца; они меняются
+в той же транзакции, что и сам файл (загрузка, замена, деактивация), так что
+проверка при загрузке — один UPDATE с условием, без SUM по files. Загрузки без
+user_id (веб-форма) квотой не ограничены.
+
+    python -m api.quotas --rebuild    # пересчитать из files
+"""
+import sys
+from typing import Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import USER_QUOTA_BYTES
+from .models import UserQuota
+
+
+UNLIMITED = 2 ** 62   # USER_QUOTA_BYTES=None — без общего лимита, личный limit_bytes всё равно действует
+
+
+def _limit():
+    return func.coalesce(UserQuota.limit_bytes, USER_QUOTA_BYTES if USER_QUOTA_BYTES is not None else UNLIMITED)
+
+
+async def reserve(db: AsyncSession, user_id: Optional[int], size: int, files: int = 1) -> bool:
+    """Добавляет size байт (может быть < 0 при замене на меньший файл), если влезает. Коммит — снаружи."""
+    if user_id is None:
+        return True
+    await db.execute(insert(UserQuota).values(user_id=user_id, used_bytes=0, file_count=0)
+                     .on_conflict_do_nothing(index_elements=[UserQuota.user_id]))
+    cond = [UserQuota.user_id == user_id]
+    if size > 0:
+        cond.append(UserQuota.used_bytes + size <= _limit())
+    res = await db.execute(
+        update(UserQuota).where(*cond)
+        .values(used_bytes=UserQuota.used_bytes + size, file_count=UserQuota.file_count + files)
+    )
+    return res.rowcount == 1
+
+
+async def free(db: AsyncSession, user_id: Optional[int], size: int, files: int = 1):
+    if user_id is None:
+        return
+    await db.execute(
+        update(UserQuota).where(UserQuota.user_id == user_id).values(
+            used_bytes=func.max(UserQuota.used_bytes - size, 0),
+            file_count=func.max(UserQuota.file_count - files, 0),
+        )
+    )
+
+
+async def usage(db: AsyncSession, user_id: int) -> dict:
+    row = (await db.execute(
+        select(UserQuota.used_bytes, UserQuota.file_count, _limit()).where(UserQuota.user_id == user_id)
+    )).first()
+    used, count, limit = row if row else (0, 0, USER_QUOTA_BYTES)
+    return {"used_bytes": used, "file_count": count, "limit_bytes": None if limit == UNLIMITED else limit}
+
+
+async def set_limit(db: AsyncSession, user_id: int, limit_bytes: Optional[int]):
+    stmt = insert(UserQuota).values(user_id=user_id, used_bytes=0, file_count=0, limit_bytes=limit_bytes)
+    stmt = stmt.on_conflict_do_update(index_elements=[UserQuota.user_id], set_={"limit_bytes": limit_bytes})
+    await db.execute(stmt)
+
+
+def rebuild(conn: Connection):
+    # личные лимиты сохраняем, пересчитываем только занятое
+    conn.exec_driver_sql("UPDATE user_quotas SET used_bytes = 0, file_count = 0")
+    conn.exec_driver_sql(
+        "INSERT INTO user_quotas (user_id, used_bytes, file_count) "
+        "SELECT user_id, COALESCE(SUM(file_size), 0), COUNT(*) FROM files "
+        "WHERE is_active = 1 AND user_id IS NOT NULL GROUP BY user_id "
+        "ON CONFLICT(user_id) DO UPDATE SET used_bytes = excluded.used_bytes, file_count = excluded.file_count"
+    )
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    if "--rebuild" in sys.argv:
+        with engine.begin() as conn:
+            rebuild(conn)
+        print("quotas rebuilt")
@@ -0,0 +1,209 @@
+"""
+Отдача файлов с поддержкой HTTP Range (одиночные и multipart/byteranges),
+условных запросов (If-None-Match / If-Modified-Since / If-Range) и строгих ETag.
+"""
+import os
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator, Optional
+
+import aiofiles
+import aiofiles.os
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 16     # больше — отдаём файл целиком, чтобы не плодить микроответы
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+@dataclass
+class StoredStat:
+    path: str
+    size: int
+    etag: str
+    last_modified: datetime
+
+
+async def stat_stored(path: str) -> Optional[StoredStat]:
+    try:
+        st = await aiofiles.os.stat(path)
+    except FileNotFoundError:
+        return None
+    # имя хранимого файла — sha256 содержимого, это и есть строгий валидатор
+    name = os.path.splitext(os.path.basename(path))[0]
+    etag = f'"{name}"'
+    last_modified = datetime.fromtimestamp(int(st.st_mtime), tz=timezone.utc)
+    return StoredStat(path=path, size=st.st_size, etag=etag, last_modified=last_modified)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[list[tuple[int, int]]]:
+    """
+    Возвращает отсортированные слитые диапазоны [start, end] включительно, либо None,
+    если заголовка нет или он синтаксически неверен (тогда отдаётся весь файл).
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        start_s, sep, end_s = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if start_s == "":
+                length = int(end_s)
+                if length <= 0:
+                    continue
+                start, end = max(0, size - length), size - 1
+            else:
+                start = int(start_s)
+                end = int(end_s) if end_s else size - 1
+                if end_s and end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _etag_list(header: str) -> list[str]:
+    return [t.strip().removeprefix("W/") for t in header.split(",") if t.strip()]
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_not_modified(request: Request, st: StoredStat) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = _etag_list(inm)
+        return "*" in tags or st.etag in tags
+    ims = _parse_http_date(request.headers.get("if-modified-since"))
+    return ims is not None and st.last_modified <= ims
+
+
+def _if_range_ok(request: Request, st: StoredStat) -> bool:
+    value = request.headers.get("if-range")
+    if value is None:
+        return True
+    value = value.strip()
+    if value.startswith('"'):
+        return value == st.etag
+    date = _parse_http_date(value)
+    return date is not None and date == st.last_modified
+
+
+def requested_ranges(request: Request, st: StoredStat) -> Optional[list[tuple[int, int]]]:
+    if not _if_range_ok(request, st):
+        return None
+    return parse_range(request.headers.get("range"), st.size)
+
+
+async def _read_range(path: str, start: int, end: int) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        left = end - start + 1
+        while left > 0:
+            chunk = await f.read(min(CHUNK_SIZE, left))
+            if not chunk:
+                break
+            left -= len(chunk)
+            yield chunk
+
+
+def file_response(request: Request, st: StoredStat, headers: dict,
+                  media_type: str = "application/octet-stream") -> Response:
+    headers = {
+        **headers,
+        "Accept-Ranges": "bytes",
+        "ETag": st.etag,
+        "Last-Modified": format_datetime(st.last_modified, usegmt=True),
+    }
+
+    if is_not_modified(request, st):
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Disposition"})
+
+    try:
+        ranges = requested_ranges(request, st)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.size}"})
+
+    if not ranges:
+        headers["Content-Length"] = str(st.size)
+        return StreamingResponse(_read_range(st.path, 0, st.size - 1), media_type=media_type, headers=headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{st.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(_read_range(st.path, start, end), status_code=206,
+                                 media_type=media_type, headers=headers)
+
+    boundary = uuid.uuid4().hex
+    parts = [
+        ((f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+          f"Content-Range: bytes {start}-{end}/{st.size}\r\n\r\n").encode(), start, end)
+        for start, end in ranges
+    ]
+    closing = f"--{boundary}--\r\n".encode()
+    headers["Content-Length"] = str(
+        sum(len(head) + (end - start + 1) + 2 for head, start, end in parts) + len(closing)
+    )
+
+    async def multipart():
+        for head, start, end in parts:
+            yield head
+            async for chunk in _read_range(st.path, start, end):
+                yield chunk
+            yield b"\r\n"
+        yield closing
+
+    return StreamingResponse(multipart(), status_code=206,
+                             media_type=f"multipart/byteranges; boundary={boundary}", headers=headers)
+
+
+def is_download_start(request: Request, response: Response, size: int) -> bool:
+    """
+    Одна логическая загрузка = полный ответ или первый кусок (диапазон с байта 0).
+    size — реальный размер файла: суффиксный bytes=-N не меньше размера начинается с нуля.
+    """
+    if response.status_code == 200:
+        return True
+    if response.status_code != 206:
+        return False
+    try:
+        ranges = parse_range(request.headers.get("range"), size)
+    except RangeNotSatisfiable:
+        return False
+    return bool(ranges) and ranges[0][0] == 0
@@ -0,0 +1,50 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    rate токенов в секунду, не больше capacity про запас. pause() — принудительная
+    тишина (например, по RetryAfter от Telegram): до её конца токены не копятся.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._ts = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        if now <= self._ts:
+            return
+        self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def try_acquire(self, n: float = 1) -> bool:
+        self._refill(time.monotonic())
+        if self._tokens >= n:
+            self._tokens -= n
+            return True
+        return False
+
+    async def acquire(self, n: float = 1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return
+                await asyncio.sleep(max(0.0, self._ts - now) + (n - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._tokens = 0
+        self._ts = max(self._ts, time.monotonic() + seconds)
+
+
+# общий лимит бота на исходящие сообщения (Telegram: ~30/с на бота, ~1/с в один чат);
+# делят уведомления владельцам и рассылки
+TELEGRAM_GLOBAL_RATE = 25.0
+telegram_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE)
@@ -0,0 +1,130 @@
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import Row, select, func, desc, or_, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import File, FileAccess, FileCounter
+
+
+# ================== FILE ==================
+async def get_file(db: AsyncSession, file_code: str) -> Optional[File]:
+    res = await db.execute(select(File).where(File.file_code == file_code).limit(1))
+    return res.scalar_one_or_none()
+
+async def get_active_file(db: AsyncSession, file_code: str) -> Optional[File]:
+    res = await db.execute(
+        select(File).where(File.file_code == file_code, File.is_active == True).limit(1)
+    )
+    return res.scalar_one_or_none()
+
+async def add_file(db: AsyncSession, **fields) -> File:
+    # коммит — на вызывающей стороне, вместе с агрегатами
+    file_obj = File(**fields)
+    db.add(file_obj)
+    await db.flush()
+    return file_obj
+
+async def list_user_files(db: AsyncSession, user_id: int) -> list[File]:
+    res = await db.execute(
+        select(File).where(File.user_id == user_id, File.is_active == True).order_by(desc(File.upload_date))
+    )
+    return list(res.scalars())
+
+def _search_cond(q: Optional[str]) -> list:
+    cond = [File.is_active == True]
+    if q:
+        like = f"%{q}%"
+        cond.append(or_(File.original_filename.ilike(like), File.file_code.ilike(like)))
+    return cond
+
+async def search_active_files(db: AsyncSession, q: Optional[str], after: Optional[tuple[datetime, int]],
+                              limit: int) -> list[File]:
+    # keyset по (upload_date, id) — ix_files_active_upload, id в нём как rowid
+    cond = _search_cond(q)
+    if after:
+        cond.append(tuple_(File.upload_date, File.id) < tuple_(*after))
+    res = await db.execute(
+        select(File).where(*cond).order_by(desc(File.upload_date), desc(File.id)).limit(limit)
+    )
+    return list(res.scalars())
+
+async def count_active_files(db: AsyncSession, q: Optional[str]) -> int:
+    return (await db.execute(select(func.count(File.id)).where(*_search_cond(q)))).scalar_one()
+
+async def top_downloaded_files(db: AsyncSession, limit: int = 10):
+    res = await db.execute(
+        select(File.file_code, File.original_filename, File.file_size, FileCounter.downloads)
+        .join(File, File.file_code == FileCounter.file_code)
+        .where(File.is_active == True, FileCounter.downloads > 0)
+        .order_by(desc(FileCounter.downloads)).limit(limit)
+    )
+    return res.all()
+
+async def count_user_ids(db: AsyncSession) -> int:
+    res = await db.execute(select(func.count(File.user_id.distinct())).where(File.user_id.isnot(None)))
+    return res.scalar_one()
+
+async def user_ids_after(db: AsyncSession, after: int, limit: int) -> list[int]:
+    # keyset по ix_files_user_id: страница начинается с поиска в индексе, а не со скана
+    res = await db.execute(
+        select(File.user_id).where(File.user_id > after).distinct().order_by(File.user_id).limit(limit)
+    )
+    return list(res.scalars())
+
+
+# ================== COUNTERS ==================
+async def get_counter(db: AsyncSession, file_code: str) -> Optional[FileCounter]:
+    return await db.get(FileCounter, file_code)
+
+
+# ================== FILE ACCESS ==================
+async def recent_access(db: AsyncSession, file_code: str, limit: int = 10) -> list[FileAccess]:
+    res = await db.execute(
+        select(FileAccess).where(FileAccess.file_code == file_code)
+        .order_by(FileAccess.access_time.desc()).limit(limit)
+    )
+    return list(res.scalars())
+
+async def access_logs_after(db: AsyncSession, file_code: str, after: Optional[tuple[datetime, int]],
+                            limit: int, not_before: Optional[datetime] = None) -> list[FileAccess]:
+    # keyset по (access_time, id) — ix_file_access_code_time
+    cond = [FileAccess.file_code == file_code]
+    if not_before:
+        cond.append(FileAccess.access_time >= not_before)   # старше — уже в архиве (api/archive.py)
+    if after:
+        cond.append(tuple_(FileAccess.access_time, FileAccess.id) < tuple_(*after))
+    res = await db.execute(
+        select(FileAccess).where(*cond)
+        .order_by(desc(FileAccess.access_time), desc(FileAccess.id)).limit(limit)
+    )
+    return list(res.scalars())
+
+async def stream_access_logs(db: AsyncSession, file_code: str, since: Optional[datetime] = None,
+                             until: Optional[datetime] = None, batch: int = 1000) -> AsyncIterator[list[Row]]:
+    # только нужные колонки и yield_per: в памяти одна пачка строк, а не весь лог
+    cond = [FileAccess.file_code == file_code]
+    if since:
+        cond.append(FileAccess.access_time >= since)
+    if until:
+        cond.append(FileAccess.access_time < until)
+    stmt = (
+        select(FileAccess.access_time, FileAccess.access_type, FileAccess.ip_address,
+               FileAccess.country, FileAccess.city, FileAccess.user_agent)
+        .where(*cond).order_by(FileAccess.access_time.asc())
+        .execution_options(yield_per=batch)
+    )
+    result = await db.stream(stmt)
+    async for part in result.partitions():
+        yield part
+
+async def last_access_id(db: AsyncSession) -> int:
+    return (await db.execute(select(func.coalesce(func.max(FileAccess.id), 0)))).scalar_one()
+
+async def access_with_files_after(db: AsyncSession, after_id: int, limit: int) -> list[Row]:
+    # хвост лога по id (rowid, без отдельного индекса) вместе с файлом — для уведомлений
+    res = await db.execute(
+        select(FileAccess, File).join(File, File.file_code == FileAccess.file_code)
+        .where(FileAccess.id > after_id).order_by(FileAccess.id).limit(limit)
+    )
+    return res.all()
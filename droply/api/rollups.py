@@ -0,0 +1,153 @@
+"""
+Почасовые и посуточные агрегаты для админ-дашборда (stats_rollup).
+
+Загрузки/удаления прибавляются в транзакции соответствующего роута, визиты и
+скачивания — пачкой из access_log. Дашборд и недельные дельты читают несколько
+сотен строк вместо сканирования files/file_access.
+
+    python -m api.rollups --rebuild    # пересчитать агрегаты из files, file_access и архивов лога
+"""
+import sys
+from collections import defaultdict
+from itertools import islice
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import archive
+from .migrations import has_column
+from .models import StatsRollup
+
+METRICS = ("uploads", "upload_bytes", "deletes", "delete_bytes", "visits", "downloads")
+MAX_POINTS = 5000
+
+
+def _trunc_hour(t: datetime) -> datetime:
+    return t.replace(minute=0, second=0, microsecond=0)
+
+def _trunc_day(t: datetime) -> datetime:
+    return t.replace(hour=0, minute=0, second=0, microsecond=0)
+
+GRANULARITIES = {
+    "hour": (_trunc_hour, timedelta(hours=1), "%Y-%m-%d %H:00:00.000000"),
+    "day": (_trunc_day, timedelta(days=1), "%Y-%m-%d 00:00:00.000000"),
+}
+
+
+async def _upsert(db: AsyncSession, rows: list[dict]):
+    if not rows:
+        return
+    stmt = insert(StatsRollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StatsRollup.granularity, StatsRollup.bucket],
+        set_={m: getattr(StatsRollup, m) + getattr(stmt.excluded, m) for m in METRICS},
+    )
+    await db.execute(stmt)
+
+
+def _rows(deltas: dict[tuple[str, datetime], dict]) -> list[dict]:
+    return [
+        {"granularity": g, "bucket": b, **{m: d.get(m, 0) for m in METRICS}}
+        for (g, b), d in deltas.items()
+    ]
+
+
+async def bump(db: AsyncSession, when: datetime, **metrics: int):
+    """Прибавляет метрики к бакетам всех гранулярностей. Коммит — на вызывающей стороне."""
+    deltas = {(g, trunc(when)): metrics for g, (trunc, _, _) in GRANULARITIES.items()}
+    await _upsert(db, _rows(deltas))
+
+
+async def apply_access(db: AsyncSession, events: Iterable):
+    deltas: dict[tuple[str, datetime], dict] = defaultdict(lambda: defaultdict(int))
+    for e in events:
+        if e.access_type not in ("visit", "download"):
+            continue
+        for g, (trunc, _, _) in GRANULARITIES.items():
+            deltas[(g, trunc(e.access_time))][e.access_type + "s"] += 1
+    await _upsert(db, _rows(deltas))
+
+
+async def totals(db: AsyncSession, since: Optional[datetime] = None, granularity: str = "day") -> dict[str, int]:
+    stmt = select(*(func.coalesce(func.sum(getattr(StatsRollup, m)), 0) for m in METRICS))\
+        .where(StatsRollup.granularity == granularity)
+    if since:
+        stmt = stmt.where(StatsRollup.bucket >= since)
+    return dict(zip(METRICS, (await db.execute(stmt)).one()))
+
+
+async def series(db: AsyncSession, granularity: str, start: datetime, end: datetime) -> list[dict]:
+    trunc, step, _ = GRANULARITIES[granularity]
+    start, end = trunc(start), trunc(end)
+    if (end - start) / step > MAX_POINTS:
+        start = end - step * MAX_POINTS
+
+    res = await db.execute(
+        select(StatsRollup).where(
+            StatsRollup.granularity == granularity,
+            StatsRollup.bucket >= start,
+            StatsRollup.bucket <= end,
+        )
+    )
+    by_bucket = {r.bucket: r for r in res.scalars()}
+
+    points = []
+    t = start
+    while t <= end:
+        r = by_bucket.get(t)
+        points.append({"t": t.isoformat(), **{m: (getattr(r, m) if r else 0) for m in METRICS}})
+        t += step
+    return points
+
+
+def _load_archived(conn: Connection, batch: int = 10_000):
+    # заархивированные месяцы лога (api/archive.py) — во временную таблицу рядом с file_access
+    conn.exec_driver_sql("CREATE TEMP TABLE IF NOT EXISTS archived_access (access_time, access_type)")
+    conn.exec_driver_sql("DELETE FROM archived_access")
+    rows = archive.iter_all(conn)
+    while part := [(r.access_time.isoformat(sep=" "), r.access_type) for r in islice(rows, batch)]:
+        conn.exec_driver_sql("INSERT INTO archived_access VALUES (?, ?)", part)
+
+
+def rebuild(conn: Connection):
+    # удаление — в бакет deleted_at, как его считает deactivate_file (файлам, удалённым
+    # раньше, миграция 6 проставила её время); до миграции 6 колонки нет — бакет загрузки
+    deleted = "COALESCE(deleted_at, upload_date)" if has_column(conn, "files", "deleted_at") else "upload_date"
+    _load_archived(conn)
+    conn.exec_driver_sql("DELETE FROM stats_rollup")
+    for g, (_, _, fmt) in GRANULARITIES.items():
+        conn.exec_driver_sql(f"""
+            INSERT INTO stats_rollup (granularity, bucket, {", ".join(METRICS)})
+            SELECT '{g}', b, SUM(u), SUM(ub), SUM(d), SUM(db), SUM(v), SUM(dl) FROM (
+                SELECT strftime('{fmt}', upload_date) AS b, 1 AS u, COALESCE(file_size, 0) AS ub,
+                       0 AS d, 0 AS db, 0 AS v, 0 AS dl
+                FROM files
+                UNION ALL
+                SELECT strftime('{fmt}', {deleted}), 0, 0, 1, COALESCE(file_size, 0), 0, 0
+                FROM files WHERE is_active = 0
+                UNION ALL
+                SELECT strftime('{fmt}', access_time), 0, 0, 0, 0,
+                       access_type = 'visit', access_type = 'download'
+                FROM file_access
+                WHERE access_time >= (SELECT COALESCE(MAX(until), '') FROM access_archives)
+                UNION ALL
+                SELECT strftime('{fmt}', access_time), 0, 0, 0, 0,
+                       access_type = 'visit', access_type = 'download'
+                FROM archived_access
+            )
+            WHERE b IS NOT NULL
+            GROUP BY b
+        """)
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    if "--rebuild" in sys.argv:
+        with engine.begin() as conn:
+            rebuild(conn)
+        print("stats_rollup rebuilt")
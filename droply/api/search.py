@@ -0,0 +1,139 @@
+"""
+Полнотекстовый поиск файлов для админки на SQLite FTS5.
+
+files_fts(rowid = files.id) содержит только активные файлы. Имена хранятся в исходном
+виде (старые percent-encoded имена от бота раскодировала миграция 7). unicode61
+приводит регистр (в том числе кириллицу), ё сводится к е на стороне приложения. Запрос "отч 2024" превращается в
+'"отч"* "2024"*' — все слова по префиксу, ранжирование по bm25 (имя весомее кода).
+
+Синхронизация — в тех же транзакциях, что и запись в files (api/services.py):
+index_file при загрузке и замене, unindex_file при деактивации.
+rebuild() перестраивает индекс целиком (миграция 5, `python -m api.search --rebuild`).
+
+Если SQLite собран без FTS5, таблицы нет и поиск откатывается на ilike.
+"""
+import re
+import sys
+from typing import Optional
+
+from sqlalchemy import Column, Integer, MetaData, Table, Text, func, literal_column, select, text, tuple_
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import File
+
+FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5("
+    "name, file_code, tokenize = \"unicode61 remove_diacritics 2\", prefix = '2 3')"
+)
+NAME_WEIGHT = 10.0
+CODE_WEIGHT = 1.0
+REBUILD_BATCH = 5000
+
+# только для построения запросов — создаётся FTS_DDL, не create_all
+files_fts = Table("files_fts", MetaData(), Column("rowid", Integer), Column("name", Text), Column("file_code", Text))
+_fts = literal_column("files_fts")
+_rank = func.bm25(_fts, NAME_WEIGHT, CODE_WEIGHT)
+
+_available: Optional[bool] = None
+
+
+def normalize(s: str) -> str:
+    return (s or "").replace("ё", "е").replace("Ё", "Е")
+
+
+def fts_query(q: str) -> Optional[str]:
+    words = re.findall(r"\w+", normalize(q))
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
+
+
+async def available(db: AsyncSession) -> bool:
+    global _available
+    if _available is None:
+        res = await db.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'"))
+        _available = res.first() is not None
+    return _available
+
+
+# ================== СИНХРОНИЗАЦИЯ ==================
+async def index_file(db: AsyncSession, file: File):
+    if not await available(db):
+        return
+    await db.execute(text("DELETE FROM files_fts WHERE rowid = :id"), {"id": file.id})
+    await db.execute(
+        text("INSERT INTO files_fts (rowid, name, file_code) VALUES (:id, :name, :code)"),
+        {"id": file.id, "name": normalize(file.original_filename), "code": file.file_code},
+    )
+
+
+async def unindex_file(db: AsyncSession, file: File):
+    if await available(db):
+        await db.execute(text("DELETE FROM files_fts WHERE rowid = :id"), {"id": file.id})
+
+
+# ================== ПОИСК ==================
+async def search_files(db: AsyncSession, q: str, after: Optional[tuple[float, int]], limit: int):
+    """Строки (File, rank) по возрастанию (rank, id); None — поиск недоступен или запрос без слов."""
+    match = fts_query(q)
+    if match is None or not await available(db):
+        return None
+    cond = [_fts.op("MATCH")(match), File.is_active == True]
+    if after:
+        cond.append(tuple_(_rank, File.id) > tuple_(*after))
+    res = await db.execute(
+        select(File, _rank.label("rank"))
+        .join(files_fts, files_fts.c.rowid == File.id)
+        .where(*cond).order_by(_rank, File.id).limit(limit)
+    )
+    return res.all()
+
+
+async def count_matches(db: AsyncSession, q: str) -> Optional[int]:
+    match = fts_query(q)
+    if match is None or not await available(db):
+        return None
+    res = await db.execute(
+        select(func.count()).select_from(files_fts).join(File, files_fts.c.rowid == File.id)
+        .where(_fts.op("MATCH")(match), File.is_active == True)
+    )
+    return res.scalar_one()
+
+
+# ================== ПЕРЕСТРОЙКА ==================
+def create(conn: Connection) -> bool:
+    try:
+        conn.exec_driver_sql(FTS_DDL)
+    except Exception:
+        return False   # нет модуля fts5 — остаёмся на ilike
+    return True
+
+
+def rebuild(conn: Connection) -> int:
+    conn.exec_driver_sql("DELETE FROM files_fts")
+    last_id, total = 0, 0
+    while True:
+        rows = conn.exec_driver_sql(
+            "SELECT id, original_filename, file_code FROM files WHERE is_active = 1 AND id > ? ORDER BY id LIMIT ?",
+            (last_id, REBUILD_BATCH),
+        ).fetchall()
+        if not rows:
+            break
+        conn.exec_driver_sql(
+            "INSERT INTO files_fts (rowid, name, file_code) VALUES (?, ?, ?)",
+            [(r[0], normalize(r[1]), r[2]) for r in rows],
+        )
+        last_id, total = rows[-1][0], total + len(rows)
+    conn.exec_driver_sql("INSERT INTO files_fts (files_fts) VALUES ('optimize')")
+    return total
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    if "--rebuild" in sys.argv:
+        with engine.begin() as conn:
+            if not create(conn):
+                sys.exit("SQLite built without FTS5")
+            print(f"indexed {rebuild(conn)} active files")
@@ -0,0 +1,340 @@
+"""
+Операции над файлами, общие для HTTP-роутов (api/main.py) и бота.
+
+Бот, запущенный в одном процессе с API (run.py), вызывает их напрямую через
+bot/backend.py:LocalBackend — без JSON, loopback-запроса и лишней сессии.
+Результаты — те же словари, что уходят клиенту в JSON.
+"""
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+import shortuuid
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import ADMIN_IDS, BASE_URL, FILE_DEFAULT_TTL_DAYS, FILE_MAX_TTL_DAYS
+from . import storage, rollups, search, filecache, quotas, archive, repository as repo
+from .broadcast import broadcaster
+from .models import File, BroadcastJob
+from .pagination import InvalidCursor, decode_cursor, page_of
+
+NOTIFY_FIELDS = ("notify_visits", "notify_downloads")
+
+
+class ServiceError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def generate_short_code() -> str:
+    return shortuuid.ShortUUID().random(length=5)
+
+def check_admin(admin_id: int):
+    if admin_id not in ADMIN_IDS:
+        raise ServiceError(403, "Access denied")
+
+async def _owned_file(db: AsyncSession, file_code: str, user_id: Optional[int], active: bool = True) -> File:
+    # user_id=None — вызов от имени администратора, владелец не проверяется
+    file = await (repo.get_active_file if active else repo.get_file)(db, file_code)
+    if not file:
+        raise ServiceError(404, "File not found")
+    if user_id is not None and file.user_id != user_id:
+        raise ServiceError(403, "Access denied")
+    return file
+
+async def deactivate_file(db: AsyncSession, file: File):
+    # блоб удалит сборщик мусора, когда на него не останется ссылок, строку и логи — sweeper;
+    # filecache.invalidate — на вызывающей стороне, после коммита
+    if not file.is_active:
+        return
+    file.is_active = False
+    file.deleted_at = datetime.now()
+    await search.unindex_file(db, file)
+    await storage.release(db, file.stored_filename)
+    await quotas.free(db, file.user_id, file.file_size or 0)
+    await rollups.bump(db, datetime.now(), deletes=1, delete_bytes=file.file_size or 0)
+
+def expiry(expires_in: Optional[int]) -> Optional[datetime]:
+    """Срок жизни новой загрузки в секундах -> expires_at; None — срок по умолчанию из конфига."""
+    if expires_in is None:
+        return datetime.now() + timedelta(days=FILE_DEFAULT_TTL_DAYS) if FILE_DEFAULT_TTL_DAYS else None
+    if expires_in <= 0 or (FILE_MAX_TTL_DAYS and expires_in > FILE_MAX_TTL_DAYS * 86400):
+        raise ServiceError(400, f"expires_in must be between 1 second and {FILE_MAX_TTL_DAYS} days")
+    return datetime.now() + timedelta(seconds=expires_in)
+
+def _quota_exceeded() -> ServiceError:
+    return ServiceError(413, "Storage quota exceeded")
+
+
+# ================== ФАЙЛЫ ПОЛЬЗОВАТЕЛЯ ==================
+async def register_upload(db: AsyncSession, stored: storage.StoredFile, filename: Optional[str],
+                          user_id: Optional[int], expires_at: Optional[datetime] = None,
+                          file_code: Optional[str] = None) -> dict:
+    """
+    Новый File из уже записанного во временный файл содержимого (upload, finalize загрузки по частям).
+    Коммитит вместе с File всё, что вызывающий успел сделать в этой сессии.
+    """
+    file_code = file_code or generate_short_code()
+
+    if not await quotas.reserve(db, user_id, stored.size):
+        await db.rollback()
+        raise _quota_exceeded()
+    await storage.acquire(db, stored)
+    file_obj = await repo.add_file(
+        db,
+        file_code=file_code,
+        original_filename=filename or stored.stored_filename,
+        stored_filename=stored.stored_filename,
+        file_size=stored.size,
+        user_id=user_id,
+        upload_date=datetime.now(),
+        notify_visits=True,
+        notify_downloads=True,
+        expires_at=expires_at
+    )
+    await search.index_file(db, file_obj)
+    await rollups.bump(db, file_obj.upload_date, uploads=1, upload_bytes=stored.size)
+    await db.commit()
+    await filecache.invalidate(db, file_code)   # мог быть закэширован как несуществующий
+
+    return {
+        "success": True,
+        "file_code": file_code,
+        "filename": file_obj.original_filename,
+        "size": stored.size,
+        "expires_at": expires_at.isoformat() if expires_at else None,
+        "download_url": f"{BASE_URL}/{file_code}"
+    }
+
+async def upload(db: AsyncSession, chunks: AsyncIterator[bytes], filename: Optional[str], user_id: Optional[int],
+                 expires_in: Optional[int] = None) -> dict:
+    expires_at = expiry(expires_in)
+    stored = None
+    try:
+        stored = await storage.save_stream(chunks)
+        return await register_upload(db, stored, filename, user_id, expires_at)
+    finally:
+        if stored:
+            await storage.discard(stored)
+
+async def replace(db: AsyncSession, file_code: str, chunks: AsyncIterator[bytes], filename: Optional[str], user_id: int) -> dict:
+    file_obj = await _owned_file(db, file_code, user_id)
+
+    stored = None
+    try:
+        # новый блоб пишется целиком до того, как со старого будет снята ссылка
+        stored = await storage.save_stream(chunks)
+        if not await quotas.reserve(db, user_id, stored.size - (file_obj.file_size or 0), files=0):
+            await db.rollback()
+            raise _quota_exceeded()
+        await storage.acquire(db, stored)
+        await storage.release(db, file_obj.stored_filename)
+
+        await rollups.bump(db, datetime.now(), upload_bytes=stored.size, delete_bytes=file_obj.file_size or 0)
+        file_obj.original_filename = filename or stored.stored_filename
+        file_obj.stored_filename = stored.stored_filename
+        file_obj.file_size = stored.size
+        file_obj.upload_date = datetime.now()
+        await search.index_file(db, file_obj)
+        await db.commit()
+        await filecache.invalidate(db, file_code)
+    finally:
+        if stored:
+            await storage.discard(stored)
+
+    return {
+        "success": True,
+        "file_code": file_code,
+        "filename": file_obj.original_filename,
+        "size": stored.size,
+        "download_url": f"{BASE_URL}/{file_code}"
+    }
+
+async def file_stats(db: AsyncSession, file_code: str) -> dict:
+    file = await filecache.resolve(db, file_code)
+    if not file:
+        raise ServiceError(404, "File not found")
+
+    counter = await repo.get_counter(db, file_code)
+    recent_activity = await repo.recent_access(db, file_code, limit=10)
+
+    return {
+        "file_code": file_code,
+        "filename": file.original_filename,
+        "size": file.file_size,
+        "visits": counter.visits if counter else 0,
+        "downloads": counter.downloads if counter else 0,
+        "notify_visits": file.notify_visits,
+        "notify_downloads": file.notify_downloads,
+        "recent_activity": [
+            {
+                "access_type": a.access_type,
+                "ip_address": a.ip_address,
+                "user_agent": a.user_agent,
+                "country": a.country,
+                "city": a.city,
+                "access_time": a.access_time
+            }
+            for a in recent_activity
+        ]
+    }
+
+async def list_files(db: AsyncSession, user_id: int) -> dict:
+    user_files = await repo.list_user_files(db, user_id)
+    return {"files": [
+        {
+            "file_code": f.file_code,
+            "filename": f.original_filename,
+            "size": f.file_size,
+            "upload_date": f.upload_date.isoformat(),
+            "expires_at": f.expires_at.isoformat() if f.expires_at else None,
+            "notify_visits": f.notify_visits,
+            "notify_downloads": f.notify_downloads,
+            "download_url": f"{BASE_URL}/{f.file_code}"
+        } for f in user_files
+    ], "quota": await quotas.usage(db, user_id)}
+
+async def toggle(db: AsyncSession, file_code: str, field: str, user_id: Optional[int]) -> dict:
+    if field not in NOTIFY_FIELDS:
+        raise ServiceError(400, "Bad field")
+    file = await _owned_file(db, file_code, user_id)
+    setattr(file, field, not getattr(file, field))
+    await db.commit()
+    await filecache.invalidate(db, file_code)
+    return {"success": True, field: getattr(file, field)}
+
+async def delete(db: AsyncSession, file_code: str, user_id: Optional[int]) -> dict:
+    file = await _owned_file(db, file_code, user_id, active=False)
+    await deactivate_file(db, file)
+    await db.commit()
+    await filecache.invalidate(db, file_code)
+    return {"success": True, "message": "File deleted" if user_id is not None else "File deleted by admin"}
+
+
+# ================== АДМИНКА ==================
+async def admin_stats(db: AsyncSession) -> dict:
+    total = await rollups.totals(db)
+    week_ago = datetime.now() - timedelta(days=7)
+    week = await rollups.totals(db, since=week_ago, granularity="hour")
+
+    top_files = await repo.top_downloaded_files(db, limit=10)
+
+    return {
+        # число файлов — живым count по ix_files_active_upload: разность загрузок и
+        # удалений в роллапах расходится с таблицей после очистки sweeper'ом
+        "total_files": await repo.count_active_files(db, None),
+        "total_size_mb": round((total["upload_bytes"] - total["delete_bytes"]) / 1024 / 1024, 2),
+        "total_visits": total["visits"],
+        "total_downloads": total["downloads"],
+        # прирост за неделю: загрузки минус удаления, может быть отрицательным
+        "files_this_week": week["uploads"] - week["deletes"],
+        "visits_this_week": week["visits"],
+        "downloads_this_week": week["downloads"],
+        "top_files": [
+            {
+                "file_code": f.file_code,
+                "filename": f.original_filename,
+                "size_mb": round(f.file_size / 1024 / 1024, 2),
+                "downloads": f.downloads
+            } for f in top_files
+        ]
+    }
+
+async def set_quota(db: AsyncSession, user_id: int, limit_mb: Optional[int]) -> dict:
+    # limit_mb=None — вернуть пользователю общий лимит USER_QUOTA_BYTES
+    await quotas.set_limit(db, user_id, limit_mb * 1024 * 1024 if limit_mb is not None else None)
+    await db.commit()
+    return {"success": True, "user_id": user_id, **await quotas.usage(db, user_id)}
+
+def _after(cursor: Optional[str], kind: str = "t"):
+    try:
+        return decode_cursor(cursor, kind)
+    except InvalidCursor:
+        raise ServiceError(400, "Bad cursor")
+
+async def admin_files(db: AsyncSession, q: Optional[str], cursor: Optional[str], size: int) -> dict:
+    if q and search.fts_query(q) and await search.available(db):
+        # полнотекстовый поиск: по релевантности, курсор по (rank, id)
+        rows, next_cursor = page_of(
+            await search.search_files(db, q, _after(cursor, "r"), size + 1), size, lambda r: (r.rank, r.File.id)
+        )
+        files = [r.File for r in rows]
+        count = search.count_matches
+    else:
+        files, next_cursor = page_of(
+            await repo.search_active_files(db, q, _after(cursor), size + 1), size, lambda f: (f.upload_date, f.id)
+        )
+        count = repo.count_active_files
+    # без кэша: он расходился с данными после загрузок/удалений и между воркерами, а
+    # count_matches по FTS и count по частичному индексу ix_files_active_upload дешёвые
+    total = await count(db, q)
+    return {
+        "total": total,
+        "size": size,
+        "cursor": cursor,
+        "next_cursor": next_cursor,
+        "files": [
+            {
+                "file_code": f.file_code,
+                "filename": f.original_filename,
+                "size_mb": round(f.file_size / 1024 / 1024, 2),
+                "upload_date": f.upload_date.isoformat(),
+                "user_id": f.user_id,
+                "notify_visits": f.notify_visits,
+                "notify_downloads": f.notify_downloads,
+                "download_url": f"{BASE_URL}/{f.file_code}"
+            } for f in files
+        ]
+    }
+
+async def admin_logs(db: AsyncSession, file_code: str, cursor: Optional[str], size: int) -> dict:
+    rows, next_cursor = page_of(
+        await archive.logs_after(db, file_code, _after(cursor), size + 1), size, lambda r: (r.access_time, r.id)
+    )
+    # число записей лога файла = визиты + скачивания из file_counters
+    counter = await repo.get_counter(db, file_code)
+    return {
+        "total": (counter.visits + counter.downloads) if counter else 0,
+        "size": size,
+        "cursor": cursor,
+        "next_cursor": next_cursor,
+        "logs": [
+            {
+                "type": r.access_type,
+                "ip": r.ip_address,
+                "ua": r.user_agent,
+                "country": r.country,
+                "city": r.city,
+                "time": r.access_time.isoformat()
+            } for r in rows
+        ]
+    }
+
+def _job_dict(job: BroadcastJob) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "sent": job.sent,
+        "failed": job.failed,
+        "progress": round(100 * (job.sent + job.failed) / job.total, 1) if job.total else 0.0,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+async def start_broadcast(db: AsyncSession, admin_id: int, message: str) -> dict:
+    # отправкой занимается api/broadcast.py в фоне, запрос только ставит задание
+    job = BroadcastJob(admin_id=admin_id, message=message, status="pending", created_at=datetime.now())
+    db.add(job)
+    await db.commit()
+    broadcaster.wake()
+    return {"success": True, "message": f"Рассылка #{job.id} поставлена в очередь", **_job_dict(job)}
+
+async def broadcast_status(db: AsyncSession, job_id: int) -> dict:
+    job = await db.get(BroadcastJob, job_id)
+    if not job:
+        raise ServiceError(404, "Job not found")
+    return _job_dict(job)
@@ -0,0 +1,312 @@
+"""
+Контентно-адресуемое хранилище файлов.
+
+Блоб хранится один раз под именем sha256 своего содержимого (File.stored_filename == digest),
+таблица blobs считает ссылки из активных File. Освободившиеся блобы удаляет фоновая
+сборка мусора после grace-периода.
+
+Раскладка на диске — двухуровневая по префиксу имени: api/files/ab/cd/abcd…
+Старые файлы из плоского каталога переносятся онлайн, без остановки сервиса:
+
+    python -m api.storage --shard [--batch 500] [--pause 0.5]
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Blob
+
+log = logging.getLogger(__name__)
+
+FILES_DIR = "api/files"
+# staging-каталог лежит рядом с FILES_DIR (та же ФС), чтобы rename был атомарным
+# и недокачанные файлы не были видны через StaticFiles
+TMP_DIR = "api/tmp"
+CHUNK_SIZE = 1024 * 1024
+
+GC_INTERVAL = 300
+GC_GRACE = timedelta(minutes=10)    # освобождённый блоб может снова понадобиться при дедупликации
+GC_BATCH = 200
+TMP_MAX_AGE = 24 * 3600
+
+os.makedirs(FILES_DIR, exist_ok=True)
+os.makedirs(TMP_DIR, exist_ok=True)
+
+
+@dataclass
+class StoredFile:
+    stored_filename: str
+    size: int
+    tmp_path: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def digest(self) -> str:
+        return self.stored_filename
+
+
+def path_for(stored_filename: str) -> str:
+    return os.path.join(FILES_DIR, stored_filename[:2], stored_filename[2:4], stored_filename)
+
+
+def legacy_path_for(stored_filename: str) -> str:
+    return os.path.join(FILES_DIR, stored_filename)
+
+
+async def locate(stored_filename: str) -> Optional[str]:
+    """Путь к существующему блобу: сначала шардированный, затем (пока идёт перенос) плоский."""
+    for path in (path_for(stored_filename), legacy_path_for(stored_filename)):
+        if await aiofiles.os.path.isfile(path):
+            return path
+    return None
+
+
+# ================== ЗАПИСЬ ==================
+async def iter_upload(file: UploadFile, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    # UploadFile.read уходит в threadpool, если multipart-парсер уже сбросил тело на диск
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def save_stream(chunks: AsyncIterator[bytes]) -> StoredFile:
+    """Пишет поток во временный файл, попутно считая sha256. В хранилище кладёт acquire()."""
+    tmp_path = os.path.join(TMP_DIR, f"{uuid.uuid4()}.part")
+    hasher = hashlib.sha256()
+
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            async for chunk in chunks:
+                # hashlib отпускает GIL на больших буферах — считаем в потоке, параллельно циклу
+                await asyncio.to_thread(hasher.update, chunk)
+                await out.write(chunk)
+                size += len(chunk)
+            await out.flush()
+            await asyncio.to_thread(os.fsync, out.fileno())
+    except BaseException:
+        await remove_path(tmp_path)
+        raise
+
+    return StoredFile(stored_filename=hasher.hexdigest(), size=size, tmp_path=tmp_path)
+
+
+async def acquire(db: AsyncSession, stored: StoredFile):
+    """
+    +1 ссылка на блоб и перенос временного файла на место, если такого содержимого ещё нет.
+    Строка blobs пишется первой: пока транзакция не закоммичена, сборщик мусора не
+    сможет удалить этот блоб (см. collect_garbage). Коммит — на вызывающей стороне.
+    """
+    stmt = insert(Blob).values(digest=stored.digest, size=stored.size, refcount=1, created_at=datetime.now())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Blob.digest],
+        set_={"refcount": Blob.refcount + 1, "released_at": None},
+    )
+    await db.execute(stmt)
+
+    if await locate(stored.stored_filename):
+        await discard(stored)
+    else:
+        target = path_for(stored.stored_filename)
+        await aiofiles.os.makedirs(os.path.dirname(target), exist_ok=True)
+        await aiofiles.os.replace(stored.tmp_path, target)
+        stored.tmp_path = None
+
+
+async def discard(stored: StoredFile):
+    if stored.tmp_path:
+        await remove_path(stored.tmp_path)
+        stored.tmp_path = None
+
+
+async def release(db: AsyncSession, stored_filename: str):
+    """-1 ссылка. Сам файл удалит collect_garbage. Коммит — на вызывающей стороне."""
+    await db.execute(
+        update(Blob).where(Blob.digest == stored_filename, Blob.refcount > 0)
+        .values(refcount=Blob.refcount - 1)
+    )
+    await db.execute(
+        update(Blob).where(Blob.digest == stored_filename, Blob.refcount == 0, Blob.released_at.is_(None))
+        .values(released_at=datetime.now())
+    )
+
+
+async def remove_path(path: str):
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# ================== СБОРКА МУСОРА ==================
+async def _restore_trash(db: AsyncSession):
+    """Блобы, оставшиеся в TMP_DIR/<digest>.gc после сбоя посреди collect_garbage, — на место, если строка жива."""
+    trashed = {e.name[:-3]: e.path for e in await aiofiles.os.scandir(TMP_DIR) if e.name.endswith(".gc")}
+    if not trashed:
+        return
+    alive = set((await db.execute(select(Blob.digest).where(Blob.digest.in_(trashed)))).scalars())
+    await db.commit()
+    for digest in alive:
+        if await locate(digest):
+            await remove_path(trashed[digest])
+            continue
+        target = path_for(digest)
+        await aiofiles.os.makedirs(os.path.dirname(target), exist_ok=True)
+        await aiofiles.os.replace(trashed[digest], target)
+
+
+async def collect_garbage(db: AsyncSession, batch: int = GC_BATCH) -> int:
+    await _restore_trash(db)
+    cutoff = datetime.now() - GC_GRACE
+    res = await db.execute(
+        select(Blob.digest).where(Blob.refcount == 0, Blob.released_at < cutoff).limit(batch)
+    )
+    removed = 0
+    for digest in list(res.scalars()):
+        path = await locate(digest)
+        trash = os.path.join(TMP_DIR, f"{digest}.gc") if path else None
+        # сначала убираем файл из-под имени, потом удаляем строку только если ссылок так и нет;
+        # если кто-то успел сделать acquire — возвращаем файл на место
+        if trash:
+            try:
+                await aiofiles.os.replace(path, trash)
+            except FileNotFoundError:
+                trash = None
+        try:
+            deleted = await db.execute(delete(Blob).where(Blob.digest == digest, Blob.refcount == 0))
+            await db.commit()
+        except BaseException:
+            # строка осталась (например, database is locked) — файл должен вернуться под своё имя,
+            # иначе блоб с живыми ссылками пролежит в TMP_DIR до _sweep_tmp
+            await db.rollback()
+            if trash:
+                await aiofiles.os.replace(trash, path)
+            raise
+        if deleted.rowcount:
+            if trash:
+                await remove_path(trash)
+            removed += 1
+        elif trash:
+            await aiofiles.os.replace(trash, path)
+    return removed
+
+
+async def _sweep_tmp():
+    cutoff = time.time() - TMP_MAX_AGE
+    for entry in await aiofiles.os.scandir(TMP_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                await remove_path(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+async def gc_loop(session_factory, interval: float = GC_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_factory() as db:
+                removed = await collect_garbage(db)
+            await _sweep_tmp()
+            if removed:
+                log.info("blob gc: removed %d unreferenced blobs", removed)
+        except Exception:
+            log.exception("blob gc failed")
+
+
+# ================== МИГРАЦИЯ ПЛОСКОГО КАТАЛОГА ==================
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def convert_flat_directory(conn: Connection):
+    """Переводит файлы вида <uuid>.<ext> в блобы по sha256 и заполняет blobs (в плоском каталоге)."""
+    names = [row[0] for row in conn.exec_driver_sql(
+        "SELECT DISTINCT stored_filename FROM files WHERE stored_filename IS NOT NULL"
+    )]
+    for name in names:
+        path = legacy_path_for(name)
+        if not os.path.isfile(path):
+            continue   # файл удалённой записи — физически уже стёрт
+        digest = _hash_file(path)
+        if digest != name:
+            target = legacy_path_for(digest)
+            if os.path.exists(target):
+                os.remove(path)
+            else:
+                os.replace(path, target)
+            conn.exec_driver_sql("UPDATE files SET stored_filename = ? WHERE stored_filename = ?", (digest, name))
+
+    now = datetime.now()
+    conn.exec_driver_sql("""
+        INSERT OR REPLACE INTO blobs (digest, size, refcount, created_at, released_at)
+        SELECT stored_filename, MAX(file_size), SUM(is_active = 1), ?,
+               CASE WHEN SUM(is_active = 1) = 0 THEN ? END
+        FROM files
+        WHERE length(stored_filename) = 64
+        GROUP BY stored_filename
+    """, (now, now))
+    # у неактивных записей блоб мог быть удалён ещё старым кодом
+    for digest, in conn.exec_driver_sql("SELECT digest FROM blobs").fetchall():
+        if not os.path.isfile(legacy_path_for(digest)) and not os.path.isfile(path_for(digest)):
+            conn.exec_driver_sql("DELETE FROM blobs WHERE digest = ? AND refcount = 0", (digest,))
+
+
+# ================== ОНЛАЙН-ПЕРЕНОС В ШАРДЫ ==================
+def shard_flat_directory(batch: int = 500, pause: float = 0.5) -> int:
+    """
+    Переносит файлы из корня FILES_DIR в шарды пачками. Сначала hardlink в шард
+    (locate уже находит новый путь), после паузы — unlink старого имени, чтобы
+    запросы, успевшие получить плоский путь, успели его открыть.
+    """
+    moved = 0
+    while True:
+        with os.scandir(FILES_DIR) as it:
+            names = [e.name for e in it if e.is_file(follow_symlinks=False) and not e.name.startswith(".")][:batch]
+        if not names:
+            return moved
+        for name in names:
+            target = path_for(name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(legacy_path_for(name), target)
+            except FileExistsError:
+                pass
+        time.sleep(pause)
+        for name in names:
+            try:
+                os.unlink(legacy_path_for(name))
+            except FileNotFoundError:
+                pass
+        moved += len(names)
+        print(f"sharded {moved} files")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shard", action="store_true", help="перенести плоский каталог в шарды")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.5)
+    args = parser.parse_args()
+    if args.shard:
+        print(f"done, {shard_flat_directory(args.batch, args.pause)} files moved")
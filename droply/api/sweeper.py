@@ -0,0 +1,91 @@
+"""
+Фоновая уборка файлов: истечение срока и окончательная очистка удалённых.
+
+Каждые SWEEP_INTERVAL секунд (только в держателе лизы, см. api/main.py):
+1. Активные файлы с expires_at <= now деактивируются пачками по EXPIRE_BATCH тем же
+   services.deactivate_file, что и ручное удаление: блоб освобождается (его удалит
+   storage.collect_garbage), квота возвращается, файл уходит из поиска и кэшей.
+2. Файлы, деактивированные дольше PURGE_AFTER_DAYS назад, удаляются вместе с логом
+   обращений и счётчиками. Лог удаляется кусками по PURGE_CHUNK строк; архивные
+   сегменты лога (api/archive.py) только выписываются из индекса — месячный файл общий.
+
+За тик делается не больше PURGE_ROWS_PER_TICK удалений строк лога, между кусками —
+пауза PAUSE. Короткие транзакции не держат блокировку записи SQLite подолгу, и
+запись access_log с загрузками успевает проходить между ними.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import PURGE_AFTER_DAYS
+from . import filecache, services
+from .models import AccessArchiveSegment, File, FileAccess, FileCounter
+
+log = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = 30
+EXPIRE_BATCH = 100
+PURGE_BATCH = 50            # файлов за тик
+PURGE_CHUNK = 500           # строк file_access за одну транзакцию
+PURGE_ROWS_PER_TICK = 5_000
+PAUSE = 0.05
+
+
+async def expire_due(db: AsyncSession, batch: int = EXPIRE_BATCH) -> int:
+    res = await db.execute(
+        select(File).where(File.is_active == True, File.expires_at.is_not(None), File.expires_at <= datetime.now())
+        .order_by(File.expires_at).limit(batch)
+    )
+    files = list(res.scalars())
+    for f in files:
+        await services.deactivate_file(db, f)
+    await db.commit()
+    for f in files:
+        await filecache.invalidate(db, f.file_code)
+    return len(files)
+
+
+async def purge_deleted(db: AsyncSession, budget: int = PURGE_ROWS_PER_TICK) -> tuple[int, int]:
+    """Возвращает (удалено файлов, удалено строк лога)."""
+    cutoff = datetime.now() - timedelta(days=PURGE_AFTER_DAYS)
+    res = await db.execute(
+        select(File.id, File.file_code).where(File.is_active == False, File.deleted_at < cutoff)
+        .order_by(File.deleted_at).limit(PURGE_BATCH)
+    )
+    files, rows = 0, 0
+    for file_id, file_code in res.all():
+        # лог — кусками по ix_file_access_code_time; строку файла удаляем последней,
+        # чтобы незаконченная очистка продолжилась со следующего тика
+        while rows < budget:
+            chunk = select(FileAccess.id).where(FileAccess.file_code == file_code).limit(PURGE_CHUNK)
+            deleted = (await db.execute(delete(FileAccess).where(FileAccess.id.in_(chunk)))).rowcount
+            await db.commit()
+            rows += deleted
+            if deleted < PURGE_CHUNK:
+                break
+            await asyncio.sleep(PAUSE)
+        else:
+            break   # бюджет тика исчерпан — файл дочистится в следующий раз
+        await db.execute(delete(FileCounter).where(FileCounter.file_code == file_code))
+        await db.execute(delete(AccessArchiveSegment).where(AccessArchiveSegment.file_code == file_code))
+        await db.execute(delete(File).where(File.id == file_id, File.is_active == False))
+        await db.commit()
+        files += 1
+    return files, rows
+
+
+async def sweep_loop(session_factory, interval: float = SWEEP_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_factory() as db:
+                expired = await expire_due(db)
+            async with session_factory() as db:
+                purged, rows = await purge_deleted(db)
+            if expired or purged:
+                log.info("sweeper: expired %d files, purged %d files and %d log rows", expired, purged, rows)
+        except Exception:
+            log.exception("sweeper failed")
@@ -0,0 +1,347 @@
+"""
+Возобновляемая загрузка больших файлов по частям, в духе tus:
+
+    POST   /api/uploads                 filename, size, [user_id], [chunk_size], [expires_in] -> upload_id
+    PUT    /api/uploads/{id}            тело — одна часть; Upload-Offset, Upload-Checksum: sha256 <base64>
+    GET    /api/uploads/{id}            сколько принято и каких частей не хватает
+    POST   /api/uploads/{id}/finalize   -> тот же ответ, что у /api/upload
+    DELETE /api/uploads/{id}
+
+Файл делится на части по chunk_size; часть пишется по своему смещению (pwrite) в
+staging-файл TMP_DIR/<id>.upload, так что части можно слать параллельно и в любом
+порядке, а после обрыва — дослать только недостающие. sha256 каждой части
+сверяется с Upload-Checksum (если передан) и сохраняется в upload_chunks.
+finalize проверяет, что пришли все части, копирует staging-файл в отдельный снимок,
+по пути сверяя sha256 каждой части с upload_chunks и считая sha256 всего файла, и
+регистрирует File так же, как обычная загрузка (services.register_upload). В хранилище
+уходит снимок: PUT, который ещё пишет в staging-файл, до готового блоба не дотянется,
+а если он успел испортить снимок — сверка частей это поймает.
+
+Сессия, зависшая в "finalizing" (процесс упал посреди finalize), через FINALIZE_TIMEOUT
+снова считается открытой.
+
+Сессии, которые не трогали дольше SESSION_TTL, вместе с staging-файлами удаляет gc_loop.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import math
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+import aiofiles
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import BASE_URL
+from . import storage, services, quotas
+from .models import UploadChunk, UploadSession
+from .services import ServiceError
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+MAX_UPLOAD_SIZE = 4 * 1024 ** 3
+SESSION_TTL = timedelta(hours=12)     # меньше storage.TMP_MAX_AGE: staging-файл убираем мы, а не _sweep_tmp
+FINALIZE_TIMEOUT = timedelta(hours=1)
+GC_INTERVAL = 600
+CHECKSUM_MISMATCH = 460               # код tus для несовпавшей контрольной суммы
+
+
+def staging_path(upload_id: str) -> str:
+    return os.path.join(storage.TMP_DIR, f"{upload_id}.upload")
+
+
+def snapshot_path(upload_id: str) -> str:
+    return os.path.join(storage.TMP_DIR, f"{upload_id}.final")
+
+
+def _chunks_total(s: UploadSession) -> int:
+    return max(1, math.ceil(s.size / s.chunk_size))
+
+
+def _parse_checksum(header: Optional[str]) -> Optional[bytes]:
+    if not header:
+        return None
+    algo, _, value = header.partition(" ")
+    if algo.lower() != "sha256":
+        raise ServiceError(400, "Only sha256 checksums are supported")
+    try:
+        return base64.b64decode(value.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise ServiceError(400, "Bad Upload-Checksum")
+
+
+async def _open_session(db: AsyncSession, upload_id: str) -> UploadSession:
+    s = await db.get(UploadSession, upload_id)
+    if s is None or s.updated_at < datetime.now() - SESSION_TTL:
+        raise ServiceError(404, "Upload not found")
+    if s.status == "finalizing" and s.updated_at < datetime.now() - FINALIZE_TIMEOUT:
+        # finalize не дожил до конца — возвращаем сессию клиенту
+        await db.execute(
+            update(UploadSession).where(UploadSession.id == upload_id, UploadSession.status == "finalizing",
+                                        UploadSession.updated_at == s.updated_at)
+            .values(status="open", updated_at=datetime.now())
+        )
+        await db.commit()
+        await db.refresh(s)
+    return s
+
+
+async def _received(db: AsyncSession, upload_id: str) -> tuple[int, set[int]]:
+    rows = (await db.execute(
+        select(UploadChunk.chunk_index, UploadChunk.size).where(UploadChunk.session_id == upload_id)
+    )).all()
+    return sum(r.size for r in rows), {r.chunk_index for r in rows}
+
+
+# ================== ОПЕРАЦИИ ==================
+async def create(db: AsyncSession, filename: Optional[str], size: int, user_id: Optional[int],
+                 chunk_size: Optional[int] = None, expires_in: Optional[int] = None) -> dict:
+    if size < 0 or size > MAX_UPLOAD_SIZE:
+        raise ServiceError(413, f"File size must be between 0 and {MAX_UPLOAD_SIZE} bytes")
+    services.expiry(expires_in)   # проверка заранее; сам срок отсчитывается от finalize
+    if user_id is not None:
+        # окончательно квоту списывает register_upload, здесь — чтобы не принимать гигабайты зря
+        q = await quotas.usage(db, user_id)
+        if q["limit_bytes"] is not None and q["used_bytes"] + size > q["limit_bytes"]:
+            raise ServiceError(413, "Storage quota exceeded")
+    chunk_size = min(max(chunk_size or DEFAULT_CHUNK_SIZE, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+
+    upload_id = secrets.token_hex(16)
+    # пустой staging-файл сразу: части дописываются в него по смещениям
+    async with aiofiles.open(staging_path(upload_id), "wb"):
+        pass
+    now = datetime.now()
+    s = UploadSession(id=upload_id, user_id=user_id, filename=filename, size=size, chunk_size=chunk_size,
+                      expires_in=expires_in, status="open", created_at=now, updated_at=now)
+    db.add(s)
+    await db.commit()
+    return _status_dict(s, 0, set())
+
+
+def _status_dict(s: UploadSession, received: int, done: set[int]) -> dict:
+    return {
+        "upload_id": s.id,
+        "status": s.status,
+        "size": s.size,
+        "chunk_size": s.chunk_size,
+        "chunks": _chunks_total(s),
+        "received": received,
+        "missing": [i for i in range(_chunks_total(s)) if i not in done],
+        "expires_at": (s.updated_at + SESSION_TTL).isoformat(),
+        "upload_url": f"{BASE_URL}/api/uploads/{s.id}",
+        "file_code": s.file_code,
+    }
+
+
+async def status(db: AsyncSession, upload_id: str) -> dict:
+    s = await _open_session(db, upload_id)
+    received, done = await _received(db, upload_id)
+    return _status_dict(s, received, done)
+
+
+def _pwrite(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view, offset = view[n:], offset + n
+
+
+async def write_chunk(db: AsyncSession, upload_id: str, offset: int, body: AsyncIterator[bytes],
+                      checksum: Optional[str] = None) -> dict:
+    expected_digest = _parse_checksum(checksum)
+    s = await _open_session(db, upload_id)
+    if s.status != "open":
+        raise ServiceError(409, "Upload is already finalized")
+    if offset < 0 or offset % s.chunk_size or (offset >= s.size and s.size):
+        raise ServiceError(400, f"Upload-Offset must be a multiple of {s.chunk_size} below {s.size}")
+    index = offset // s.chunk_size
+    expected = min(s.chunk_size, s.size - offset)
+    # читать сессию дальше не нужно — не держим транзакцию, пока идёт тело
+    await db.commit()
+
+    hasher = hashlib.sha256()
+    written = 0
+    try:
+        fd = await asyncio.to_thread(os.open, staging_path(upload_id), os.O_WRONLY)
+        try:
+            async for piece in body:
+                if written + len(piece) > expected:
+                    raise ServiceError(400, f"Chunk {index} is larger than {expected} bytes")
+                hasher.update(piece)
+                await asyncio.to_thread(_pwrite, fd, piece, offset + written)
+                written += len(piece)
+            await asyncio.to_thread(os.fsync, fd)
+        finally:
+            await asyncio.to_thread(os.close, fd)
+
+        if written != expected:
+            raise ServiceError(400, f"Chunk {index} must be {expected} bytes, got {written}")
+        if expected_digest is not None and hasher.digest() != expected_digest:
+            raise ServiceError(CHECKSUM_MISMATCH, f"Checksum mismatch for chunk {index}")
+    except BaseException:
+        # байты части на диске уже могли смениться — принятой она больше не считается
+        await db.execute(delete(UploadChunk).where(UploadChunk.session_id == upload_id,
+                                                   UploadChunk.chunk_index == index))
+        await db.commit()
+        raise
+
+    # пока писали тело, сессию мог забрать finalize: часть в него уже не попадёт
+    touched = await db.execute(
+        update(UploadSession).where(UploadSession.id == upload_id, UploadSession.status == "open")
+        .values(updated_at=datetime.now())
+    )
+    if not touched.rowcount:
+        await db.commit()
+        raise ServiceError(409, "Upload is already finalized")
+    # повторная отправка той же части просто перезаписывает её
+    stmt = insert(UploadChunk).values(session_id=upload_id, chunk_index=index, size=written,
+                                      sha256=hasher.hexdigest())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UploadChunk.session_id, UploadChunk.chunk_index],
+        set_={"size": stmt.excluded.size, "sha256": stmt.excluded.sha256},
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+    received, done = await _received(db, upload_id)
+    return {
+        "upload_id": upload_id,
+        "chunk": index,
+        "offset": offset,
+        "size": written,
+        "sha256": hasher.hexdigest(),
+        "received": received,
+        "complete": len(done) == _chunks_total(s),
+    }
+
+
+def _assemble(src: str, dst: str, chunk_size: int, chunks: int, expected: dict[int, str]) -> tuple[str, int]:
+    """Копирует src в dst, сверяя sha256 каждой части с expected. -> (sha256 файла, размер)."""
+    whole = hashlib.sha256()
+    size = 0
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        for index in range(chunks):
+            part = hashlib.sha256()
+            left = chunk_size
+            while left:
+                piece = fin.read(min(left, storage.CHUNK_SIZE))
+                if not piece:
+                    break
+                part.update(piece)
+                whole.update(piece)
+                fout.write(piece)
+                left -= len(piece)
+                size += len(piece)
+            if part.hexdigest() != expected.get(index):
+                raise ServiceError(409, f"Chunk {index} changed during finalize, upload it again")
+        fout.flush()
+        os.fsync(fout.fileno())
+    return whole.hexdigest(), size
+
+
+async def finalize(db: AsyncSession, upload_id: str) -> dict:
+    s = await _open_session(db, upload_id)
+    if s.status == "done" and s.file_code:
+        # ответ на предыдущий finalize потерялся — повторяем тот же результат
+        return {"success": True, "file_code": s.file_code, "filename": s.filename, "size": s.size,
+                "download_url": f"{BASE_URL}/{s.file_code}"}
+
+    received, done = await _received(db, upload_id)
+    missing = _chunks_total(s) - len(done)
+    if s.size and missing:
+        raise ServiceError(409, f"{missing} chunks are missing")
+
+    # один finalize на сессию, даже если клиент повторил запрос, не дождавшись ответа;
+    # claimed_at отличает нашу заявку от следующей, если эту успеет снять FINALIZE_TIMEOUT
+    claimed_at = datetime.now()
+    claimed = await db.execute(
+        update(UploadSession).where(UploadSession.id == upload_id, UploadSession.status == "open")
+        .values(status="finalizing", updated_at=claimed_at)
+    )
+    await db.commit()
+    if not claimed.rowcount:
+        raise ServiceError(409, "Upload is being finalized")
+    ours = (UploadSession.id == upload_id, UploadSession.status == "finalizing",
+            UploadSession.updated_at == claimed_at)
+
+    snapshot = snapshot_path(upload_id)
+    try:
+        # части, записанные до заявки, — уже в upload_chunks; новые write_chunk не примет
+        expected = dict((await db.execute(
+            select(UploadChunk.chunk_index, UploadChunk.sha256).where(UploadChunk.session_id == upload_id)
+        )).tuples().all())
+        if not s.size:
+            expected = {0: hashlib.sha256().hexdigest()}
+        await db.commit()
+        digest, size = await asyncio.to_thread(_assemble, staging_path(upload_id), snapshot,
+                                               s.chunk_size, _chunks_total(s), expected)
+        stored = storage.StoredFile(stored_filename=digest, size=size, tmp_path=snapshot)
+        if stored.size != s.size:
+            raise ServiceError(409, f"Assembled {stored.size} bytes, expected {s.size}")
+
+        # статус, file_code и чистка частей — в той же транзакции, что и новый File
+        file_code = services.generate_short_code()
+        marked = await db.execute(update(UploadSession).where(*ours).values(status="done", file_code=file_code))
+        if not marked.rowcount:
+            raise ServiceError(409, "Upload finalize timed out, retry it")
+        await db.execute(delete(UploadChunk).where(UploadChunk.session_id == upload_id))
+        result = await services.register_upload(db, stored, s.filename, s.user_id,
+                                                services.expiry(s.expires_in), file_code=file_code)
+    except BaseException:
+        await db.rollback()
+        await db.execute(update(UploadSession).where(*ours).values(status="open"))
+        await db.commit()
+        raise       # staging-файл остаётся: части можно дослать и повторить finalize
+    finally:
+        await storage.remove_path(snapshot)     # после acquire снимка под этим именем уже нет
+    await storage.remove_path(staging_path(upload_id))
+    return result
+
+
+async def abort(db: AsyncSession, upload_id: str) -> dict:
+    s = await _open_session(db, upload_id)
+    if s.status == "finalizing":
+        raise ServiceError(409, "Upload is being finalized")
+    await _drop(db, [upload_id])
+    return {"success": True}
+
+
+async def _drop(db: AsyncSession, ids: list[str]):
+    await db.execute(delete(UploadChunk).where(UploadChunk.session_id.in_(ids)))
+    await db.execute(delete(UploadSession).where(UploadSession.id.in_(ids)))
+    await db.commit()
+    for upload_id in ids:
+        await storage.remove_path(staging_path(upload_id))
+        await storage.remove_path(snapshot_path(upload_id))
+
+
+# ================== СБОРКА МУСОРА ==================
+async def collect_abandoned(db: AsyncSession, batch: int = 100) -> int:
+    cutoff = datetime.now() - SESSION_TTL
+    ids = list((await db.execute(
+        select(UploadSession.id).where(UploadSession.updated_at < cutoff).limit(batch)
+    )).scalars())
+    if ids:
+        await _drop(db, ids)
+    return len(ids)
+
+
+async def gc_loop(session_factory, interval: float = GC_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_factory() as db:
+                removed = await collect_abandoned(db)
+            if removed:
+                log.info("uploads gc: removed %d abandoned sessions", removed)
+        except Exception:
+            log.exception("uploads gc failed")
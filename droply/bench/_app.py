@@ -0,0 +1,31 @@
+"""
+Запуск api.main:app для бенчмарков с переопределёнными константами bot.config.
+
+    DROPLY_BENCH_CONFIG='{"GEO_API_URL": "..."}' python -m bench._app --port 8001
+
+Константы подменяются до импорта приложения, поэтому `from bot.config import X`
+в модулях api видит уже новые значения. Используется bench/_server.py.
+"""
+import argparse
+import json
+import os
+
+import uvicorn
+
+import bot.config
+
+
+def apply_overrides(raw: str):
+    for name, value in json.loads(raw or "{}").items():
+        if not hasattr(bot.config, name):
+            raise SystemExit(f"bot.config has no {name}")
+        setattr(bot.config, name, value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+    apply_overrides(os.environ.get("DROPLY_BENCH_CONFIG", ""))
+    uvicorn.run("api.main:app", host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,72 @@
+"""
+Локальные заглушки внешних сервисов для бенчмарков: Telegram Bot API и ip-api.com.
+
+Поднимаются в процессе бенчмарка на свободных портах; приложению их адреса
+передаются через TELEGRAM_API_URL и GEO_API_URL (см. bench/_app.py). Задержка
+ответа настраивается, чтобы мерить поведение при медленном внешнем API.
+"""
+import asyncio
+import contextlib
+import time
+from dataclasses import dataclass
+
+from aiohttp import web
+
+from ._server import _free_port
+
+
+@dataclass
+class FakeStats:
+    telegram_messages: int = 0
+    telegram_calls: int = 0
+    geo_lookups: int = 0
+
+
+async def _telegram(request: web.Request):
+    stats: FakeStats = request.app["stats"]
+    await asyncio.sleep(request.app["telegram_latency"])
+    stats.telegram_calls += 1
+    data = await request.post()
+    if request.match_info["method"].lower() != "sendmessage":
+        return web.json_response({"ok": True, "result": True})
+    stats.telegram_messages += 1
+    chat_id = int(data.get("chat_id", 0))
+    return web.json_response({"ok": True, "result": {
+        "message_id": stats.telegram_messages,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": data.get("text", ""),
+    }})
+
+
+async def _ip_api(request: web.Request):
+    stats: FakeStats = request.app["stats"]
+    await asyncio.sleep(request.app["geo_latency"])
+    stats.geo_lookups += 1
+    n = sum(map(ord, request.match_info["ip"]))   # один и тот же IP — одно и то же место
+    return web.json_response({"status": "success", "country": f"Country {n % 20}", "city": f"City {n % 500}"})
+
+
+@contextlib.asynccontextmanager
+async def fake_upstreams(telegram_latency: float = 0.05, geo_latency: float = 0.05):
+    """-> (config-переопределения для droply_server, FakeStats)."""
+    stats = FakeStats()
+    app = web.Application()
+    app["stats"] = stats
+    app["telegram_latency"] = telegram_latency
+    app["geo_latency"] = geo_latency
+    app.router.add_post("/bot{token}/{method}", _telegram)
+    app.router.add_get("/json/{ip}", _ip_api)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = _free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    base = f"http://127.0.0.1:{port}"
+    try:
+        yield {
+            "TELEGRAM_API_URL": base,
+            "GEO_API_URL": base + "/json/{ip}?lang=ru&fields=status,country,city",
+        }, stats
+    finally:
+        await runner.cleanup()
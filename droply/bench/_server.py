@@ -0,0 +1,78 @@
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+DROPLY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def peak_rss_mb(pid: int) -> float | None:
+    # VmHWM — пиковый RSS процесса (Linux); на других ОС None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+@contextlib.asynccontextmanager
+async def droply_server(env: dict | None = None, config: dict | None = None):
+    """
+    Запускает api.main:app в отдельном процессе с чистой БД во временном каталоге.
+    config — переопределения констант bot.config (см. bench/_app.py).
+    """
+    workdir = tempfile.mkdtemp(prefix="droply-bench-")
+    os.makedirs(os.path.join(workdir, "api"))
+    os.symlink(os.path.join(DROPLY_DIR, "api", "templates"), os.path.join(workdir, "api", "templates"))
+
+    port = _free_port()
+    proc_env = dict(os.environ, PYTHONPATH=DROPLY_DIR, DROPLY_BENCH_CONFIG=json.dumps(config or {}), **(env or {}))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "bench._app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=workdir, env=proc_env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        async with aiohttp.ClientSession() as s:
+            while True:
+                try:
+                    async with s.get(f"{base_url}/") as r:
+                        if r.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                if time.monotonic() > deadline or proc.poll() is not None:
+                    raise RuntimeError("droply server did not start")
+                await asyncio.sleep(0.2)
+        yield base_url, proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
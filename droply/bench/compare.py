@@ -0,0 +1,68 @@
+"""
+Сравнение двух прогонов bench.load_mix (например, до и после коммита).
+
+    cd droply && python -m bench.compare before.json after.json [--threshold 10]
+
+Печатает по каждой операции rps и p50/p99 обоих прогонов с изменением в процентах,
+а в конце — JSON со списком регрессий: p99 выросла или rps упал больше чем на
+--threshold процентов, либо ошибок стало больше. Код выхода 1, если регрессии есть, — удобно для CI.
+"""
+import argparse
+import json
+import sys
+
+
+def _delta(old: float, new: float) -> float:
+    return round((new - old) / old * 100, 1) if old else 0.0
+
+
+def compare(before: dict, after: dict, threshold: float) -> dict:
+    rows, regressions = {}, []
+    for name in sorted(set(before["ops"]) & set(after["ops"])):
+        b, a = before["ops"][name], after["ops"][name]
+        row = {key: {"before": b[key], "after": a[key], "delta_pct": _delta(b[key], a[key])}
+               for key in ("rps", "p50_ms", "p99_ms")}
+        rows[name] = row
+        if row["p99_ms"]["delta_pct"] > threshold:
+            regressions.append(f"{name}: p99 {b['p99_ms']} -> {a['p99_ms']} ms")
+        if row["rps"]["delta_pct"] < -threshold:
+            regressions.append(f"{name}: rps {b['rps']} -> {a['rps']}")
+        if a["errors"] > b["errors"]:
+            regressions.append(f"{name}: errors {b['errors']} -> {a['errors']}")
+    rss_b, rss_a = before.get("server_peak_rss_mb"), after.get("server_peak_rss_mb")
+    if rss_b and rss_a and _delta(rss_b, rss_a) > threshold:
+        regressions.append(f"peak RSS {rss_b} -> {rss_a} MB")
+    return {
+        "before": before.get("commit"),
+        "after": after.get("commit"),
+        "ops": rows,
+        "peak_rss_mb": {"before": rss_b, "after": rss_a},
+        "regressions": regressions,
+    }
+
+
+def main(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before.get("params") != after.get("params"):
+        print("warning: runs used different parameters", file=sys.stderr)
+    if before.get("host") != after.get("host"):
+        print("warning: runs come from different hosts", file=sys.stderr)
+
+    result = compare(before, after, args.threshold)
+    for name, row in result["ops"].items():
+        print(f"{name:18} " + "  ".join(
+            f"{key} {v['before']:>9} -> {v['after']:>9} ({v['delta_pct']:+.1f}%)" for key, v in row.items()
+        ))
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if result["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допустимое ухудшение, %%")
+    main(parser.parse_args())
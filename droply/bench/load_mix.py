@@ -0,0 +1,230 @@
+"""
+Смешанная нагрузка на API целиком, офлайн: Telegram и ip-api заменены заглушками (bench/_fakes.py).
+
+    cd droply && python -m bench.load_mix --duration 30 --concurrency 32 --out before.json
+    cd droply && python -m bench.compare before.json after.json
+
+Сервер — api.main:app во временном каталоге с чистой SQLite-БД (bench/_server.py).
+Перед замером загружаются файлы размеров --sizes-kb от --owners владельцев (им и
+идут уведомления о визитах и скачиваниях) и ставится одна рассылка. Дальше
+--concurrency клиентов --duration секунд выполняют операции с весами WEIGHTS:
+просмотр короткой ссылки, скачивание файла каждого размера, загрузка, статистика
+файла, список файлов владельца и админская статистика. Запросы идут с X-Forwarded-For
+из пула публичных адресов, поэтому работают геолокация и её кэш.
+
+Итог — JSON: по каждой операции число запросов, ошибки, rps, p50/p99 (мс), для
+скачиваний МБ/с; общий rps, пиковый RSS сервера, сколько вызовов получили заглушки
+и на чём мерили (число CPU, версия Python). Клиенты и сервер делят одну машину, так
+что сравнивать имеет смысл прогоны с одного хоста.
+Сид генератора фиксирован (--seed), так что прогоны на разных коммитах сравнимы.
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from collections import defaultdict
+
+import aiohttp
+
+from ._fakes import fake_upstreams
+from ._server import DROPLY_DIR, droply_server, peak_rss_mb, percentile
+
+ADMIN_ID = 1
+WEIGHTS = {
+    "short_link": 50,
+    "download": 25,
+    "upload": 5,
+    "file_stats": 8,
+    "user_files": 7,
+    "admin_stats": 5,
+}
+UPLOAD_SIZE = 64 * 1024
+
+
+def _public_ips(rnd: random.Random, count: int) -> list[str]:
+    ips = []
+    while len(ips) < count:
+        addr = ipaddress.IPv4Address(rnd.getrandbits(32))
+        if addr.is_global:
+            ips.append(str(addr))
+    return ips
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DROPLY_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Workload:
+    def __init__(self, s: aiohttp.ClientSession, base_url: str, args, rnd: random.Random):
+        self.s = s
+        self.base_url = base_url
+        self.args = args
+        self.rnd = rnd
+        self.ips = _public_ips(rnd, args.ips)
+        self.owners = list(range(1000, 1000 + args.owners))
+        self.files: dict[int, list[str]] = defaultdict(list)   # размер (КБ) -> коды
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.bytes: dict[str, int] = defaultdict(int)
+
+    def _headers(self) -> dict:
+        return {"X-Forwarded-For": self.rnd.choice(self.ips), "User-Agent": "droply-bench/1.0"}
+
+    async def upload(self, size: int, user_id: int) -> str:
+        form = aiohttp.FormData()
+        form.add_field("user_id", str(user_id))
+        form.add_field("file", self.rnd.randbytes(size), filename=f"bench_{size}.bin",
+                       content_type="application/octet-stream")
+        async with self.s.post(f"{self.base_url}/api/upload", data=form) as r:
+            r.raise_for_status()
+            return (await r.json())["file_code"]
+
+    async def seed(self):
+        for size_kb in self.args.sizes_kb:
+            for i in range(self.args.files_per_size):
+                code = await self.upload(size_kb * 1024, self.owners[i % len(self.owners)])
+                self.files[size_kb].append(code)
+        form = aiohttp.FormData()
+        form.add_field("admin_id", str(ADMIN_ID))
+        form.add_field("message", "bench broadcast")
+        async with self.s.post(f"{self.base_url}/api/admin/broadcast", data=form) as r:
+            r.raise_for_status()
+
+    def _code(self) -> str:
+        return self.rnd.choice(self.files[self.rnd.choice(self.args.sizes_kb)])
+
+    async def _get(self, op: str, path: str):
+        async with self.s.get(f"{self.base_url}{path}", headers=self._headers()) as r:
+            size = 0
+            async for chunk in r.content.iter_chunked(256 * 1024):
+                size += len(chunk)
+            if r.status >= 400:
+                raise aiohttp.ClientResponseError(r.request_info, (), status=r.status)
+            self.bytes[op] += size
+
+    def _pick(self, op: str) -> tuple[str, str | None]:
+        """-> (имя для отчёта, путь GET); путь None — загрузка."""
+        if op == "short_link":
+            return op, f"/{self._code()}"
+        if op == "download":
+            # скачивания учитываем по размерам: у 4 КБ и 4 МБ разная латентность
+            size_kb = self.rnd.choice(self.args.sizes_kb)
+            return f"download_{size_kb}kb", f"/download/{self.rnd.choice(self.files[size_kb])}"
+        if op == "file_stats":
+            return op, f"/api/stats/{self._code()}"
+        if op == "user_files":
+            return op, f"/api/files/{self.rnd.choice(self.owners)}"
+        if op == "admin_stats":
+            return op, f"/api/admin/stats?admin_id={ADMIN_ID}"
+        return op, None
+
+    async def client(self, deadline: float):
+        ops, weights = list(WEIGHTS), list(WEIGHTS.values())
+        while time.monotonic() < deadline:
+            name, path = self._pick(self.rnd.choices(ops, weights)[0])
+            t0 = time.perf_counter()
+            try:
+                if path is None:
+                    await self.upload(UPLOAD_SIZE, self.rnd.choice(self.owners))
+                else:
+                    await self._get(name, path)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.errors[name] += 1
+                continue
+            self.latencies[name].append((time.perf_counter() - t0) * 1000)
+
+    def report(self, elapsed: float) -> dict:
+        ops = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            lat = self.latencies.get(name, [])
+            row = {
+                "requests": len(lat),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(lat) / elapsed, 1),
+                "p50_ms": round(percentile(lat, 50), 2),
+                "p99_ms": round(percentile(lat, 99), 2),
+            }
+            if name.startswith("download_"):
+                row["mb_s"] = round(self.bytes[name] / elapsed / 1024 / 1024, 1)
+            ops[name] = row
+        total = sum(r["requests"] for r in ops.values())
+        return {
+            "total": {
+                "requests": total,
+                "errors": sum(r["errors"] for r in ops.values()),
+                "rps": round(total / elapsed, 1),
+            },
+            "ops": ops,
+        }
+
+
+async def main(args):
+    rnd = random.Random(args.seed)
+    async with fake_upstreams(args.telegram_latency_ms / 1000, args.geo_latency_ms / 1000) as (upstreams, fakes):
+        config = {**upstreams, "ADMIN_IDS": [ADMIN_ID]}
+        async with droply_server(config=config) as (base_url, proc):
+            connector = aiohttp.TCPConnector(limit=args.concurrency)
+            timeout = aiohttp.ClientTimeout(total=60)
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as s:
+                load = Workload(s, base_url, args, rnd)
+                await load.seed()
+                started = time.monotonic()
+                deadline = started + args.duration
+                await asyncio.gather(*(load.client(deadline) for _ in range(args.concurrency)))
+                elapsed = time.monotonic() - started
+            # даём уведомлениям и сводкам дойти до заглушки Telegram
+            await asyncio.sleep(args.drain)
+            rss = peak_rss_mb(proc.pid)
+
+    result = {
+        "commit": _commit(),
+        "host": {"cpus": os.cpu_count(), "python": platform.python_version()},
+        "params": {
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "sizes_kb": args.sizes_kb,
+            "files_per_size": args.files_per_size,
+            "owners": args.owners,
+            "ips": args.ips,
+            "telegram_latency_ms": args.telegram_latency_ms,
+            "geo_latency_ms": args.geo_latency_ms,
+            "seed": args.seed,
+        },
+        **load.report(elapsed),
+        "server_peak_rss_mb": rss,
+        "upstreams": {
+            "telegram_messages": fakes.telegram_messages,
+            "telegram_calls": fakes.telegram_calls,
+            "geo_lookups": fakes.geo_lookups,
+        },
+    }
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--sizes-kb", type=int, nargs="+", default=[4, 256, 4096])
+    parser.add_argument("--files-per-size", type=int, default=10)
+    parser.add_argument("--owners", type=int, default=50)
+    parser.add_argument("--ips", type=int, default=2000)
+    parser.add_argument("--telegram-latency-ms", type=float, default=50)
+    parser.add_argument("--geo-latency-ms", type=float, default=50)
+    parser.add_argument("--drain", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="записать результат ещё и в файл")
+    asyncio.run(main(parser.parse_args()))
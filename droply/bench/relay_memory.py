@@ -0,0 +1,113 @@
+"""
+Пиковый RSS бот-процесса при пересылке файлов Telegram -> /api/upload.
+
+    cd droply && python -m bench.relay_memory --uploads 10 --size-mb 50
+
+Поднимает локальные заглушки файлового эндпоинта Bot API и /api/upload, затем в
+отдельных процессах прогоняет старый путь (download_file + read + FormData с байтами)
+и потоковый relay, сравнивая ru_maxrss.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import time
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bot.relay import telegram_chunks, upload_form
+
+TOKEN = "123456:bench-token"
+BLOCK = b"\xa5" * (256 * 1024)
+
+
+async def _telegram_file(request: web.Request):
+    size = int(request.app["size"])
+    resp = web.StreamResponse()
+    resp.content_length = size
+    await resp.prepare(request)
+    sent = 0
+    while sent < size:
+        part = BLOCK[:min(len(BLOCK), size - sent)]
+        await resp.write(part)
+        sent += len(part)
+    return resp
+
+
+async def _upload_sink(request: web.Request):
+    reader = await request.multipart()
+    total = 0
+    async for part in reader:
+        while chunk := await part.read_chunk(256 * 1024):
+            total += len(chunk)
+    return web.json_response({"size": total})
+
+
+def _serve(port: int, size: int):
+    app = web.Application(client_max_size=0)
+    app["size"] = size
+    app.router.add_get("/file/bot{token}/{path:.*}", _telegram_file)
+    app.router.add_post("/api/upload", _upload_sink)
+    web.run_app(app, host="127.0.0.1", port=port, print=None)
+
+
+async def _relay_once(bot: Bot, s: aiohttp.ClientSession, base: str, mode: str):
+    if mode == "buffered":
+        downloaded = await bot.download_file("documents/file.bin")
+        form = aiohttp.FormData()
+        form.add_field("file", downloaded.read(), filename="file.bin")
+        form.add_field("user_id", "1")
+    else:
+        form = upload_form(telegram_chunks(bot, "documents/file.bin"), "file.bin", 1)
+    async with s.post(f"{base}/api/upload", data=form) as r:
+        r.raise_for_status()
+
+
+def _run_mode(mode: str, base: str, uploads: int, out):
+    async def run():
+        session = AiohttpSession(api=TelegramAPIServer.from_base(base))
+        bot = Bot(token=TOKEN, session=session)
+        t0 = time.perf_counter()
+        async with aiohttp.ClientSession() as s:
+            await asyncio.gather(*(_relay_once(bot, s, base, mode) for _ in range(uploads)))
+        await session.close()
+        return time.perf_counter() - t0
+
+    elapsed = asyncio.run(run())
+    out.put({"mode": mode, "seconds": round(elapsed, 2),
+             "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)})
+
+
+def main(args):
+    from ._server import _free_port
+
+    port = _free_port()
+    server = multiprocessing.Process(target=_serve, args=(port, args.size_mb * 1024 * 1024), daemon=True)
+    server.start()
+    time.sleep(1.0)
+    base = f"http://127.0.0.1:{port}"
+
+    results = []
+    try:
+        for mode in ("buffered", "streaming"):
+            out = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=_run_mode, args=(mode, base, args.uploads, out))
+            proc.start()
+            results.append(out.get())
+            proc.join()
+    finally:
+        server.terminate()
+
+    print(json.dumps({"uploads": args.uploads, "size_mb": args.size_mb, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=10)
+    parser.add_argument("--size-mb", type=int, default=50)
+    main(parser.parse_args())
@@ -0,0 +1,114 @@
+"""
+Поиск файлов в админке: ilike('%q%') против FTS5 (api.search) на большом каталоге.
+
+    cd droply && python -m bench.search_files --files 1000000
+
+Строит во временной SQLite-БД таблицу files с --files строк (имена — смесь русских и
+английских слов), индекс files_fts тем же
+rebuild(), что и миграция, и меряет p50/p99 для одинаковых запросов обоими способами.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from api import search
+
+from ._server import percentile
+
+WORDS = [
+    "отчёт", "договор", "счёт", "фото", "презентация", "квартал", "итоги", "смета", "резюме", "акт",
+    "report", "invoice", "photo", "backup", "draft", "final", "scan", "slides", "budget", "notes",
+]
+EXTS = ["pdf", "docx", "xlsx", "jpg", "png", "zip", "txt", "mp4"]
+QUERIES = ["отчет", "отч 2023", "договор итоги", "invoice", "fin", "scan 12", "презентация квартал", "xlsx"]
+
+LIKE_SQL = (
+    "SELECT id FROM files WHERE is_active = 1 AND (original_filename LIKE ? OR file_code LIKE ?) "
+    "ORDER BY upload_date DESC, id DESC LIMIT 10"
+)
+FTS_SQL = (
+    "SELECT files.id FROM files_fts JOIN files ON files.id = files_fts.rowid "
+    "WHERE files_fts MATCH ? AND files.is_active = 1 ORDER BY bm25(files_fts, ?, ?), files.id LIMIT 10"
+)
+
+
+def _name(rnd: random.Random) -> str:
+    words = rnd.sample(WORDS, rnd.randint(1, 3))
+    return "_".join(words) + f"_{rnd.randint(2015, 2025)}.{rnd.choice(EXTS)}"
+
+
+def _populate(path: str, count: int):
+    rnd = random.Random(42)
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE files (id INTEGER PRIMARY KEY, file_code VARCHAR(6), original_filename VARCHAR(255), "
+        "upload_date DATETIME, is_active BOOLEAN)"
+    )
+    conn.execute("CREATE INDEX ix_files_active_upload ON files (upload_date) WHERE is_active = 1")
+    batch = []
+    for i in range(1, count + 1):
+        code = "".join(rnd.choices("abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789", k=5))
+        batch.append((i, code, _name(rnd), f"2024-01-01 00:00:{i % 60:02d}.{i:06d}", rnd.random() > 0.1))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", batch)
+            batch = []
+    conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+
+def _measure(conn: sqlite3.Connection, sql: str, params_for, repeats: int) -> dict:
+    lat = []
+    for _ in range(repeats):
+        for q in QUERIES:
+            t0 = time.perf_counter()
+            conn.execute(sql, params_for(q)).fetchall()
+            lat.append((time.perf_counter() - t0) * 1000)
+    return {"p50_ms": round(percentile(lat, 50), 3), "p99_ms": round(percentile(lat, 99), 3)}
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="droply-search-")
+    path = os.path.join(workdir, "bench.db")
+
+    t0 = time.perf_counter()
+    _populate(path, args.files)
+    populate_s = time.perf_counter() - t0
+
+    engine = create_engine(f"sqlite:///{path}")
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        if not search.create(conn):
+            raise SystemExit("SQLite built without FTS5")
+        indexed = search.rebuild(conn)
+    index_s = time.perf_counter() - t0
+
+    conn = sqlite3.connect(path)
+    like = _measure(conn, LIKE_SQL, lambda q: (f"%{q}%", f"%{q}%"), args.repeats)
+    fts = _measure(conn, FTS_SQL, lambda q: (search.fts_query(q), search.NAME_WEIGHT, search.CODE_WEIGHT), args.repeats)
+    conn.close()
+
+    print(json.dumps({
+        "files": args.files,
+        "indexed": indexed,
+        "populate_s": round(populate_s, 1),
+        "fts_build_s": round(index_s, 1),
+        "db_mb": round(os.path.getsize(path) / 1024 / 1024, 1),
+        "ilike": like,
+        "fts5": fts,
+    }, indent=2))
+    os.remove(path)
+    os.rmdir(workdir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,69 @@
+"""
+Латентность поиска блоба в плоском и шардированном каталоге в зависимости от числа файлов.
+
+    cd droply && python -m bench.storage_lookup --counts 1000 10000 100000
+
+Для каждого N создаётся N пустых файлов в обеих раскладках (api.storage.legacy_path_for /
+path_for) и меряется os.stat для существующих и отсутствующих имён.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from api import storage
+
+from ._server import percentile
+
+
+def _populate(root: str, names: list[str], resolver):
+    storage.FILES_DIR = root
+    for name in names:
+        path = resolver(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+
+
+def _measure(root: str, names: list[str], resolver) -> dict:
+    storage.FILES_DIR = root
+    lat = []
+    for name in names:
+        t0 = time.perf_counter()
+        os.path.exists(resolver(name))
+        lat.append((time.perf_counter() - t0) * 1e6)
+    return {"p50_us": round(percentile(lat, 50), 2), "p99_us": round(percentile(lat, 99), 2)}
+
+
+def main(args):
+    rnd = random.Random(42)
+    results = []
+    for count in args.counts:
+        names = [f"{rnd.getrandbits(256):064x}" for _ in range(count)]
+        probe_hit = rnd.sample(names, min(args.probes, count))
+        probe_miss = [f"{rnd.getrandbits(256):064x}" for _ in range(args.probes)]
+
+        row = {"files": count}
+        for layout, resolver in (("flat", storage.legacy_path_for), ("sharded", storage.path_for)):
+            root = tempfile.mkdtemp(prefix=f"droply-{layout}-")
+            try:
+                _populate(root, names, resolver)
+                row[layout] = {
+                    "hit": _measure(root, probe_hit, resolver),
+                    "miss": _measure(root, probe_miss, resolver),
+                }
+            finally:
+                shutil.rmtree(root)
+        results.append(row)
+        print(json.dumps(row), flush=True)
+
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--probes", type=int, default=5000)
+    main(parser.parse_args())
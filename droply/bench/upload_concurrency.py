@@ -0,0 +1,86 @@
+"""
+Латентность коротких ссылок во время параллельных крупных загрузок.
+
+    cd droply && python -m bench.upload_concurrency --uploads 4 --size-mb 50
+
+Сначала меряется p50/p99 для GET /{file_code} без нагрузки, затем то же самое,
+пока в полёте --uploads загрузок по --size-mb МБ. При неблокирующей загрузке
+p99 во второй фазе должен оставаться того же порядка, что и в первой.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from ._server import droply_server, percentile
+
+CHUNK = 256 * 1024
+
+
+async def _payload(size: int):
+    block = b"\0" * CHUNK
+    sent = 0
+    while sent < size:
+        part = block[:min(CHUNK, size - sent)]
+        sent += len(part)
+        yield part
+
+
+async def _upload(s: aiohttp.ClientSession, base_url: str, size: int):
+    form = aiohttp.FormData()
+    form.add_field("file", _payload(size), filename="big.bin", content_type="application/octet-stream")
+    async with s.post(f"{base_url}/api/upload", data=form) as r:
+        r.raise_for_status()
+        return await r.json()
+
+
+async def _probe(s: aiohttp.ClientSession, url: str, duration: float) -> list[float]:
+    latencies = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        t0 = time.perf_counter()
+        async with s.get(url) as r:
+            await r.read()
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies
+
+
+def _summary(latencies: list[float]) -> dict:
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+async def main(args):
+    async with droply_server() as (base_url, _):
+        async with aiohttp.ClientSession() as s:
+            seed = await _upload(s, base_url, 1024)
+            url = f"{base_url}/{seed['file_code']}"
+
+            idle = await _probe(s, url, args.duration)
+
+            uploads = [
+                asyncio.create_task(_upload(s, base_url, args.size_mb * 1024 * 1024))
+                for _ in range(args.uploads)
+            ]
+            loaded = await _probe(s, url, args.duration)
+            await asyncio.gather(*uploads)
+
+    print(json.dumps({
+        "uploads_in_flight": args.uploads,
+        "upload_size_mb": args.size_mb,
+        "idle": _summary(idle),
+        "under_upload": _summary(loaded),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,227 @@
+"""
+Доступ бота к данным Droply.
+
+LocalBackend — бот работает с той же БД, что и API (в одном процессе или отдельным
+`run.py bot` на том же хосте): вызывает api.services напрямую, с собственной сессией
+БД и без HTTP-петли через BASE_URL.
+HttpBackend — бот на другом хосте: те же операции через REST API.
+
+Оба возвращают словари в формате JSON-ответов API и бросают BackendError
+вместо HTTP-статусов.
+"""
+import asyncio
+import base64
+import hashlib
+from typing import AsyncIterator, Optional, Union
+
+import aiohttp
+
+from .config import (BASE_URL, BOT_BACKEND, HTTP_UPLOAD_TIMEOUT, HTTP_RETRIES,
+                     CHUNKED_UPLOAD_THRESHOLD, CHUNKED_UPLOAD_CHUNK)
+from .http import ApiClient, RETRY_BACKOFF
+from .relay import upload_form, fixed_chunks
+
+
+class BackendError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class HttpBackend:
+    def __init__(self, http: ApiClient):
+        self.http = http
+        self.upload_timeout = aiohttp.ClientTimeout(total=HTTP_UPLOAD_TIMEOUT)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def _call(self, method: str, path: str, fields: Optional[dict] = None, **kwargs) -> dict:
+        if fields is not None:
+            form = aiohttp.FormData()
+            for k, v in fields.items():
+                form.add_field(k, str(v))
+            kwargs["data"] = form
+        async with self.http.request(method, f"{BASE_URL}{path}", **kwargs) as r:
+            if r.status != 200:
+                raise BackendError(r.status, await r.text())
+            return await r.json()
+
+    # ---- пользователь ----
+    async def upload(self, chunks: AsyncIterator[bytes], filename: str, user_id: int,
+                     size: Optional[int] = None) -> dict:
+        if size and size > CHUNKED_UPLOAD_THRESHOLD:
+            return await self._upload_chunked(chunks, filename, user_id, size)
+        form = upload_form(chunks, filename, user_id)
+        return await self._call("POST", "/api/upload", data=form, timeout=self.upload_timeout)
+
+    async def _upload_chunked(self, chunks: AsyncIterator[bytes], filename: str, user_id: int, size: int) -> dict:
+        # часть держим в памяти, пока сервер её не принял: при обрыве повторяется только она
+        session = await self._call("POST", "/api/uploads", {
+            "filename": filename, "size": size, "user_id": user_id, "chunk_size": CHUNKED_UPLOAD_CHUNK,
+        })
+        url = f"{BASE_URL}/api/uploads/{session['upload_id']}"
+        try:
+            offset = 0
+            async for part in fixed_chunks(chunks, session["chunk_size"]):
+                await self._put_chunk(url, offset, part)
+                offset += len(part)
+            return await self._call("POST", f"/api/uploads/{session['upload_id']}/finalize",
+                                    timeout=self.upload_timeout)
+        except BaseException:
+            try:
+                async with self.http.delete(url):
+                    pass
+            except Exception:
+                pass
+            raise
+
+    async def _put_chunk(self, url: str, offset: int, part: bytes):
+        headers = {
+            "Upload-Offset": str(offset),
+            "Upload-Checksum": "sha256 " + base64.b64encode(hashlib.sha256(part).digest()).decode(),
+        }
+        for attempt in range(HTTP_RETRIES + 1):
+            last = attempt == HTTP_RETRIES
+            try:
+                async with self.http.put(url, data=part, headers=headers, timeout=self.upload_timeout) as r:
+                    if r.status == 200:
+                        return
+                    # 460 — часть испортилась в пути, 5xx — сервер; остальное повтор не исправит
+                    if last or not (r.status == 460 or r.status >= 500):
+                        raise BackendError(r.status, await r.text())
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last:
+                    raise
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    async def replace(self, file_code: str, chunks: AsyncIterator[bytes], filename: str, user_id: int) -> dict:
+        form = upload_form(chunks, filename, user_id)
+        return await self._call("PUT", f"/api/files/{file_code}/replace", data=form, timeout=self.upload_timeout)
+
+    async def file_stats(self, file_code: str) -> dict:
+        return await self._call("GET", f"/api/stats/{file_code}")
+
+    async def list_files(self, user_id: int) -> dict:
+        return await self._call("GET", f"/api/files/{user_id}")
+
+    async def toggle(self, file_code: str, field: str, user_id: int) -> dict:
+        return await self._call("PATCH", f"/api/files/{file_code}/{field}", {"user_id": user_id})
+
+    async def delete(self, file_code: str, user_id: int) -> dict:
+        return await self._call("DELETE", f"/api/files/{file_code}", {"user_id": user_id})
+
+    # ---- админка ----
+    async def admin_stats(self, admin_id: int) -> dict:
+        return await self._call("GET", "/api/admin/stats", params={"admin_id": admin_id})
+
+    async def admin_files(self, admin_id: int, q: Optional[str], cursor: Optional[str], size: int) -> dict:
+        params = {"admin_id": admin_id, "size": size}
+        if q:
+            params["q"] = q
+        if cursor:
+            params["cursor"] = cursor
+        return await self._call("GET", "/api/admin/files", params=params)
+
+    async def admin_logs(self, admin_id: int, file_code: str, cursor: Optional[str], size: int) -> dict:
+        params = {"admin_id": admin_id, "size": size}
+        if cursor:
+            params["cursor"] = cursor
+        return await self._call("GET", f"/api/admin/logs/{file_code}", params=params)
+
+    async def admin_toggle(self, admin_id: int, file_code: str, field: str) -> dict:
+        return await self._call("PATCH", f"/api/admin/files/{file_code}/toggle", {"admin_id": admin_id, "field": field})
+
+    async def admin_delete(self, admin_id: int, file_code: str) -> dict:
+        return await self._call("DELETE", f"/api/admin/files/{file_code}", {"admin_id": admin_id})
+
+    async def broadcast(self, admin_id: int, message: str) -> dict:
+        return await self._call("POST", "/api/admin/broadcast", {"message": message, "admin_id": admin_id})
+
+    async def broadcast_status(self, admin_id: int, job_id: int) -> dict:
+        return await self._call("GET", f"/api/admin/broadcast/{job_id}", params={"admin_id": admin_id})
+
+
+class LocalBackend:
+    def __init__(self):
+        # импорт здесь: api.database при импорте открывает БД и прогоняет миграции,
+        # в раздельном деплое бот этого делать не должен
+        from api import services, filecache
+        from api.database import AsyncSessionLocal
+        self.services = services
+        self.filecache = filecache
+        self.session_factory = AsyncSessionLocal
+
+    async def start(self):
+        # у процесса бота свой filecache — изменения из воркеров API приходят через БД
+        self.filecache.follower.start(self.session_factory)
+
+    async def close(self):
+        await self.filecache.follower.stop()
+
+    async def _run(self, op: str, *args, admin_id: Optional[int] = None, **kwargs) -> dict:
+        try:
+            if admin_id is not None:
+                self.services.check_admin(admin_id)
+            async with self.session_factory() as db:
+                return await getattr(self.services, op)(db, *args, **kwargs)
+        except self.services.ServiceError as e:
+            raise BackendError(e.status_code, e.detail) from e
+
+    # ---- пользователь ----
+    async def upload(self, chunks: AsyncIterator[bytes], filename: str, user_id: int,
+                     size: Optional[int] = None) -> dict:
+        # без сети до API докачивать нечего — пишем потоком сразу в хранилище
+        return await self._run("upload", chunks, filename, user_id)
+
+    async def replace(self, file_code: str, chunks: AsyncIterator[bytes], filename: str, user_id: int) -> dict:
+        return await self._run("replace", file_code, chunks, filename, user_id)
+
+    async def file_stats(self, file_code: str) -> dict:
+        return await self._run("file_stats", file_code)
+
+    async def list_files(self, user_id: int) -> dict:
+        return await self._run("list_files", user_id)
+
+    async def toggle(self, file_code: str, field: str, user_id: int) -> dict:
+        return await self._run("toggle", file_code, field, user_id)
+
+    async def delete(self, file_code: str, user_id: int) -> dict:
+        return await self._run("delete", file_code, user_id)
+
+    # ---- админка ----
+    async def admin_stats(self, admin_id: int) -> dict:
+        return await self._run("admin_stats", admin_id=admin_id)
+
+    async def admin_files(self, admin_id: int, q: Optional[str], cursor: Optional[str], size: int) -> dict:
+        return await self._run("admin_files", q, cursor, size, admin_id=admin_id)
+
+    async def admin_logs(self, admin_id: int, file_code: str, cursor: Optional[str], size: int) -> dict:
+        return await self._run("admin_logs", file_code, cursor, size, admin_id=admin_id)
+
+    async def admin_toggle(self, admin_id: int, file_code: str, field: str) -> dict:
+        return await self._run("toggle", file_code, field, None, admin_id=admin_id)
+
+    async def admin_delete(self, admin_id: int, file_code: str) -> dict:
+        return await self._run("delete", file_code, None, admin_id=admin_id)
+
+    async def broadcast(self, admin_id: int, message: str) -> dict:
+        return await self._run("start_broadcast", admin_id, message, admin_id=admin_id)
+
+    async def broadcast_status(self, admin_id: int, job_id: int) -> dict:
+        return await self._run("broadcast_status", job_id, admin_id=admin_id)
+
+
+Backend = Union[LocalBackend, HttpBackend]
+
+
+def make_backend(http: ApiClient) -> Backend:
+    if BOT_BACKEND == "local":
+        return LocalBackend()
+    if BOT_BACKEND == "http":
+        return HttpBackend(http)
+    raise ValueError(f"Unknown BOT_BACKEND: {BOT_BACKEND}")
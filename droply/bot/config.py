@@ -4,3 +4,46 @@ ADMIN_IDS = [5916500182]
 BASE_URL = "http://localhost:8001"
 HOST = "0.0.0.0"
 PORT = 8001
+
+# геолокация IP: "ip-api" (онлайн), "csv" (диапазоны start_ip,end_ip,country,city) или "mmdb"
+GEO_BACKEND = "ip-api"
+GEO_DB_PATH = ""
+GEO_API_URL = "http://ip-api.com/json/{ip}?lang=ru&fields=status,country,city"
+
+# свой сервер Bot API (telegram-bot-api или заглушка в бенчмарках); None — api.telegram.org
+TELEGRAM_API_URL = None
+
+# общий HTTP-клиент бота (bot/http.py)
+HTTP_TIMEOUT = 30
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_UPLOAD_TIMEOUT = 600
+HTTP_RETRIES = 2
+HTTP_POOL_LIMIT = 100
+HTTP_POOL_PER_HOST = 20
+
+# как бот получает данные: "local" — напрямую через api.services (бот в одном процессе
+# с API или отдельно на том же хосте и той же БД), "http" — через REST API по BASE_URL
+BOT_BACKEND = "local"
+
+# состояние диалогов бота (FSM): "sqlite" — файл FSM_DB_PATH, переживает рестарт;
+# "memory" — в памяти процесса; "redis://host:6379/0" — Redis (нужен пакет redis)
+FSM_STORAGE = "sqlite"
+FSM_DB_PATH = "./bot_state.db"
+
+# run.py api: число воркеров uvicorn (бот при этом запускается отдельно: run.py bot)
+API_WORKERS = 4
+
+# файлы из Telegram: облачный Bot API отдаёт боту файлы до 20 МБ, свой telegram-bot-api — до 2 ГБ
+BOT_MAX_FILE_SIZE = 50 * 1024 * 1024
+# HttpBackend шлёт файлы крупнее порога частями через /api/uploads: обрыв стоит одной части
+CHUNKED_UPLOAD_THRESHOLD = 16 * 1024 * 1024
+CHUNKED_UPLOAD_CHUNK = 8 * 1024 * 1024
+
+# срок жизни файлов и квоты (api/quotas.py, api/sweeper.py); None — без ограничения
+FILE_DEFAULT_TTL_DAYS = None
+FILE_MAX_TTL_DAYS = 365
+USER_QUOTA_BYTES = 2 * 1024 ** 3
+# сколько дней держать строки и логи удалённых/истёкших файлов перед окончательной очисткой
+PURGE_AFTER_DAYS = 30
+# лог обращений старше стольких дней (целыми месяцами) уходит из БД в gzip-архивы api/archive
+ARCHIVE_AFTER_DAYS = 90
@@ -0,0 +1,95 @@
+"""
+Хранилище FSM бота вне памяти процесса.
+
+MemoryStorage теряет состояние диалогов (ожидание файла для замены, ввод рассылки,
+навигация по списку файлов в админке) при каждом рестарте и не даёт вынести бота в
+отдельный процесс. SQLiteStorage держит его в файле FSM_DB_PATH (WAL, одна
+aiosqlite-связь на процесс); для нескольких хостов — RedisStorage aiogram по URL.
+"""
+import asyncio
+import json
+from typing import Any, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from .config import FSM_STORAGE, FSM_DB_PATH
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS fsm ("
+    "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')"
+)
+
+
+def _key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str = FSM_DB_PATH):
+        self.path = path
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+
+    async def _db(self) -> aiosqlite.Connection:
+        if self._conn is None:
+            async with self._lock:
+                if self._conn is None:
+                    conn = await aiosqlite.connect(self.path)
+                    await conn.execute("PRAGMA journal_mode=WAL")
+                    await conn.execute("PRAGMA synchronous=NORMAL")
+                    await conn.execute("PRAGMA busy_timeout=5000")
+                    await conn.execute(SCHEMA)
+                    await conn.commit()
+                    self._conn = conn
+        return self._conn
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        db = await self._db()
+        await db.execute(
+            "INSERT INTO fsm (key, state) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (_key(key), value),
+        )
+        await db.commit()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        db = await self._db()
+        async with db.execute("SELECT state FROM fsm WHERE key = ?", (_key(key),)) as cur:
+            row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        db = await self._db()
+        await db.execute(
+            "INSERT INTO fsm (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (_key(key), json.dumps(data, ensure_ascii=False)),
+        )
+        await db.commit()
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        db = await self._db()
+        async with db.execute("SELECT data FROM fsm WHERE key = ?", (_key(key),)) as cur:
+            row = await cur.fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+
+def make_storage() -> BaseStorage:
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "sqlite":
+        return SQLiteStorage()
+    if FSM_STORAGE.startswith(("redis://", "rediss://")):
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            raise RuntimeError("FSM_STORAGE=redis://... требует пакет redis")
+        return RedisStorage.from_url(FSM_STORAGE)
+    raise ValueError(f"Unknown FSM_STORAGE: {FSM_STORAGE}")
@@ -1,12 +1,15 @@
+from dataclasses import replace
+
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-import aiohttp
+from aiogram.exceptions import TelegramBadRequest
 
-from ..keyboards import admin_menu, admin_files_menu, admin_file_actions, cancel_keyboard
+from ..keyboards import admin_menu, admin_files_menu, admin_file_actions, broadcast_status_menu, cancel_keyboard
 from ..config import ADMIN_IDS, BASE_URL
+from ..backend import Backend, BackendError
 
 router = Router()
 
@@ -16,8 +19,6 @@ class BroadcastState(StatesGroup):
 class SearchState(StatesGroup):
     waiting_for_query = State()
 
-_admin_pages = {}
-
 @router.message(Command("admin"))
 async def admin_panel(message: Message):
     if message.from_user.id in ADMIN_IDS:
@@ -34,173 +35,161 @@ async def admin_menu_callback(callback: CallbackQuery):
 
 # ====== ДАШБОРД ======
 @router.callback_query(F.data == "admin_dashboard")
-async def admin_dashboard(callback: CallbackQuery):
+async def admin_dashboard(callback: CallbackQuery, api: Backend):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("❌ Доступ запрещен"); return
     try:
-        async with aiohttp.ClientSession() as s:
-            async with s.get(f"{BASE_URL}/api/admin/stats?admin_id={callback.from_user.id}") as r:
-                if r.status != 200:
-                    await callback.message.edit_text("❌ Ошибка при получении статистики", reply_markup=admin_menu()); return
-                st = await r.json()
-                text = (
-                    "📊 <b>Дашборд</b>\n\n"
-                    f"📁 Файлов: <b>{st['total_files']}</b> "
-                    f"(+{st['files_this_week']} за 7д)\n"
-                    f"💾 Объем: <b>{st['total_size_mb']} MB</b>\n"
-                    f"👁 Визитов: <b>{st['total_visits']}</b> "
-                    f"(+{st['visits_this_week']} за 7д)\n"
-                    f"⬇️ Скачиваний: <b>{st['total_downloads']}</b> "
-                    f"(+{st['downloads_this_week']} за 7д)\n\n"
-                    "🏆 <b>Топ по скачиваниям:</b>\n" +
-                    ("\n".join([f"{i+1}. {t['filename']} — {t['downloads']}" for i,t in enumerate(st['top_files'])]) or "—")
-                )
-                await callback.message.edit_text(text, reply_markup=admin_menu(), parse_mode="HTML")
+        st = await api.admin_stats(callback.from_user.id)
+        text = (
+            "📊 <b>Дашборд</b>\n\n"
+            f"📁 Файлов: <b>{st['total_files']}</b> "
+            f"({st['files_this_week']:+d} за 7д)\n"
+            f"💾 Объем: <b>{st['total_size_mb']} MB</b>\n"
+            f"👁 Визитов: <b>{st['total_visits']}</b> "
+            f"(+{st['visits_this_week']} за 7д)\n"
+            f"⬇️ Скачиваний: <b>{st['total_downloads']}</b> "
+            f"(+{st['downloads_this_week']} за 7д)\n\n"
+            "🏆 <b>Топ по скачиваниям:</b>\n" +
+            ("\n".join([f"{i+1}. {t['filename']} — {t['downloads']}" for i,t in enumerate(st['top_files'])]) or "—")
+        )
+        await callback.message.edit_text(text, reply_markup=admin_menu(), parse_mode="HTML")
+    except BackendError:
+        await callback.message.edit_text("❌ Ошибка при получении статистики", reply_markup=admin_menu()); return
     except Exception as e:
         await callback.message.edit_text(f"❌ Ошибка: {e}", reply_markup=admin_menu())
     await callback.answer()
 
 # ====== СПИСОК ФАЙЛОВ ======
+def _nav_state(state: FSMContext) -> FSMContext:
+    # навигация — в хранилище FSM (переживает рестарт бота), но под своим ключом:
+    # state.clear() в диалогах поиска и рассылки её не сбрасывает
+    return FSMContext(storage=state.storage, key=replace(state.key, destiny="admin_pages"))
+
+def _new_nav(q=None) -> dict:
+    # стек курсоров просмотренных страниц: назад — pop, вперёд — push next_cursor
+    return {"cursors": [None], "next": None, "q": q, "size": 10}
+
+async def _files_nav(state: FSMContext) -> dict:
+    return (await _nav_state(state).get_data()).get("nav") or _new_nav()
+
 @router.callback_query(F.data == "all_links")
-async def admin_all_files(callback: CallbackQuery):
+async def admin_all_files(callback: CallbackQuery, state: FSMContext, api: Backend):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("❌ Доступ запрещен"); return
-    info = _admin_pages.get(callback.from_user.id, {"page": 1, "q": None, "size": 10})
-    await _send_files_page(callback, info["page"], info["q"], info["size"])
+    await _send_files_page(callback, api, state, await _files_nav(state))
 
 @router.callback_query(F.data == "admin_prev")
-async def admin_prev(callback: CallbackQuery):
+async def admin_prev(callback: CallbackQuery, state: FSMContext, api: Backend):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer(); return
-    info = _admin_pages.get(callback.from_user.id, {"page": 1, "q": None, "size": 10})
-    info["page"] = max(1, info["page"] - 1)
-    _admin_pages[callback.from_user.id] = info
-    await _send_files_page(callback, info["page"], info["q"], info["size"])
+    nav = await _files_nav(state)
+    if len(nav["cursors"]) > 1:
+        nav["cursors"].pop()
+    await _send_files_page(callback, api, state, nav)
 
 @router.callback_query(F.data == "admin_next")
-async def admin_next(callback: CallbackQuery):
+async def admin_next(callback: CallbackQuery, state: FSMContext, api: Backend):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer(); return
-    info = _admin_pages.get(callback.from_user.id, {"page": 1, "q": None, "size": 10})
-    info["page"] += 1
-    _admin_pages[callback.from_user.id] = info
-    await _send_files_page(callback, info["page"], info["q"], info["size"])
+    nav = await _files_nav(state)
+    if not nav["next"]:
+        await callback.answer("Конец списка"); return
+    nav["cursors"].append(nav["next"])
+    await _send_files_page(callback, api, state, nav)
 
-async def _send_files_page(callback: CallbackQuery, page: int, q: str | None, size: int):
+async def _send_files_page(callback: CallbackQuery, api: Backend, state: FSMContext, nav: dict):
     try:
-        async with aiohttp.ClientSession() as s:
-            url = f"{BASE_URL}/api/admin/files?admin_id={callback.from_user.id}&page={page}&size={size}"
-            if q: url += f"&q={q}"
-            async with s.get(url) as r:
-                if r.status != 200:
-                    await callback.message.edit_text("❌ Ошибка при получении файлов", reply_markup=admin_menu()); return
-                result = await r.json()
-                files = result.get("files", [])
-                total = result.get("total", 0)
-                if not files and page > 1:
-                    await callback.answer("Конец списка");
-                    _admin_pages[callback.from_user.id] = {"page": max(1, page-1), "q": q, "size": size}
-                    return
-                text = f"📁 <b>Все файлы</b> (стр {result['page']}, всего {total})\n\n"
-                for i, f in enumerate(files, 1):
-                    text += (
-                        f"{i}. <b>{f['filename']}</b>\n"
-                        f"   💾 {f['size_mb']} MB | 👤 ID: {f['user_id']}\n"
-                        f"   🔗 <code>{f['download_url']}</code>\n"
-                        f"   ⚙️ /manage_{f['file_code']}\n\n"
-                    )
-                await callback.message.edit_text(text, reply_markup=admin_files_menu(), parse_mode="HTML")
+        result = await api.admin_files(callback.from_user.id, nav["q"], nav["cursors"][-1], nav["size"])
+        files = result.get("files", [])
+        total = result.get("total", 0)
+        nav["next"] = result.get("next_cursor")
+        await _nav_state(state).set_data({"nav": nav})
+        text = f"📁 <b>Все файлы</b> (стр {len(nav['cursors'])}, всего ~{total})\n\n"
+        for i, f in enumerate(files, 1):
+            text += (
+                f"{i}. <b>{f['filename']}</b>\n"
+                f"   💾 {f['size_mb']} MB | 👤 ID: {f['user_id']}\n"
+                f"   🔗 <code>{f['download_url']}</code>\n"
+                f"   ⚙️ /manage_{f['file_code']}\n\n"
+            )
+        await callback.message.edit_text(text, reply_markup=admin_files_menu(), parse_mode="HTML")
+    except BackendError:
+        await callback.message.edit_text("❌ Ошибка при получении файлов", reply_markup=admin_menu()); return
     except Exception as e:
         await callback.message.edit_text(f"❌ Ошибка: {e}", reply_markup=admin_menu())
     await callback.answer()
 
 
 @router.message(F.text.regexp(r"^/manage_[A-Za-z0-9]+$"))
-async def admin_manage_file(message: Message):
+async def admin_manage_file(message: Message, api: Backend):
     if message.from_user.id not in ADMIN_IDS:
         return
     code = message.text.split("_",1)[1]
     try:
-        async with aiohttp.ClientSession() as s:
-            async with s.get(f"{BASE_URL}/api/stats/{code}") as r:
-                if r.status != 200:
-                    await message.answer("❌ Файл не найден"); return
-                st = await r.json()
-                size_mb = (st.get("size", 0) / 1024 / 1024) if st.get("size") else 0
-                text = (
-                    f"<b>Управление файлом</b>\n\n"
-                    f"📁 {st['filename']}\n"
-                    f"📦 {size_mb:.2f} MB\n"
-                    f"👁 {st['visits']} | ⬇️ {st['downloads']}\n"
-                    f"🔗 <code>{'{}/{}'.format(BASE_URL, code)}</code>"
-                )
-                kb = admin_file_actions(code, st["notify_visits"], st["notify_downloads"])
-                await message.answer(text, reply_markup=kb, parse_mode="HTML")
+        text, kb = await _manage_view(api, code)
+        await message.answer(text, reply_markup=kb, parse_mode="HTML")
+    except BackendError:
+        await message.answer("❌ Файл не найден"); return
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
 
+async def _manage_view(api: Backend, code: str):
+    st = await api.file_stats(code)
+    size_mb = (st.get("size", 0) / 1024 / 1024) if st.get("size") else 0
+    text = (
+        f"<b>Управление файлом</b>\n\n"
+        f"📁 {st['filename']}\n"
+        f"📦 {size_mb:.2f} MB\n"
+        f"👁 {st['visits']} | ⬇️ {st['downloads']}\n"
+        f"🔗 <code>{'{}/{}'.format(BASE_URL, code)}</code>"
+    )
+    return text, admin_file_actions(code, st["notify_visits"], st["notify_downloads"])
+
 # ====== ТУМБЛЕРЫ УВЕДОМЛЕНИЙ ======
 @router.callback_query(F.data.startswith("admin_toggle_visits_"))
-async def admin_toggle_visits(callback: CallbackQuery):
-    await _admin_toggle(callback, field="notify_visits")
+async def admin_toggle_visits(callback: CallbackQuery, api: Backend):
+    await _admin_toggle(callback, api, field="notify_visits")
 
 @router.callback_query(F.data.startswith("admin_toggle_downloads_"))
-async def admin_toggle_downloads(callback: CallbackQuery):
-    await _admin_toggle(callback, field="notify_downloads")
+async def admin_toggle_downloads(callback: CallbackQuery, api: Backend):
+    await _admin_toggle(callback, api, field="notify_downloads")
 
-async def _admin_toggle(callback: CallbackQuery, field: str):
+async def _admin_toggle(callback: CallbackQuery, api: Backend, field: str):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("❌ Доступ запрещен"); return
     code = callback.data.split("_")[-1]
     try:
-        async with aiohttp.ClientSession() as s:
-            form = aiohttp.FormData()
-            form.add_field("admin_id", str(callback.from_user.id))
-            form.add_field("field", field)
-            async with s.patch(f"{BASE_URL}/api/admin/files/{code}/toggle", data=form) as r:
-                if r.status == 200:
-                    async with s.get(f"{BASE_URL}/api/stats/{code}") as r2:
-                        st = await r2.json()
-                        size_mb = (st.get("size", 0) / 1024 / 1024) if st.get("size") else 0
-                        text = (
-                            f"<b>Управление файлом</b>\n\n"
-                            f"📁 {st['filename']}\n"
-                            f"📦 {size_mb:.2f} MB\n"
-                            f"👁 {st['visits']} | ⬇️ {st['downloads']}\n"
-                            f"🔗 <code>{'{}/{}'.format(BASE_URL, code)}</code>"
-                        )
-                        kb = admin_file_actions(code, st["notify_visits"], st["notify_downloads"])
-                        await callback.message.edit_text(text, reply_markup=kb, parse_mode="HTML")
-                else:
-                    await callback.answer("Ошибка")
+        await api.admin_toggle(callback.from_user.id, code, field)
+        text, kb = await _manage_view(api, code)
+        await callback.message.edit_text(text, reply_markup=kb, parse_mode="HTML")
+    except BackendError:
+        await callback.answer("Ошибка")
     except Exception as e:
         await callback.answer(f"Ошибка: {e}")
     await callback.answer()
 
 # ====== ЛОГИ ======
 @router.callback_query(F.data.startswith("admin_logs_"))
-async def admin_logs_view(callback: CallbackQuery):
+async def admin_logs_view(callback: CallbackQuery, api: Backend):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("❌ Доступ запрещен"); return
     code = callback.data.split("_", 2)[2]
     try:
-        async with aiohttp.ClientSession() as s:
-            async with s.get(f"{BASE_URL}/api/admin/logs/{code}?admin_id={callback.from_user.id}&page=1&size=20") as r:
-                if r.status != 200:
-                    await callback.answer("Ошибка"); return
-                data = await r.json()
-                rows = data.get("logs", [])
-                if not rows:
-                    await callback.message.edit_text("📜 Логи пусты", reply_markup=admin_menu()); return
-                lines = []
-                for r in rows:
-                    place = ", ".join([p for p in [r['country'], r['city']] if p])
-                    lines.append(f"{'👁' if r['type']=='visit' else '⬇️'} {r['time']}  IP: {r['ip']}  {place}")
-                await callback.message.edit_text(
-                    f"📜 <b>Последние события ({len(rows)})</b>\n\n" + "\n".join(lines),
-                    reply_markup=admin_menu(),
-                    parse_mode="HTML"
-                )
+        data = await api.admin_logs(callback.from_user.id, code, cursor=None, size=20)
+        rows = data.get("logs", [])
+        if not rows:
+            await callback.message.edit_text("📜 Логи пусты", reply_markup=admin_menu()); return
+        lines = []
+        for r in rows:
+            place = ", ".join([p for p in [r['country'], r['city']] if p])
+            lines.append(f"{'👁' if r['type']=='visit' else '⬇️'} {r['time']}  IP: {r['ip']}  {place}")
+        await callback.message.edit_text(
+            f"📜 <b>Последние события ({len(rows)})</b>\n\n" + "\n".join(lines),
+            reply_markup=admin_menu(),
+            parse_mode="HTML"
+        )
+    except BackendError:
+        await callback.answer("Ошибка"); return
     except Exception as e:
         await callback.message.edit_text(f"❌ Ошибка: {e}", reply_markup=admin_menu())
     await callback.answer()
@@ -224,11 +213,10 @@ async def admin_search(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(SearchState.waiting_for_query)
-async def admin_search_query(message: Message, state: FSMContext):
+async def admin_search_query(message: Message, state: FSMContext, api: Backend):
     if message.from_user.id not in ADMIN_IDS:
         return
     q = (message.text or "").strip()
-    _admin_pages[message.from_user.id] = {"page": 1, "q": q, "size": 10}
     await state.clear()
 
     class DummyCb:
@@ -236,7 +224,7 @@ async def admin_search_query(message: Message, state: FSMContext):
         async def answer(self, *a, **kw): pass
         @property
         def message(self): return message
-    await _send_files_page(DummyCb(), 1, q, 10)
+    await _send_files_page(DummyCb(), api, state, _new_nav(q))
 
 # ====== РАССЫЛКА ======
 @router.callback_query(F.data == "sending")
@@ -252,40 +240,59 @@ async def admin_broadcast_start(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(BroadcastState.waiting_for_message)
-async def admin_broadcast_message(message: Message, state: FSMContext):
+async def admin_broadcast_message(message: Message, state: FSMContext, api: Backend):
     if message.from_user.id not in ADMIN_IDS:
         return
     try:
-        async with aiohttp.ClientSession() as session:
-            form = aiohttp.FormData()
-            form.add_field("message", message.text)
-            form.add_field("admin_id", str(message.from_user.id))
-            async with session.post(f"{BASE_URL}/api/admin/broadcast", data=form) as resp:
-                if resp.status == 200:
-                    result = await resp.json()
-                    await message.answer(f"✅ {result['message']}", reply_markup=admin_menu())
-                else:
-                    await message.answer("❌ Ошибка при отправке рассылки", reply_markup=admin_menu())
+        job = await api.broadcast(message.from_user.id, message.text)
+        await message.answer(_broadcast_text(job), reply_markup=broadcast_status_menu(job["job_id"]), parse_mode="HTML")
+    except BackendError:
+        await message.answer("❌ Ошибка при отправке рассылки", reply_markup=admin_menu())
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}", reply_markup=admin_menu())
     finally:
         await state.clear()
 
+@router.callback_query(F.data.startswith("broadcast_status_"))
+async def admin_broadcast_status(callback: CallbackQuery, api: Backend):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("❌ Доступ запрещен"); return
+    job_id = int(callback.data.split("_")[-1])
+    try:
+        job = await api.broadcast_status(callback.from_user.id, job_id)
+        await callback.message.edit_text(_broadcast_text(job), reply_markup=broadcast_status_menu(job_id), parse_mode="HTML")
+    except BackendError:
+        await callback.answer("Рассылка не найдена"); return
+    except TelegramBadRequest:
+        pass  # "message is not modified" — прогресс не сдвинулся с прошлого нажатия
+    except Exception as e:
+        await callback.answer(f"Ошибка: {e}"); return
+    await callback.answer()
+
+_BROADCAST_STATUS = {"pending": "⏳ в очереди", "running": "🚀 идёт", "done": "✅ завершена", "failed": "❌ ошибка"}
+
+def _broadcast_text(job: dict) -> str:
+    text = (
+        f"📢 <b>Рассылка #{job['job_id']}</b> — {_BROADCAST_STATUS.get(job['status'], job['status'])}\n\n"
+        f"👥 Получателей: <b>{job['total']}</b>\n"
+        f"✅ Доставлено: <b>{job['sent']}</b> | ⚠️ Ошибок: <b>{job['failed']}</b>\n"
+        f"📈 Прогресс: <b>{job['progress']}%</b>"
+    )
+    if job.get("error"):
+        text += f"\n\n<code>{job['error']}</code>"
+    return text
+
 # ====== УДАЛЕНИЕ ======
 @router.callback_query(F.data.startswith("admin_delete_"))
-async def admin_delete_file(callback: CallbackQuery):
+async def admin_delete_file(callback: CallbackQuery, api: Backend):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("❌ Доступ запрещен"); return
     file_code = callback.data.split("_", 2)[2]
     try:
-        async with aiohttp.ClientSession() as session:
-            form = aiohttp.FormData()
-            form.add_field("admin_id", str(callback.from_user.id))
-            async with session.delete(f"{BASE_URL}/api/admin/files/{file_code}", data=form) as resp:
-                if resp.status == 200:
-                    await callback.message.edit_text("✅ Файл удален администратором", reply_markup=admin_menu())
-                else:
-                    await callback.message.edit_text("❌ Ошибка при удалении файла", reply_markup=admin_menu())
+        await api.admin_delete(callback.from_user.id, file_code)
+        await callback.message.edit_text("✅ Файл удален администратором", reply_markup=admin_menu())
+    except BackendError:
+        await callback.message.edit_text("❌ Ошибка при удалении файла", reply_markup=admin_menu())
     except Exception as e:
         await callback.message.edit_text(f"❌ Ошибка: {e}", reply_markup=admin_menu())
     await callback.answer()
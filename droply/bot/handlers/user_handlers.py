@@ -3,11 +3,11 @@ from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-import aiohttp
-import urllib.parse
 
-from ..config import BASE_URL
+from ..config import BASE_URL, BOT_MAX_FILE_SIZE
 from ..keyboards import main_menu, back_to_main, upload, file_settings_menu
+from ..backend import Backend, BackendError
+from ..relay import telegram_chunks
 
 
 router = Router()
@@ -46,124 +46,85 @@ async def upload_callback(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "links")
-async def my_links(callback: CallbackQuery):
+async def my_links(callback: CallbackQuery, api: Backend):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{BASE_URL}/api/files/{callback.from_user.id}") as resp:
-                if resp.status != 200:
-                    await callback.message.edit_text("<b>❌ Ошибка при получении файлов</b>", reply_markup=back_to_main(), parse_mode='HTML')
-                    return
-
-                result = await resp.json()
-                files = result.get("files", [])
-                if not files:
-                    await callback.message.edit_text("📎 У вас пока нет загруженных файлов", reply_markup=back_to_main())
-                    return
-                text = "📎 <b>Ваши файлы:</b>"
-                kb = InlineKeyboardBuilder()
-                for i, f in enumerate(files, 1):
-                    kb.row(
-                        InlineKeyboardButton(
-                            text=f"{i}. {f['filename']}",
-                            callback_data=f"file_{f['file_code']}"
-                        )
-                    )
-                kb.row(InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu"))
-
-                await callback.message.edit_text(text, reply_markup=kb.as_markup(), parse_mode="HTML")
+        result = await api.list_files(callback.from_user.id)
+        files = result.get("files", [])
+        if not files:
+            await callback.message.edit_text("📎 У вас пока нет загруженных файлов", reply_markup=back_to_main())
+            return
+        text = "📎 <b>Ваши файлы:</b>"
+        kb = InlineKeyboardBuilder()
+        for i, f in enumerate(files, 1):
+            kb.row(
+                InlineKeyboardButton(
+                    text=f"{i}. {f['filename']}",
+                    callback_data=f"file_{f['file_code']}"
+                )
+            )
+        kb.row(InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu"))
+
+        await callback.message.edit_text(text, reply_markup=kb.as_markup(), parse_mode="HTML")
+    except BackendError:
+        await callback.message.edit_text("<b>❌ Ошибка при получении файлов</b>", reply_markup=back_to_main(), parse_mode='HTML')
     except Exception as e:
         await callback.message.edit_text(f"<b>❌ Ошибка:</b> <code>{e}</code>", reply_markup=back_to_main(), parse_mode='HTML')
     await callback.answer()
 
 
+async def _show_file(callback: CallbackQuery, api: Backend, file_code: str):
+    st = await api.file_stats(file_code)
+    size_mb = (st.get("size", 0) / 1024 / 1024) if st.get("size") else 0
+    await callback.message.edit_text(
+        f"<b>📁 Файл: {st['filename']}\n\n"
+        f"📦 Размер: {size_mb:.2f} MB\n"
+        f"👁 Посещения: {st['visits']} | 📥 Скачивания: {st['downloads']}\n"
+        f"🔗 Ссылка: <code>{BASE_URL}/{file_code}</code></b>\n",
+        reply_markup=file_settings_menu(file_code, st["notify_visits"], st["notify_downloads"]),
+        parse_mode='HTML'
+    )
+
+
 @router.callback_query(F.data.startswith("file_"))
-async def file_actions(callback: CallbackQuery):
+async def file_actions(callback: CallbackQuery, api: Backend):
     file_code = callback.data.split("_", 1)[1]
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{BASE_URL}/api/stats/{file_code}") as resp:
-                if resp.status != 200:
-                    await callback.answer("Файл не найден"); return
-                stats = await resp.json()
-                size_mb = (stats.get("size", 0) / 1024 / 1024) if stats.get("size") else 0
-                await callback.message.edit_text(
-                    f"<b>📁 Файл: {stats['filename']}\n\n"
-                    f"📦 Размер: {size_mb:.2f} MB\n"
-                    f"👁 Посещения: {stats['visits']} | 📥 Скачивания: {stats['downloads']}\n"
-                    f"🔗 Ссылка: <code>{BASE_URL}/{file_code}</code></b>\n",
-                    reply_markup=file_settings_menu(file_code, stats["notify_visits"], stats["notify_downloads"]),
-                    parse_mode='HTML'
-                )
+        await _show_file(callback, api, file_code)
+    except BackendError:
+        await callback.answer("Файл не найден"); return
     except Exception as e:
         await callback.answer(f"Ошибка: {e}")
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("user_toggle_visits_"))
-async def user_toggle_visits(callback: CallbackQuery):
-    file_code = callback.data.split("_")[-1]
-    try:
-        async with aiohttp.ClientSession() as s:
-            form = aiohttp.FormData()
-            form.add_field("user_id", str(callback.from_user.id))
-            async with s.patch(f"{BASE_URL}/api/files/{file_code}/notify_visits", data=form) as r:
-                if r.status == 200:
-                    async with s.get(f"{BASE_URL}/api/stats/{file_code}") as r2:
-                        st = await r2.json()
-                        size_mb = (st.get("size", 0) / 1024 / 1024) if st.get("size") else 0
-                        await callback.message.edit_text(
-                            f"<b>📁 Файл: {st['filename']}\n\n"
-                            f"📦 Размер: {size_mb:.2f} MB\n"
-                            f"👁 Посещения: {st['visits']} | 📥 Скачивания: {st['downloads']}\n"
-                            f"🔗 Ссылка: <code>{BASE_URL}/{file_code}</code></b>\n",
-                            reply_markup=file_settings_menu(file_code, st["notify_visits"], st["notify_downloads"]),
-                            parse_mode='HTML'
-                        )
-                else:
-                    await callback.answer("Ошибка")
-    except Exception as e:
-        await callback.answer(f"Ошибка: {e}")
-    await callback.answer()
+async def user_toggle_visits(callback: CallbackQuery, api: Backend):
+    await _user_toggle(callback, api, "notify_visits")
 
 @router.callback_query(F.data.startswith("user_toggle_downloads_"))
-async def user_toggle_downloads(callback: CallbackQuery):
+async def user_toggle_downloads(callback: CallbackQuery, api: Backend):
+    await _user_toggle(callback, api, "notify_downloads")
+
+async def _user_toggle(callback: CallbackQuery, api: Backend, field: str):
     file_code = callback.data.split("_")[-1]
     try:
-        async with aiohttp.ClientSession() as s:
-            form = aiohttp.FormData()
-            form.add_field("user_id", str(callback.from_user.id))
-            async with s.patch(f"{BASE_URL}/api/files/{file_code}/notify_downloads", data=form) as r:
-                if r.status == 200:
-                    async with s.get(f"{BASE_URL}/api/stats/{file_code}") as r2:
-                        st = await r2.json()
-                        size_mb = (st.get("size", 0) / 1024 / 1024) if st.get("size") else 0
-                        await callback.message.edit_text(
-                            f"<b>📁 Файл: {st['filename']}\n\n"
-                            f"📦 Размер: {size_mb:.2f} MB\n"
-                            f"👁 Посещения: {st['visits']} | 📥 Скачивания: {st['downloads']}\n"
-                            f"🔗 Ссылка: <code>{BASE_URL}/{file_code}</code></b>\n",
-                            reply_markup=file_settings_menu(file_code, st["notify_visits"], st["notify_downloads"]),
-                            parse_mode='HTML'
-                        )
-                else:
-                    await callback.answer("Ошибка")
+        await api.toggle(file_code, field, callback.from_user.id)
+        await _show_file(callback, api, file_code)
+    except BackendError:
+        await callback.answer("Ошибка")
     except Exception as e:
         await callback.answer(f"Ошибка: {e}")
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("delete_"))
-async def delete_file(callback: CallbackQuery):
+async def delete_file(callback: CallbackQuery, api: Backend):
     file_code = callback.data.split("_", 1)[1]
     try:
-        async with aiohttp.ClientSession() as session:
-            form = aiohttp.FormData()
-            form.add_field("user_id", str(callback.from_user.id))
-            async with session.delete(f"{BASE_URL}/api/files/{file_code}", data=form) as resp:
-                if resp.status == 200:
-                    await callback.message.edit_text("<b>✅ Файл успешно удалён</b>", reply_markup=back_to_main(), parse_mode='HTML')
-                else:
-                    await callback.message.edit_text("<b>❌ Ошибка при удалении файла</b>", reply_markup=back_to_main(), parse_mode='HTML')
+        await api.delete(file_code, callback.from_user.id)
+        await callback.message.edit_text("<b>✅ Файл успешно удалён</b>", reply_markup=back_to_main(), parse_mode='HTML')
+    except BackendError:
+        await callback.message.edit_text("<b>❌ Ошибка при удалении файла</b>", reply_markup=back_to_main(), parse_mode='HTML')
     except Exception as e:
         await callback.message.edit_text(f"<b>❌ Ошибка:</b> <code>{e}</code>", reply_markup=back_to_main(), parse_mode='HTML')
     await callback.answer()
@@ -190,7 +151,7 @@ async def handle_text(message: Message, state: FSMContext):
 
 
 @router.message(F.document | F.photo | F.video | F.audio | F.voice)
-async def handle_file(message: Message, state: FSMContext):
+async def handle_file(message: Message, state: FSMContext, api: Backend):
     current_state = await state.get_state()
     if current_state and "broadcast" in current_state:
         return
@@ -222,73 +183,61 @@ async def handle_file(message: Message, state: FSMContext):
             await loading_msg.edit_text("<b>❌ Неподдерживаемый тип файла</b>", parse_mode='HTML')
             return
 
-        MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 МБ
-        if file_size > MAX_FILE_SIZE:
+        if file_size > BOT_MAX_FILE_SIZE:
             await loading_msg.edit_text(
                 f"<b>❌ Файл слишком большой!</b>\n\n"
                 f"Размер: {file_size / 1024 / 1024:.2f} МБ\n"
-                f"Максимальный размер: 50 МБ\n\n"
+                f"Максимальный размер: {BOT_MAX_FILE_SIZE // 1024 // 1024} МБ\n\n"
                 f"Пожалуйста, отправьте файл меньшего размера.",
                 parse_mode='HTML'
             )
             return
 
-        await loading_msg.edit_text("📥 <b>Скачиваю файл из Telegram...</b>", parse_mode='HTML')
-
         file_info = await message.bot.get_file(file.file_id)
-        downloaded = await message.bot.download_file(file_info.file_path)
-        file_bytes = downloaded.read()
-
-        await loading_msg.edit_text("📤 <b>Загружаю файл на сервер...</b>", parse_mode='HTML')
 
         data = await state.get_data()
         replace_file_code = data.get("replace_file_code")
 
-        async with aiohttp.ClientSession() as session:
-            form = aiohttp.FormData()
-            form.add_field("file", file_bytes, filename=file_name)
-            form.add_field("user_id", str(message.from_user.id))
-
-            if replace_file_code:
-                await loading_msg.edit_text("🔄 <b>Заменяю файл...</b>", parse_mode='HTML')
-
-                async with session.put(f"{BASE_URL}/api/files/{replace_file_code}/replace", data=form) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        await loading_msg.edit_text(
-                            f"<b>✅ Файл заменён!\n\n"
-                            f"📁 Имя: {result['filename']}\n"
-                            f"🔗 Ссылка: <code>{result['download_url']}</code></b>",
-                            reply_markup=back_to_main(),
-                            parse_mode='HTML'
-                        )
-                        await state.clear()
-                    else:
-                        error_text = await resp.text()
-                        await loading_msg.edit_text(
-                            f"<b>❌ Ошибка при замене файла:</b>\n<code>{error_text[:100]}...</code>",
-                            parse_mode='HTML'
-                        )
+        # файл идёт из Telegram в хранилище потоком, целиком в памяти не собирается
+        chunks = telegram_chunks(message.bot, file_info.file_path)
+
+        if replace_file_code:
+            await loading_msg.edit_text("🔄 <b>Заменяю файл...</b>", parse_mode='HTML')
+
+            try:
+                result = await api.replace(replace_file_code, chunks, file_name, message.from_user.id)
+            except BackendError as e:
+                await loading_msg.edit_text(
+                    f"<b>❌ Ошибка при замене файла:</b>\n<code>{e.detail[:100]}...</code>",
+                    parse_mode='HTML'
+                )
+            else:
+                await loading_msg.edit_text(
+                    f"<b>✅ Файл заменён!\n\n"
+                    f"📁 Имя: {result['filename']}\n"
+                    f"🔗 Ссылка: <code>{result['download_url']}</code></b>",
+                    reply_markup=back_to_main(),
+                    parse_mode='HTML'
+                )
+                await state.clear()
+        else:
+            await loading_msg.edit_text("📤 <b>Загружаю файл...</b>", parse_mode='HTML')
+
+            try:
+                result = await api.upload(chunks, file_name, message.from_user.id, size=file_size)
+            except BackendError as e:
+                await loading_msg.edit_text(
+                    f"<b>❌ Ошибка при загрузке файла:</b>\n<code>{e.detail[:100]}...</code>",
+                    parse_mode='HTML'
+                )
             else:
-                await loading_msg.edit_text("📤 <b>Загружаю файл...</b>", parse_mode='HTML')
-
-                async with session.post(f"{BASE_URL}/api/upload", data=form) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        filename = urllib.parse.unquote(result["filename"])
-                        await loading_msg.edit_text(
-                            f"<b>✅ Файл загружен!\n\n"
-                            f"📁 Имя: {filename}\n"
-                            f"🔗 Ссылка: <code>{result['download_url']}</code></b>",
-                            reply_markup=back_to_main(),
-                            parse_mode='HTML'
-                        )
-                    else:
-                        error_text = await resp.text()
-                        await loading_msg.edit_text(
-                            f"<b>❌ Ошибка при загрузке файла:</b>\n<code>{error_text[:100]}...</code>",
-                            parse_mode='HTML'
-                        )
+                await loading_msg.edit_text(
+                    f"<b>✅ Файл загружен!\n\n"
+                    f"📁 Имя: {result['filename']}\n"
+                    f"🔗 Ссылка: <code>{result['download_url']}</code></b>",
+                    reply_markup=back_to_main(),
+                    parse_mode='HTML'
+                )
 
     except Exception as e:
         error_msg = str(e)
@@ -0,0 +1,82 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+from .config import HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT, HTTP_RETRIES, HTTP_POOL_LIMIT, HTTP_POOL_PER_HOST
+
+IDEMPOTENT = {"GET", "HEAD"}            # тело FormData нельзя отправить повторно — ретраим только их
+RETRY_STATUSES = {502, 503, 504}
+RETRY_BACKOFF = 0.2
+
+
+class ApiClient:
+    """
+    Один долгоживущий aiohttp-клиент на процесс бота: keep-alive пул соединений,
+    лимиты на хост, общие таймауты и повторы идемпотентных запросов.
+    Создаётся на старте диспетчера и прокидывается в хендлеры как `http`.
+    """
+
+    def __init__(self, timeout: float = HTTP_TIMEOUT, connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+                 retries: int = HTTP_RETRIES, limit: int = HTTP_POOL_LIMIT, limit_per_host: int = HTTP_POOL_PER_HOST):
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.retries = retries
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host,
+                keepalive_timeout=60, ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("ApiClient is not started")
+        return self._session
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        attempts = self.retries + 1 if method in IDEMPOTENT else 1
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                resp = await self.session.request(method, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last:
+                    raise
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+                continue
+            if resp.status in RETRY_STATUSES and not last:
+                resp.release()
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+                continue
+            break
+        try:
+            yield resp
+        finally:
+            resp.release()
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url: str, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url: str, **kwargs):
+        return self.request("DELETE", url, **kwargs)
@@ -73,6 +73,12 @@ def admin_file_actions(file_code: str, notify_visits: bool, notify_downloads: bo
     b.row(InlineKeyboardButton(text="🔙 Назад", callback_data="all_links"))
     return b.as_markup()
 
+def broadcast_status_menu(job_id: int) -> InlineKeyboardMarkup:
+    b = InlineKeyboardBuilder()
+    b.row(InlineKeyboardButton(text="🔄 Обновить", callback_data=f"broadcast_status_{job_id}"))
+    b.row(InlineKeyboardButton(text="🔙 Назад", callback_data="admin_menu"))
+    return b.as_markup()
+
 def cancel_keyboard() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="❌ Отмена", callback_data="admin_menu"))
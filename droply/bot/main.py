@@ -1,20 +1,42 @@
-import asyncio
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-
-from .config import BOT_TOKEN
-from .handlers import user_router, admin_router
-
-
-async def main():
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
-
-    dp.include_router(admin_router)
-    dp.include_router(user_router)
-
-    await dp.start_polling(bot)
-
-
-if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+import asyncio
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from .config import BOT_TOKEN, TELEGRAM_API_URL
+from .handlers import user_router, admin_router
+from .http import ApiClient
+from .backend import make_backend
+from .fsm import make_storage
+
+
+def create_dispatcher() -> Dispatcher:
+    http = ApiClient()
+    api = make_backend(http)
+    # всё, что передано в Dispatcher(...), доступно хендлерам по имени аргумента
+    dp = Dispatcher(storage=make_storage(), http=http, api=api)
+
+    dp.startup.register(http.start)
+    dp.startup.register(api.start)
+    dp.shutdown.register(api.close)
+    dp.shutdown.register(http.close)
+
+    dp.include_router(admin_router)
+    dp.include_router(user_router)
+    return dp
+
+
+def create_bot() -> Bot:
+    # свой сервер Bot API (TELEGRAM_API_URL) — и для `run.py bot`, и для совместного запуска
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    return Bot(token=BOT_TOKEN, session=session)
+
+
+async def main():
+    bot = create_bot()
+    dp = create_dispatcher()
+    await dp.start_polling(bot)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+"""
+Потоковая пересылка файла из Telegram в хранилище Droply.
+
+Вместо bot.download_file() (весь файл в BytesIO) и FormData с ещё одной копией байтов
+чанки из Telegram сразу уходят в тело multipart-запроса. aiohttp тянет следующий чанк
+только после записи предыдущего, так что в памяти на одну загрузку — O(RELAY_CHUNK).
+"""
+from typing import AsyncIterator
+
+import aiohttp
+from aiogram import Bot
+
+RELAY_CHUNK = 256 * 1024
+DOWNLOAD_TIMEOUT = 300
+
+
+async def telegram_chunks(bot: Bot, file_path: str, chunk_size: int = RELAY_CHUNK) -> AsyncIterator[bytes]:
+    url = bot.session.api.file_url(bot.token, file_path)
+    async for chunk in bot.session.stream_content(url, timeout=DOWNLOAD_TIMEOUT, chunk_size=chunk_size,
+                                                  raise_for_status=True):
+        yield chunk
+
+
+def upload_form(chunks: AsyncIterator[bytes], filename: str, user_id: int) -> aiohttp.FormData:
+    # quote_fields=False: имя уходит как есть (UTF-8, кавычки экранированы), а не percent-encoded —
+    # API хранит имена в исходном виде, как их передаёт LocalBackend и браузер
+    form = aiohttp.FormData(quote_fields=False)
+    form.add_field("user_id", str(user_id))
+    # AsyncIterable отправляется chunked-телом, без буферизации файла целиком
+    form.add_field("file", chunks, filename=filename, content_type="application/octet-stream")
+    return form
+
+
+async def fixed_chunks(chunks: AsyncIterator[bytes], size: int) -> AsyncIterator[bytes]:
+    """Перенарезает поток на куски ровно по size байт (последний — остаток) для /api/uploads."""
+    buf = bytearray()
+    async for chunk in chunks:
+        buf += chunk
+        while len(buf) >= size:
+            yield bytes(buf[:size])
+            del buf[:size]
+    if buf:
+        yield bytes(buf)
@@ -1,27 +1,72 @@
+"""
+Запуск Droply.
+
+    python run.py                  # API и бот в одном процессе и одном event loop
+    python run.py api --workers 4  # только API, N процессов uvicorn
+    python run.py bot              # только бот (к API из `run.py api`)
+
+Во втором и третьем режиме состояние, общее для процессов, живёт в БД: FSM бота
+(bot/fsm.py), сброс кэша файлов (api/filecache.py); рассылки, уведомления и сборку
+мусора выполняет один воркер — держатель лизы (api/leases.py).
+"""
+import argparse
 import asyncio
-import threading
 import uvicorn
-from api.main import app as api_app
-from bot.main import main as bot_main
-from bot.config import HOST, PORT
+from bot.config import HOST, PORT, API_WORKERS
+
+async def _stop_polling(dp):
+    try:
+        await dp.stop_polling()
+    except RuntimeError:
+        pass  # поллинг ещё не стартовал
+
+async def main():
+    from api.main import app as api_app
+    from bot.main import create_bot, create_dispatcher
 
-def run_api():
-    uvicorn.run(api_app, host=HOST, port=PORT, log_level="info")
+    # API и бот крутятся в одном event loop: BOT_BACKEND="local" ходит в api.services
+    # напрямую, а сессии aiosqlite и очередь access_log привязаны к своему loop
+    server = uvicorn.Server(uvicorn.Config(api_app, host=HOST, port=PORT, log_level="info"))
+    bot = create_bot()
+    dp = create_dispatcher()
+
+    api_task = asyncio.create_task(server.serve())
+    api_task.add_done_callback(lambda _: asyncio.ensure_future(_stop_polling(dp)))
+    try:
+        # сигналы ловит uvicorn; его остановка гасит и поллинг
+        await dp.start_polling(bot, handle_signals=False)
+    finally:
+        server.should_exit = True
+        await api_task
+
+def run_api(workers: int):
+    # миграции — один раз здесь, до форка: воркеры застанут схему уже актуальной
+    import api.database  # noqa: F401
+    print(f"Запуск API Droply на {HOST}:{PORT}, воркеров: {workers}")
+    uvicorn.run("api.main:app", host=HOST, port=PORT, workers=workers, log_level="info")
 
 def run_bot():
+    from bot.main import main as bot_main
+    print("Telegram бот запускается...")
     asyncio.run(bot_main())
 
 if __name__ == "__main__":
-    print(f"Запуск Droply на {HOST}:{PORT}")
-    print("Telegram бот запускается...")
-    print("Веб-интерфейс запускается...")
-    
-    api_thread = threading.Thread(target=run_api, daemon=True)
-    api_thread.start()
-    
+    parser = argparse.ArgumentParser(description="Droply")
+    parser.add_argument("mode", nargs="?", choices=["all", "api", "bot"], default="all")
+    parser.add_argument("--workers", type=int, default=API_WORKERS)
+    args = parser.parse_args()
+
     try:
-        run_bot()
+        if args.mode == "api":
+            run_api(args.workers)
+        elif args.mode == "bot":
+            run_bot()
+        else:
+            print(f"Запуск Droply на {HOST}:{PORT}")
+            print("Telegram бот запускается...")
+            print("Веб-интерфейс запускается...")
+            asyncio.run(main())
     except KeyboardInterrupt:
         print("\nDroply остановлен")
     except Exception as e:
-        print(f"\nОшибка: {e}")
\ No newline at end of file
+        print(f"\nОшибка: {e}")
@@ -0,0 +1,14 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# модули импортируются как api.* / bot.* из каталога droply, как при `python run.py`
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # api.* работают с путями относительно cwd (api/files, api/archive, api/tmp)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,133 @@
+"""
+Миграции на свежей БД и на БД исходной версии (только files и file_access, файлы
+в плоском api/files под именами <uuid>.<ext>): содержимое производных таблиц и
+планы горячих запросов (api.migrations.HOT_QUERIES).
+"""
+import hashlib
+import os
+
+import pytest
+from sqlalchemy import create_engine
+
+from api.migrations import HOT_QUERIES, check_query_plans, upgrade, plan_of
+from api.models import Base
+
+# схема до всех миграций — как её создавал create_all исходных моделей
+BASELINE_DDL = (
+    "CREATE TABLE files ("
+    "id INTEGER NOT NULL, file_code VARCHAR(6), original_filename VARCHAR(255), "
+    "stored_filename VARCHAR(255), file_size INTEGER, user_id INTEGER, upload_date DATETIME, "
+    "notify_visits BOOLEAN, notify_downloads BOOLEAN, is_active BOOLEAN, "
+    "PRIMARY KEY (id), UNIQUE (file_code))",
+    "CREATE TABLE file_access ("
+    "id INTEGER NOT NULL, file_code VARCHAR(6), access_type VARCHAR(10), ip_address VARCHAR(45), "
+    "user_agent TEXT, access_time DATETIME, country VARCHAR(100), city VARCHAR(100), PRIMARY KEY (id))",
+)
+
+# id, код, имя, файл на диске, содержимое, владелец, активен, дата загрузки
+BASELINE_FILES = [
+    (1, "aaaaaa", "%D0%9E%D1%82%D1%87%D0%B5%D1%82.pdf", "u1.pdf", b"one", 10, 1, "2024-03-01 10:00:00.000000"),
+    (2, "bbbbbb", "report.txt", "u2.txt", b"one", 10, 1, "2024-03-01 11:00:00.000000"),
+    (3, "cccccc", "old.bin", "u3.bin", b"gone!", 20, 0, "2024-03-02 09:00:00.000000"),
+    (4, "dddddd", "anon.txt", "u4.txt", b"anon", None, 1, "2024-03-02 12:00:00.000000"),
+]
+BASELINE_ACCESS = [
+    ("aaaaaa", "visit", "2024-03-01 12:00:00.000000"),
+    ("aaaaaa", "visit", "2024-03-01 12:30:00.000000"),
+    ("aaaaaa", "download", "2024-03-01 13:00:00.000000"),
+    ("bbbbbb", "download", "2024-03-02 10:00:00.000000"),
+]
+
+
+def _sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def engine(workdir):
+    engine = create_engine(f"sqlite:///{workdir / 'droply.db'}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def legacy_engine(engine, workdir):
+    os.makedirs(workdir / "api" / "files", exist_ok=True)
+    with engine.begin() as conn:
+        for ddl in BASELINE_DDL:
+            conn.exec_driver_sql(ddl)
+        for id_, code, name, stored, data, user_id, active, uploaded in BASELINE_FILES:
+            (workdir / "api" / "files" / stored).write_bytes(data)
+            conn.exec_driver_sql(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, 1, 1, ?)",
+                (id_, code, name, stored, len(data), user_id, uploaded, active),
+            )
+        conn.exec_driver_sql(
+            "INSERT INTO file_access (file_code, access_type, ip_address, user_agent, access_time, country, city) "
+            "VALUES (?, ?, '8.8.8.8', 'ua', ?, '', '')",
+            BASELINE_ACCESS,
+        )
+    return engine
+
+
+def _migrate(engine):
+    # как api/database.py: create_all досоздаёт новые таблицы, остальное — миграции
+    Base.metadata.create_all(bind=engine)
+    return upgrade(engine)
+
+
+@pytest.mark.parametrize("legacy", [False, True], ids=["fresh", "legacy"])
+def test_hot_queries_use_indexes(request, legacy):
+    engine = request.getfixturevalue("legacy_engine" if legacy else "engine")
+    _migrate(engine)
+
+    with engine.connect() as conn:
+        assert check_query_plans(conn) == {}
+        for name, (sql, params, index) in HOT_QUERIES.items():
+            plan = plan_of(conn, sql, params)
+            assert "USING INDEX" in plan or "USING COVERING INDEX" in plan, f"{name}: {plan}"
+
+
+def test_upgrade_is_idempotent(engine):
+    assert _migrate(engine)
+    assert upgrade(engine) == []
+
+
+def test_legacy_upgrade_contents(legacy_engine, workdir):
+    _migrate(legacy_engine)
+    with legacy_engine.connect() as conn:
+        def rows(sql):
+            return conn.exec_driver_sql(sql).fetchall()
+
+        # блобы по sha256: два файла с одинаковым содержимым — один блоб с двумя ссылками
+        files = {r[0]: r[1:] for r in rows(
+            "SELECT file_code, stored_filename, original_filename, deleted_at IS NOT NULL FROM files")}
+        assert files["aaaaaa"][0] == files["bbbbbb"][0] == _sha(b"one")
+        assert files["aaaaaa"][1] == "Отчет.pdf"          # миграция 7
+        assert rows("SELECT file_id, original_filename FROM filename_decodes") == [
+            (1, "%D0%9E%D1%82%D1%87%D0%B5%D1%82.pdf")]
+        assert files["cccccc"][2] == 1 and files["aaaaaa"][2] == 0
+        blobs = {r[0]: (r[1], r[2]) for r in rows("SELECT digest, refcount, released_at IS NOT NULL FROM blobs")}
+        assert blobs == {_sha(b"one"): (2, 0), _sha(b"gone!"): (0, 1), _sha(b"anon"): (1, 0)}
+        for digest in blobs:
+            assert (workdir / "api" / "files" / digest).is_file()
+        assert not (workdir / "api" / "files" / "u1.pdf").exists()
+
+        assert dict((r[0], (r[1], r[2])) for r in rows("SELECT file_code, visits, downloads FROM file_counters")) == {
+            "aaaaaa": (2, 1), "bbbbbb": (0, 1),
+        }
+
+        days = {r[0][:10]: r[1:] for r in rows(
+            "SELECT bucket, uploads, upload_bytes, deletes, visits, downloads FROM stats_rollup "
+            "WHERE granularity = 'day'")}
+        assert days["2024-03-01"] == (2, 6, 0, 2, 1)
+        # удаление cccccc: миграция 3 идёт раньше колонки deleted_at — бакет загрузки
+        assert days["2024-03-02"] == (2, 9, 1, 0, 1)
+        hours = rows("SELECT SUM(uploads), SUM(visits), SUM(downloads) FROM stats_rollup WHERE granularity = 'hour'")
+        assert tuple(hours[0]) == (4, 2, 2)
+
+        assert dict((r[0], (r[1], r[2])) for r in rows(
+            "SELECT user_id, used_bytes, file_count FROM user_quotas WHERE file_count > 0")) == {10: (6, 2)}
+
+        fts = {r[0]: r[1] for r in rows("SELECT file_code, name FROM files_fts")}
+        assert fts == {"aaaaaa": "Отчет.pdf", "bbbbbb": "report.txt", "dddddd": "anon.txt"}